@@ -1,20 +1,72 @@
 import os
+import json
+import time
+import hashlib
+import pathlib
 import sqlite3
 import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from flask import Flask, g, jsonify, redirect, request, render_template, url_for, flash, session
+import re
+import random
+import threading
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import Flask, Response, g, has_app_context, stream_with_context, jsonify, redirect, request, render_template, send_file, url_for, flash, session
+from flask.signals import before_render_template, template_rendered
+from authors import author_key, author_quotes, find_author, get_author, init_authors, list_authors
+from backup import BackupManager
+from change_hub import ChangeHub
+from group_commit import GroupCommitter
+from metrics import MetricsRegistry, configure_slow_log, instrumented_connection, redact_params, redact_sql, statement_labels
+from outbox import OutboxWorkerPool, SMTPSession, enqueue_email, init_outbox
+from quote_archive import QuoteArchive
+from quote_cards import CardCache, CardRenderer, CardService
+from rate_limit import ConcurrencyLimiter, TokenBucketLimiter
+from retention import RetentionJob, init_retention
+from snapshot_publish import SnapshotPublisher, is_payload
+from static_build import is_built, send_asset
+from dedup import exact_fingerprint, find_exact, find_pending_exact, find_similar, index_quote, init_dedup
 
 # Configurazione percorso database
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATABASE = os.path.join(BASE_DIR, 'quotes.db')  # Assicurati che il file esista
-QUOTES_FOLDER = os.path.join(BASE_DIR, 'quotes_files')
+DATABASE = os.environ.get('DATABASE_PATH', os.path.join(BASE_DIR, 'quotes.db'))  # Assicurati che il file esista
+QUOTES_FOLDER = os.environ.get('QUOTES_FOLDER', os.path.join(BASE_DIR, 'quotes_files'))
+QUOTES_ARCHIVE_DIR = os.path.join(QUOTES_FOLDER, 'archive')  # Archivio a segmenti del testo delle citazioni
+# File statici con hash e precompressi generati da static_build.py (usati se presenti)
+STATIC_BUILD_DIR = os.environ.get('STATIC_BUILD_DIR', os.path.join(BASE_DIR, 'static_build'))
+# File statici pubblicati con l'elenco delle frasi validate (quotes.<hash>.json + .gz/.br e manifest)
+QUOTES_SNAPSHOT_DIR = os.environ.get('QUOTES_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'static', 'snapshot'))
+
+# Chiave delle sessioni condivisa da tutti i worker e stabile tra i riavvii: SECRET_KEY oppure un
+# file generato al primo avvio (creato con link atomico, vince il primo processo che ci arriva)
+SECRET_KEY_FILE = os.environ.get('SECRET_KEY_FILE', os.path.join(QUOTES_FOLDER, '.secret_key'))
+
+def load_secret_key():
+    key = os.environ.get('SECRET_KEY', '')
+    if key:
+        return key
+    os.makedirs(os.path.dirname(SECRET_KEY_FILE), exist_ok=True)
+    if not os.path.exists(SECRET_KEY_FILE):
+        tmp_path = f"{SECRET_KEY_FILE}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.write(fd, secrets.token_hex(32).encode('ascii'))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        try:
+            os.link(tmp_path, SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(SECRET_KEY_FILE, 'r') as f:
+        return f.read().strip()
 
 # Creazione app Flask
 app = Flask(__name__, static_folder='static')
-app.config['DEBUG'] = True
-app.config['SECRET_KEY'] = secrets.token_hex(16)
+app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', '0') == '1'
+app.config['SECRET_KEY'] = load_secret_key()
 
 # Configurazione email da variabili d'ambiente o valori predefiniti
 EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.example.com')
@@ -23,88 +75,942 @@ EMAIL_USER = os.environ.get('EMAIL_USER', 'your_email@example.com')
 EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD', 'your_password')
 EMAIL_FROM = os.environ.get('EMAIL_FROM', 'noreply@example.com')
 SITE_URL = os.environ.get('SITE_URL', 'http://localhost:5001')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '1') != '0'  # 0 per server SMTP locali di test senza STARTTLS
+
+# Archivio del testo delle citazioni: fsync ogni N record o ogni N secondi
+ARCHIVE_SEGMENT_SIZE = int(os.environ.get('ARCHIVE_SEGMENT_SIZE', 64 * 1024 * 1024))
+ARCHIVE_FSYNC_EVERY = int(os.environ.get('ARCHIVE_FSYNC_EVERY', 32))
+ARCHIVE_FSYNC_INTERVAL = float(os.environ.get('ARCHIVE_FSYNC_INTERVAL', 1.0))
+
+# Configurazione coda email (outbox)
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 2))  # Thread di invio per processo
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 6))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', 30))  # Secondi prima del primo nuovo tentativo
 
 # Configurazione admin da variabili d'ambiente o valori predefiniti
 ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'password')  # Cambia questa password in produzione!
 
+# Configurazione SQLite: journal WAL e pragma applicati a ogni connessione del pool
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 8))  # Connessioni inattive tenute per tipo
+SQLITE_PRAGMAS = {
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # millisecondi
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -16000)),  # negativo = KiB
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024)),
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+
+# Intervallo (secondi) entro cui lo snapshot delle frasi validate viene servito senza ricontrollare il database
+QUOTES_CACHE_TTL = float(os.environ.get('QUOTES_CACHE_TTL', 1.0))
+
+# Versioni precedenti dei file statici mantenute e livello di compressione brotli (0-11). Lo snapshot
+# si ricomprime a ogni approvazione: con 50.000 frasi la qualità 11 richiede ~20 s, la 5 mezzo secondo
+SNAPSHOT_KEEP_VERSIONS = int(os.environ.get('SNAPSHOT_KEEP_VERSIONS', 3))
+SNAPSHOT_BROTLI_QUALITY = int(os.environ.get('SNAPSHOT_BROTLI_QUALITY', 5))
+
+# Paginazione e streaming dell'API pubblica
+QUOTES_PAGE_DEFAULT = 100
+QUOTES_PAGE_MAX = 1000
+QUOTES_STREAM_BATCH = 500
+AUTHORS_PAGE_DEFAULT = 100
+AUTHORS_PAGE_MAX = 1000
+
+# Feed delle modifiche (/api/quotes/changes): modifiche per risposta, conservazione dei tombstone
+CHANGES_PAGE_DEFAULT = 500
+CHANGES_PAGE_MAX = 5000
+CHANGES_TOMBSTONE_TTL = int(os.environ.get('CHANGES_TOMBSTONE_TTL', 30 * 24 * 3600))
+
+# Stream SSE: controllo del database, heartbeat e modifiche recenti tenute in memoria per worker
+SSE_POLL_INTERVAL = float(os.environ.get('SSE_POLL_INTERVAL', 0.25))
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+SSE_BUFFER_SIZE = int(os.environ.get('SSE_BUFFER_SIZE', 1000))
+
+# Controllo di ammissione per /submit e /conferma, condiviso tra i worker (file in RATE_LIMIT_DIR).
+# Token bucket: richieste al minuto/ora e raffica massima; 0 disattiva il limite.
+# I limiti per IP valgono per un'intera sala dietro lo stesso NAT (tutto il pubblico di una serata
+# che invia insieme): il limite per persona è quello per indirizzo email
+RATE_LIMIT_DIR = os.environ.get('RATE_LIMIT_DIR', os.path.join(QUOTES_FOLDER, 'ratelimit'))
+SUBMIT_IP_PER_MINUTE = float(os.environ.get('SUBMIT_IP_PER_MINUTE', 60))
+SUBMIT_IP_BURST = int(os.environ.get('SUBMIT_IP_BURST', 200))
+SUBMIT_EMAIL_PER_HOUR = float(os.environ.get('SUBMIT_EMAIL_PER_HOUR', 10))
+SUBMIT_EMAIL_BURST = int(os.environ.get('SUBMIT_EMAIL_BURST', 5))
+CONFIRM_IP_PER_MINUTE = float(os.environ.get('CONFIRM_IP_PER_MINUTE', 120))
+CONFIRM_IP_BURST = int(os.environ.get('CONFIRM_IP_BURST', 200))
+WRITE_CONCURRENCY = int(os.environ.get('WRITE_CONCURRENCY', 8))  # Scritture contemporanee su tutti i worker
+WRITE_RETRY_AFTER = 2  # Secondi suggeriti quando il limite di concorrenza è pieno
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', '0') == '1'  # IP da X-Forwarded-For
+
+# Commit di gruppo per /submit e /conferma (group_commit.py): le scritture di richieste contemporanee
+# finiscono nella stessa transazione, al massimo WRITE_BEHIND_BATCH per volta, attendendo al massimo
+# WRITE_BEHIND_DELAY secondi. WRITE_BEHIND_SYNCHRONOUS: FULL (fsync a ogni commit) o NORMAL
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', '0') == '1'
+WRITE_BEHIND_BATCH = int(os.environ.get('WRITE_BEHIND_BATCH', 256))
+WRITE_BEHIND_DELAY = float(os.environ.get('WRITE_BEHIND_DELAY', 0.002))
+WRITE_BEHIND_SYNCHRONOUS = os.environ.get('WRITE_BEHIND_SYNCHRONOUS', 'FULL')
+WRITE_BEHIND_TIMEOUT = 30  # Secondi di attesa massima del commit per una richiesta
+
+# Backup a caldo (backup.py): snapshot ogni BACKUP_INTERVAL secondi (0 = solo da riga di comando),
+# conservati gli ultimi BACKUP_KEEP. Il database si copia BACKUP_PAGES pagine alla volta, con una pausa
+# di BACKUP_STEP_SLEEP secondi tra due blocchi
+BACKUP_DIR = os.environ.get('BACKUP_DIR', os.path.join(QUOTES_FOLDER, 'backups'))
+BACKUP_INTERVAL = int(os.environ.get('BACKUP_INTERVAL', 24 * 3600))
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', 256))
+BACKUP_STEP_SLEEP = float(os.environ.get('BACKUP_STEP_SLEEP', 0.005))
+
+# Card PNG delle frasi (quote_cards.py): cache su disco fino a CARD_CACHE_MAX_MB; le dimensioni di
+# CARD_SIZES sono disegnate in anticipo per ogni frase approvata o modificata (la prima è la predefinita)
+CARD_CACHE_DIR = os.environ.get('CARD_CACHE_DIR', os.path.join(QUOTES_FOLDER, 'cards'))
+CARD_CACHE_MAX_MB = int(os.environ.get('CARD_CACHE_MAX_MB', 256))
+CARD_SIZES = [
+    tuple(int(n) for n in size.strip().split('x'))
+    for size in os.environ.get('CARD_SIZES', '1200x630,1920x1080').split(',') if size.strip()
+]
+CARD_MIN_SIZE = 200  # Pixel, per lato
+CARD_MAX_SIZE = 3840
+CARD_RENDER_WORKERS = int(os.environ.get('CARD_RENDER_WORKERS', 2))  # Thread di rendering per worker
+CARD_RENDER_TIMEOUT = 10  # Secondi di attesa di una card non ancora pronta
+CARD_MAX_AGE = 300  # Cache-Control delle card (poi si rivalida con l'ETag)
+CARD_LOGO = os.path.join(BASE_DIR, 'static', 'logo-rotary-palermo-teatro-del-sole-and-the-magic.png')
+CARD_FONT = os.environ.get('CARD_FONT')  # File TTF; predefinito DejaVu Sans, se installato
+
+# Pulizia periodica (retention.py): un solo worker per intervallo; TTL in secondi, 0 disattiva il passo
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))  # 0 = nessun job in background
+UNCONFIRMED_TTL = int(os.environ.get('UNCONFIRMED_TTL', 7 * 24 * 3600))  # Invii mai confermati
+CONFIRMED_TTL = int(os.environ.get('CONFIRMED_TTL', 30 * 24 * 3600))  # Invii confermati ancora in coda
+RETENTION_CONFIRMED_MODE = os.environ.get('RETENTION_CONFIRMED_MODE', 'archive')  # 'archive' o 'purge'
+OUTBOX_RETENTION = int(os.environ.get('OUTBOX_RETENTION', 14 * 24 * 3600))  # Email inviate o fallite
+
+# Citazioni in attesa mostrate per pagina nella dashboard
+PENDING_PAGE_SIZE = int(os.environ.get('PENDING_PAGE_SIZE', 20))
+
+# Moderazione massiva: numero massimo di id per richiesta
+BULK_MAX_IDS = int(os.environ.get('BULK_MAX_IDS', 5000))
+BULK_CHUNK = 500  # Id per singola query IN (...)
+
+# Metriche Prometheus su /metrics, sommate tra i worker tramite i file in METRICS_DIR.
+# Soglie del log delle richieste e delle query lente in millisecondi (0 lo disattiva)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(QUOTES_FOLDER, 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # Se impostato, /metrics richiede "Authorization: Bearer <token>"
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_LOG_FILE = os.environ.get('SLOW_LOG_FILE', '')  # Vuoto = log dell'applicazione
+
+# Playlist lato server per i display (/api/quotes/next)
+PLAYLIST_MAX_DISPLAYS = int(os.environ.get('PLAYLIST_MAX_DISPLAYS', 256))
+PLAYLIST_RECENT_COUNT = int(os.environ.get('PLAYLIST_RECENT_COUNT', 10))  # Quante frasi recenti favorire
+PLAYLIST_RECENT_WEIGHT = int(os.environ.get('PLAYLIST_RECENT_WEIGHT', 3))  # Peso delle frasi recenti
+PLAYLIST_ADVANCE_RETRIES = 3  # Tentativi di avanzamento senza transazione prima di quello completo
+
 # Configurazione manutenzione
 MAINTENANCE_MODE = False  # Modalità manutenzione attiva/disattiva
 MAINTENANCE_MESSAGE = "Torneremo online presto!"  # Messaggio personalizzabile
-MAINTENANCE_CONFIG_FILE = os.path.join(BASE_DIR, 'maintenance_config.json')  # File di configurazione
+MAINTENANCE_CONFIG_FILE = os.path.join(BASE_DIR, 'maintenance_config.json')  # File di configurazione, condiviso da tutti i worker
+MAINTENANCE_CHECK_INTERVAL = float(os.environ.get('MAINTENANCE_CHECK_INTERVAL', 0.5))  # Secondi tra due controlli del file
+MAINTENANCE_VERSION = 0  # Incrementato a ogni salvataggio
+
+_maintenance_stamp = None
+_maintenance_checked_at = 0.0
+_maintenance_page = None
 
 # Carica configurazione manutenzione se esiste
 def load_maintenance_config():
-    global MAINTENANCE_MODE, MAINTENANCE_MESSAGE
+    global MAINTENANCE_MODE, MAINTENANCE_MESSAGE, MAINTENANCE_VERSION
     if os.path.exists(MAINTENANCE_CONFIG_FILE):
         try:
-            import json
             with open(MAINTENANCE_CONFIG_FILE, 'r') as f:
                 config = json.load(f)
                 MAINTENANCE_MODE = config.get('maintenance_mode', False)
                 MAINTENANCE_MESSAGE = config.get('maintenance_message', MAINTENANCE_MESSAGE)
+                MAINTENANCE_VERSION = config.get('version', 0)
         except Exception as e:
             app.logger.error(f"Errore caricamento configurazione manutenzione: {str(e)}")
+            return False
+    return True
 
 # Salva configurazione manutenzione
 def save_maintenance_config():
+    global MAINTENANCE_VERSION
     try:
-        import json
-        with open(MAINTENANCE_CONFIG_FILE, 'w') as f:
-            json.dump({
-                'maintenance_mode': MAINTENANCE_MODE,
-                'maintenance_message': MAINTENANCE_MESSAGE
-            }, f)
+        MAINTENANCE_VERSION += 1
+        data = json.dumps({
+            'maintenance_mode': MAINTENANCE_MODE,
+            'maintenance_message': MAINTENANCE_MESSAGE,
+            'version': MAINTENANCE_VERSION
+        })
+        # Scrittura atomica: gli altri worker non leggono mai un file a metà
+        tmp_path = f"{MAINTENANCE_CONFIG_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        try:
+            os.replace(tmp_path, MAINTENANCE_CONFIG_FILE)
+        except OSError:
+            # Il file montato direttamente come volume Docker non può essere sostituito
+            os.remove(tmp_path)
+            with open(MAINTENANCE_CONFIG_FILE, 'w') as f:
+                f.write(data)
     except Exception as e:
         app.logger.error(f"Errore salvataggio configurazione manutenzione: {str(e)}")
 
+# Ricarica lo stato se il file è cambiato (un solo stat ogni MAINTENANCE_CHECK_INTERVAL secondi)
+def refresh_maintenance_state():
+    global _maintenance_stamp, _maintenance_checked_at
+    now = time.monotonic()
+    if now - _maintenance_checked_at < MAINTENANCE_CHECK_INTERVAL:
+        return
+    _maintenance_checked_at = now
+    try:
+        st = os.stat(MAINTENANCE_CONFIG_FILE)
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+        stamp = None
+    if stamp != _maintenance_stamp and load_maintenance_config():
+        _maintenance_stamp = stamp
+
+# Pagina 503 renderizzata una sola volta per ogni messaggio
+def maintenance_response():
+    global _maintenance_page
+    page = _maintenance_page
+    if page is None or page[0] != MAINTENANCE_MESSAGE:
+        body = render_template('maintenance.html', message=MAINTENANCE_MESSAGE).encode('utf-8')
+        page = _maintenance_page = (MAINTENANCE_MESSAGE, body)
+    resp = Response(page[1], status=503, mimetype='text/html')
+    resp.headers['Cache-Control'] = 'no-store'
+    resp.headers['Retry-After'] = '60'
+    return resp
+
+# Strumentazione: durata e codice di risposta per rotta, tempo passato in SQLite, nei template e in SMTP
+metrics = MetricsRegistry(METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL)
+metrics.describe('http_requests_total', 'counter', 'Richieste HTTP per metodo, rotta e codice di risposta')
+metrics.describe('http_request_duration_seconds', 'histogram', 'Durata delle richieste HTTP fino all\'invio degli header')
+metrics.describe('sqlite_query_duration_seconds', 'histogram', 'Durata delle query SQLite per istruzione e tabella')
+metrics.describe('template_render_duration_seconds', 'histogram', 'Durata del rendering dei template')
+metrics.describe('smtp_send_duration_seconds', 'histogram', 'Durata degli invii SMTP della coda email per esito')
+slow_log = configure_slow_log(SLOW_LOG_FILE)
+
+def observe_sql(sql, params, seconds):
+    metrics.observe('sqlite_query_duration_seconds', statement_labels(sql), seconds)
+    if has_app_context():
+        g._sql_time = g.get('_sql_time', 0.0) + seconds
+        g._sql_count = g.get('_sql_count', 0) + 1
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        slow_log.warning(
+            f"Query lenta {seconds * 1000:.1f} ms: {redact_sql(sql)[:500]} parametri={redact_params(params)}"
+        )
+
+def observe_smtp(seconds, result):
+    metrics.observe('smtp_send_duration_seconds', (('result', result),), seconds)
+
+_sql_factory = instrumented_connection(observe_sql) if METRICS_ENABLED else sqlite3.Connection
+
+def _template_started(sender, template, context, **extra):
+    if has_app_context():
+        g._template_started = time.perf_counter()
+
+def _template_finished(sender, template, context, **extra):
+    started = g.pop('_template_started', None) if has_app_context() else None
+    if started is not None:
+        seconds = time.perf_counter() - started
+        metrics.observe('template_render_duration_seconds', (('template', template.name or ''),), seconds)
+        g._template_time = g.get('_template_time', 0.0) + seconds
+
+if METRICS_ENABLED:
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+# Registrato prima degli altri hook: misura anche le risposte della modalità manutenzione.
+# Per le risposte in streaming (NDJSON, SSE) la durata si ferma all'invio degli header
+@app.before_request
+def start_request_metrics():
+    if METRICS_ENABLED:
+        metrics.start()
+        g._request_started = time.perf_counter()
+
+def _record_request(status):
+    started = g.pop('_request_started', None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.inc('http_requests_total', (('method', request.method), ('route', route), ('status', str(status))))
+    metrics.observe('http_request_duration_seconds', (('method', request.method), ('route', route)), seconds)
+    if SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS:
+        slow_log.warning(
+            f"Richiesta lenta {seconds * 1000:.1f} ms: {request.method} {route} -> {status} "
+            f"(sql {g.get('_sql_time', 0.0) * 1000:.1f} ms in {g.get('_sql_count', 0)} query, "
+            f"template {g.get('_template_time', 0.0) * 1000:.1f} ms)"
+        )
+
+@app.after_request
+def record_request_metrics(response):
+    _record_request(response.status_code)
+    return response
+
+# Eccezione non gestita: after_request non viene chiamato
+@app.teardown_request
+def record_failed_request(exception):
+    _record_request(500)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metriche disattivate"}), 404
+    if METRICS_TOKEN and not secrets.compare_digest(
+        request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"
+    ):
+        return jsonify({"error": "Non autorizzato"}), 401
+    try:
+        body = metrics.render()
+    except OSError as e:
+        app.logger.error(f"Errore lettura metriche: {str(e)}")
+        return jsonify({"error": "Metriche non disponibili"}), 503
+    resp = Response(body, mimetype='text/plain')
+    resp.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
 # Middleware per la modalità manutenzione
 @app.before_request
 def check_maintenance():
+    refresh_maintenance_state()
     # Bypass per admin login e pagine statiche necessarie
     if MAINTENANCE_MODE:
         # Esclusioni: permettere sempre l'accesso all'admin e ai file CSS/JS statici
-        if not request.path.startswith('/admin') and not request.path.startswith('/static/css') and not request.path.startswith('/static/js'):
+        if not request.path.startswith('/admin') and not request.path.startswith('/static/css') and not request.path.startswith('/static/js') and request.path not in ('/metrics', '/healthz'):
             # Sempre permetti l'accesso alla pagina di login admin
             if request.path != '/admin' and request.path != '/admin/login':
-                return render_template('maintenance.html', message=MAINTENANCE_MESSAGE), 503
+                return maintenance_response()
 
 @app.route('/')
 def root():
+    # Con il build la pagina usa URL assoluti e può essere servita direttamente, senza redirect
+    if is_built(STATIC_BUILD_DIR):
+        return send_asset(STATIC_BUILD_DIR, 'index.html')
     return redirect('/static/index.html')
 
+# File statici: prima il build (cache immutabile, varianti .br/.gz, Range), poi la cartella static/.
+# /static/snapshot/ viene da QUOTES_SNAPSHOT_DIR con le stesse regole: payload con hash immutabili,
+# manifest sempre rivalidato
+def serve_static(filename):
+    if filename.startswith('snapshot/'):
+        name = filename[len('snapshot/'):]
+        resp = send_asset(QUOTES_SNAPSHOT_DIR, name, immutable=is_payload(name))
+        return resp if resp is not None else app.send_static_file(filename)
+    resp = send_asset(STATIC_BUILD_DIR, filename)
+    if resp is None:
+        return app.send_static_file(filename)
+    return resp
+
+app.view_functions['static'] = serve_static
+
 # Gestione connessione SQLite
+# Connessioni di lunga durata riusate tra le richieste: una coda di scrittura e una di sola lettura
+# per processo. In WAL i lettori non aspettano mai chi scrive.
+def connect_db(readonly=False):
+    if readonly:
+        db = sqlite3.connect(f"{pathlib.Path(DATABASE).as_uri()}?mode=ro", uri=True, check_same_thread=False,
+                             factory=_sql_factory)
+    else:
+        db = sqlite3.connect(DATABASE, check_same_thread=False, factory=_sql_factory)
+    db.row_factory = sqlite3.Row
+    for name, value in SQLITE_PRAGMAS.items():
+        db.execute(f"PRAGMA {name} = {value}")
+    if readonly:
+        db.execute("PRAGMA query_only = 1")
+    return db
+
+_db_pool = {False: [], True: []}
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+
+def _acquire_db(readonly):
+    global _db_pool_pid
+    with _db_pool_lock:
+        if _db_pool_pid != os.getpid():
+            # Dopo un fork le connessioni del processo padre non vanno riutilizzate
+            _db_pool[False], _db_pool[True] = [], []
+            _db_pool_pid = os.getpid()
+        if _db_pool[readonly]:
+            return _db_pool[readonly].pop()
+    return connect_db(readonly)
+
+def _release_db(db, readonly):
+    if db.in_transaction:
+        db.rollback()
+    with _db_pool_lock:
+        if _db_pool_pid == os.getpid() and len(_db_pool[readonly]) < SQLITE_POOL_SIZE:
+            _db_pool[readonly].append(db)
+            return
+    db.close()
+
+# Chiude le connessioni inattive del processo corrente (es. prima del fork dei worker)
+def close_db_pool():
+    global _watch_db
+    with _db_pool_lock:
+        for db in _db_pool[False] + _db_pool[True]:
+            db.close()
+        _db_pool[False], _db_pool[True] = [], []
+    if _watch_db is not None and _watch_db[0] == os.getpid():
+        _watch_db[1].close()
+    _watch_db = None
+
+# Connessione di scrittura per la richiesta corrente
 def get_db():
-    app.logger.debug(f"Opening SQLite database at: {DATABASE}")
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = _acquire_db(False)
+    return db
+
+# Connessione di sola lettura per la richiesta corrente
+def get_read_db():
+    db = getattr(g, '_read_database', None)
+    if db is None:
+        db = g._read_database = _acquire_db(True)
     return db
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
+    if db is not None:
+        _release_db(db, False)
+    db = g.pop('_read_database', None)
     if db is not None:
-        db.close()
+        _release_db(db, True)
+
+# Snapshot immutabile e già serializzato delle frasi validate, uno per worker
+# ids: id in ordine crescente (array compatto), items: id -> JSON della singola frase,
+# recent: id delle ultime PLAYLIST_RECENT_COUNT frasi approvate (pesi della playlist)
+QuotesSnapshot = namedtuple('QuotesSnapshot', ['version', 'body', 'etag', 'ids', 'items', 'recent'])
+
+_snapshot_lock = threading.Lock()
+_quotes_snapshot = None
+_snapshot_checked_at = 0.0
+_watch_db = None
+_watch_data_version = None
+
+# Connessione dedicata del worker per rilevare le modifiche (PRAGMA data_version)
+def _get_watch_db():
+    global _watch_db, _watch_data_version
+    if _watch_db is None or _watch_db[0] != os.getpid():
+        # Dopo un fork la connessione del processo padre non va riutilizzata
+        _watch_db = (os.getpid(), connect_db(readonly=True))
+        _watch_data_version = None
+    return _watch_db[1]
+
+# Legge il contatore di versione aggiornato dai trigger sulla tabella quotes
+def _read_quotes_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM quotes_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else 0
+
+def _build_quotes_snapshot(conn, version):
+    rows = conn.execute(
+        'SELECT id, text, author FROM quotes WHERE validated = 1 ORDER BY id'
+    ).fetchall()
+    items = {}
+    for r in rows:
+        items[r[0]] = json.dumps(
+            dict(id=r[0], text=r[1], author=r[2]), ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+    body = b'[' + b','.join(items.values()) + b']'
+    try:
+        recent = frozenset(r[0] for r in conn.execute(
+            'SELECT quote_id FROM quote_approvals ORDER BY seq DESC LIMIT ?', (PLAYLIST_RECENT_COUNT,)
+        ).fetchall())
+    except sqlite3.OperationalError:
+        recent = frozenset()
+    return QuotesSnapshot(version, body, hashlib.sha1(body).hexdigest(), array('q', items), items, recent)
+
+# Restituisce lo snapshot corrente, ricostruendolo solo se le frasi validate sono cambiate
+def get_quotes_snapshot():
+    global _quotes_snapshot, _snapshot_checked_at, _watch_data_version
+    snapshot = _quotes_snapshot
+    if snapshot is not None and time.monotonic() - _snapshot_checked_at < QUOTES_CACHE_TTL:
+        return snapshot
+
+    with _snapshot_lock:
+        snapshot = _quotes_snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - _snapshot_checked_at < QUOTES_CACHE_TTL:
+            return snapshot
+
+        conn = _get_watch_db()
+        # data_version cambia solo se un'altra connessione (anche di un altro worker) ha fatto commit
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if snapshot is None or data_version != _watch_data_version:
+            version = _read_quotes_version(conn)
+            if snapshot is None or version is None or version != snapshot.version:
+                snapshot = _quotes_snapshot = _build_quotes_snapshot(conn, version)
+            _watch_data_version = data_version
+        _snapshot_checked_at = now
+        return snapshot
+
+# Forza il controllo dello snapshot alla prossima richiesta (dopo una scrittura locale)
+def invalidate_quotes_snapshot():
+    global _snapshot_checked_at
+    _snapshot_checked_at = 0.0
+
+# Dopo una scrittura che tocca le frasi validate: aggiorna lo snapshot e ripubblica i file statici
+def publish_quotes_snapshot():
+    invalidate_quotes_snapshot()
+    card_service.notify()
+    snapshot = get_quotes_snapshot()
+    try:
+        snapshot_publisher.publish(snapshot.body, snapshot.version, len(snapshot.ids))
+    except OSError as e:
+        # Il database resta la fonte di verità: /api/quotes continua a rispondere
+        app.logger.error(f"Errore pubblicazione file statici delle frasi: {str(e)}")
+
+# Playlist dei display condivise da tutti i worker: ordine del giro corrente (array di id) in
+# display_playlist_orders, posizione in display_playlists. Una richiesta aggiorna solo la posizione;
+# l'ordine si riscrive (con un nuovo rev) solo a ogni nuovo giro o quando cambiano le frasi validate
+PLAYLISTS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS display_playlists (
+    display TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    rev INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS display_playlist_orders (
+    display TEXT PRIMARY KEY,
+    ids BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quote_approvals (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    quote_id INTEGER NOT NULL UNIQUE
+);
+CREATE TRIGGER IF NOT EXISTS quote_approvals_insert AFTER INSERT ON quotes
+WHEN NEW.validated = 1
+BEGIN
+    INSERT INTO quote_approvals (quote_id) VALUES (NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS quote_approvals_update AFTER UPDATE OF validated ON quotes
+WHEN OLD.validated IS NOT NEW.validated
+BEGIN
+    DELETE FROM quote_approvals WHERE quote_id = NEW.id;
+    INSERT INTO quote_approvals (quote_id) SELECT NEW.id WHERE NEW.validated = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS quote_approvals_delete AFTER DELETE ON quotes
+WHEN OLD.validated = 1
+BEGIN
+    DELETE FROM quote_approvals WHERE quote_id = OLD.id;
+END;
+'''
+
+# Ordine di approvazione in quote_approvals (seq crescente); alla prima esecuzione le frasi già
+# validate prendono l'ordine dell'ultima modifica nel log (quote_changes), poi l'id
+def init_playlists(db):
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='quote_approvals'"
+    ).fetchone()
+    seed = '''
+    INSERT INTO quote_approvals (quote_id)
+    SELECT id FROM quotes WHERE validated = 1
+    ORDER BY (SELECT seq FROM quote_changes WHERE quote_id = quotes.id), id;
+    ''' if not exists else ''
+    db.executescript('BEGIN IMMEDIATE;' + PLAYLISTS_SCHEMA + seed + 'COMMIT;')
+
+# Pesi di estrazione: le ultime PLAYLIST_RECENT_COUNT frasi approvate pesano di più
+def _playlist_weight(snapshot, quote_id):
+    return max(1, PLAYLIST_RECENT_WEIGHT) if quote_id in snapshot.recent else 1
+
+# Nuovo giro senza ripetizioni: shuffle pesato (chiave random ** (1 / peso))
+def _playlist_shuffle(snapshot):
+    keyed = [(random.random() ** (1.0 / _playlist_weight(snapshot, i)), i) for i in snapshot.ids]
+    keyed.sort(reverse=True)
+    return array('q', (i for _, i in keyed))
+
+# Le frasi approvate dopo la creazione dell'ordine entrano nella parte ancora da mostrare del giro;
+# quelle eliminate restano nell'ordine e vengono saltate in lettura
+def _playlist_sync(order, pos, snapshot):
+    known = set(order)
+    added = [i for i in snapshot.ids if i not in known]
+    random.shuffle(added)
+    for quote_id in added:
+        remaining = len(order) - pos
+        if _playlist_weight(snapshot, quote_id) > 1:
+            # Le frasi appena approvate compaiono presto
+            remaining = min(remaining, PLAYLIST_RECENT_COUNT)
+        order.insert(pos + random.randint(0, remaining), quote_id)
+    return bool(added)
+
+# Pool per estrazione con ripetizione (nessuno stato per display): ogni id compare tante volte
+# quanto il suo peso. Uno per worker, ricostruito a ogni nuovo snapshot
+_playlist_pool = (None, None)
+
+def _random_playlist_quote(snapshot):
+    global _playlist_pool
+    built_for, pool = _playlist_pool
+    if built_for is not snapshot:
+        pool = array('q', (i for i in snapshot.ids for _ in range(_playlist_weight(snapshot, i))))
+        _playlist_pool = (snapshot, pool)
+    return pool[random.randrange(len(pool))]
+
+# Ordini già letti dal database, per display: (rev, array). Si rileggono solo quando rev cambia.
+# Gli array in cache non vengono mai modificati: chi deve cambiare l'ordine ne fa una copia
+_playlist_orders = OrderedDict()
+_playlist_orders_lock = threading.Lock()
+
+def _cached_playlist_order(display, rev):
+    with _playlist_orders_lock:
+        cached = _playlist_orders.get(display)
+        if cached is None or cached[0] != rev:
+            return None
+        _playlist_orders.move_to_end(display)
+        return cached[1]
+
+def _load_playlist_order(db, display, rev):
+    order = _cached_playlist_order(display, rev)
+    if order is not None:
+        return order
+    row = db.execute("SELECT ids FROM display_playlist_orders WHERE display = ?", (display,)).fetchone()
+    order = array('q')
+    if row is not None:
+        order.frombytes(row[0])
+    _cache_playlist_order(display, rev, order)
+    return order
+
+def _cache_playlist_order(display, rev, order):
+    with _playlist_orders_lock:
+        _playlist_orders[display] = (rev, order)
+        _playlist_orders.move_to_end(display)
+        while len(_playlist_orders) > PLAYLIST_MAX_DISPLAYS:
+            _playlist_orders.popitem(last=False)
+
+# Caso comune: ordine già in cache e nessuna frase cambiata dall'ultima richiesta. Nessuna transazione
+# esplicita né copia dell'ordine: si legge la posizione e la si avanza con un solo UPDATE condizionato
+# a rev e pos letti; se un'altra richiesta dello stesso display è passata prima si riprova.
+# None se serve il percorso completo (display nuovo, frasi cambiate, fine del giro)
+def _advance_playlist(db, display, snapshot):
+    for _ in range(PLAYLIST_ADVANCE_RETRIES):
+        # fetchall: nessuna lettura lasciata aperta prima dell'UPDATE
+        rows = db.execute(
+            "SELECT version, rev, pos FROM display_playlists WHERE display = ?", (display,)
+        ).fetchall()
+        if not rows or rows[0]['version'] != (snapshot.version or 0):
+            return None
+        version, rev, start = rows[0]
+        order = _cached_playlist_order(display, rev)
+        if order is None:
+            return None
+        pos = start
+        while pos < len(order):
+            candidate = order[pos]
+            pos += 1
+            if candidate in snapshot.items:
+                break
+        else:
+            return None
+        cursor = db.execute(
+            "UPDATE display_playlists SET pos = ?, used_at = ? WHERE display = ? AND rev = ? AND pos = ?",
+            (pos, time.time(), display, rev, start)
+        )
+        db.commit()
+        if cursor.rowcount:
+            return candidate
+    return None
+
+# Prossima frase per il display indicato: (snapshot, id), con lo snapshot usato per la risposta.
+# Fuori dal caso comune lettura e avanzamento della posizione stanno nella stessa transazione
+# IMMEDIATE: due richieste dello stesso display su worker diversi non ricevono mai la stessa frase
+# nello stesso giro
+def next_playlist_quote(db, display, snapshot, no_repeat=True):
+    if not snapshot.ids:
+        return snapshot, None
+    if not no_repeat:
+        return snapshot, _random_playlist_quote(snapshot)
+
+    quote_id = _advance_playlist(db, display, snapshot)
+    if quote_id is not None:
+        return snapshot, quote_id
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        row = db.execute(
+            "SELECT version, rev, pos FROM display_playlists WHERE display = ?", (display,)
+        ).fetchone()
+        if row is not None and snapshot.version is not None and row['version'] > snapshot.version:
+            # Un altro worker ha già visto frasi più recenti: lo snapshot di questo worker è indietro
+            invalidate_quotes_snapshot()
+            snapshot = get_quotes_snapshot()
+
+        rewrite = row is None
+        if row is None:
+            order, pos = _playlist_shuffle(snapshot), 0
+            db.execute(
+                "DELETE FROM display_playlists WHERE display IN "
+                "(SELECT display FROM display_playlists ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (PLAYLIST_MAX_DISPLAYS - 1,)
+            )
+            db.execute(
+                "DELETE FROM display_playlist_orders WHERE display NOT IN (SELECT display FROM display_playlists)"
+            )
+        else:
+            order, pos = _load_playlist_order(db, display, row['rev']), row['pos']
+            if row['version'] != (snapshot.version or 0):
+                order = array('q', order)  # L'array in cache resta intatto
+                rewrite = _playlist_sync(order, pos, snapshot)
+
+        # Al massimo un giro completo di frasi eliminate da saltare
+        quote_id = None
+        for _ in range(2):
+            while pos < len(order):
+                candidate = order[pos]
+                pos += 1
+                if candidate in snapshot.items:
+                    quote_id = candidate
+                    break
+            if quote_id is not None:
+                break
+            order, pos, rewrite = _playlist_shuffle(snapshot), 0, True
+
+        if rewrite:
+            rev = random.getrandbits(62)
+            db.execute(
+                "INSERT OR REPLACE INTO display_playlist_orders (display, ids) VALUES (?, ?)",
+                (display, order.tobytes())
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO display_playlists (display, version, rev, pos, used_at) VALUES (?, ?, ?, ?, ?)",
+                (display, snapshot.version or 0, rev, pos, time.time())
+            )
+            _cache_playlist_order(display, rev, order)
+        else:
+            db.execute(
+                "UPDATE display_playlists SET version = ?, pos = ?, used_at = ? WHERE display = ?",
+                (snapshot.version or 0, pos, time.time(), display)
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return snapshot, quote_id
+
+# Pagina di frasi validate con paginazione keyset (?after_id=&limit=)
+def _quotes_page(after_id):
+    limit = request.args.get('limit', QUOTES_PAGE_DEFAULT, type=int)
+    limit = max(1, min(limit, QUOTES_PAGE_MAX))
+    rows = get_read_db().execute(
+        'SELECT id, text, author FROM quotes WHERE validated = 1 AND id > ? ORDER BY id LIMIT ?',
+        (after_id, limit)
+    ).fetchall()
+    quotes = [dict(id=r['id'], text=r['text'], author=r['author']) for r in rows]
+    return jsonify({
+        "quotes": quotes,
+        "next_after_id": quotes[-1]['id'] if len(quotes) == limit else None
+    })
+
+# Streaming NDJSON: una frase per riga, letta dal cursore a blocchi senza caricare tutta la tabella
+def _quotes_stream(after_id):
+    def generate():
+        cur = get_read_db().execute(
+            'SELECT id, text, author FROM quotes WHERE validated = 1 AND id > ? ORDER BY id',
+            (after_id,)
+        )
+        while True:
+            rows = cur.fetchmany(QUOTES_STREAM_BATCH)
+            if not rows:
+                break
+            yield ''.join(
+                json.dumps(dict(id=r['id'], text=r['text'], author=r['author']), ensure_ascii=False) + '\n'
+                for r in rows
+            )
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Compatta il log: i tombstone più vecchi di CHANGES_TOMBSTONE_TTL vengono eliminati e
+# compacted_seq ricorda fin dove; un client fermo prima di quel punto deve risincronizzarsi.
+# Eseguita dal job di pulizia periodica (retention.py, extra_tasks)
+def compact_quote_changes(db, ttl=None):
+    ttl = CHANGES_TOMBSTONE_TTL if ttl is None else ttl
+    row = db.execute(
+        "SELECT MAX(seq) FROM quote_changes WHERE op = 'delete' AND changed_at < ?",
+        (time.time() - ttl,)
+    ).fetchone()
+    if row[0] is None:
+        return 0
+    cur = db.execute("DELETE FROM quote_changes WHERE op = 'delete' AND seq <= ?", (row[0],))
+    db.execute(
+        "UPDATE quote_changes_state SET compacted_seq = MAX(compacted_seq, ?) WHERE id = 1",
+        (row[0],)
+    )
+    db.commit()
+    return cur.rowcount
+
+# Modifiche alle frasi validate dopo la sequenza since: upsert con la frase corrente,
+# delete come tombstone con il solo id. La compattazione elimina solo tombstone, quindi since=0
+# restituisce sempre l'elenco completo. Se since è precedente alla compattazione (o successivo
+# all'ultima modifica, es. database ripristinato) il risultato è resync: il client svuota la sua
+# copia e riparte da since=0
+def read_quote_changes(db, since, limit):
+    state = db.execute(
+        "SELECT compacted_seq, (SELECT IFNULL(MAX(seq), 0) FROM quote_changes) FROM quote_changes_state WHERE id = 1"
+    ).fetchone()
+    compacted_seq, last_seq = state[0], max(state[0], state[1])
+    if since < 0 or 0 < since < compacted_seq or since > last_seq:
+        return {"resync": True, "seq": 0, "changes": [], "more": False}
+
+    rows = db.execute(
+        "SELECT c.seq, c.op, c.quote_id, q.text, q.author FROM quote_changes c "
+        "LEFT JOIN quotes q ON q.id = c.quote_id WHERE c.seq > ? ORDER BY c.seq LIMIT ?",
+        (since, limit)
+    ).fetchall()
+    changes = []
+    for r in rows:
+        if r['op'] == 'upsert' and r['text'] is not None:
+            changes.append(dict(seq=r['seq'], op='upsert', quote=dict(id=r['quote_id'], text=r['text'], author=r['author'])))
+        else:
+            changes.append(dict(seq=r['seq'], op='delete', id=r['quote_id']))
+    return {
+        "resync": False,
+        "seq": rows[-1]['seq'] if rows else since,
+        "changes": changes,
+        "more": len(rows) == limit
+    }
+
+@app.route('/api/quotes/changes')
+def get_quote_changes():
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', CHANGES_PAGE_DEFAULT, type=int)
+    limit = max(1, min(limit, CHANGES_PAGE_MAX))
+    resp = jsonify(read_quote_changes(get_read_db(), since, limit))
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+# Eventi in tempo reale (Server-Sent Events) per i display: le modifiche arrivano appena approvate.
+# ?since=<seq> per la prima connessione, poi il browser riprende da Last-Event-ID
+@app.route('/api/quotes/stream')
+def stream_quote_changes():
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('since', type=int)
+    change_hub.start()
+    resp = Response(stream_with_context(change_hub.stream(last_id)), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # nginx: niente buffering della risposta
+    return resp
 
 # Endpoint API che restituisce solo le frasi validate
 @app.route('/api/quotes')
 def get_quotes():
-    # Verifica esistenza tabella
-    cur = get_db().execute(
-        "SELECT name FROM sqlite_master WHERE type='table' AND name='quotes';"
-    )
-    if cur.fetchone() is None:
-        app.logger.error("Table 'quotes' not found in the database!")
+    after_id = request.args.get('after_id', 0, type=int)
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        return _quotes_stream(after_id)
+    if 'after_id' in request.args or 'limit' in request.args:
+        return _quotes_page(after_id)
+
+    try:
+        snapshot = get_quotes_snapshot()
+    except sqlite3.OperationalError as e:
+        app.logger.error(f"Errore lettura tabella 'quotes': {str(e)}")
         return jsonify({"error": "Table 'quotes' non trovata"}), 500
 
-    # Seleziona solo le frasi con validated = 1
-    rows = get_db().execute(
-        'SELECT id, text, author FROM quotes WHERE validated = 1'
-    ).fetchall()
+    # ETag forte sul contenuto: uguale su tutti i worker, 304 se il client ha già questa versione
+    resp = Response(snapshot.body, mimetype='application/json')
+    resp.set_etag(snapshot.etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp.make_conditional(request)
+
+# Endpoint per i display: una sola frase per rotazione, secondo la playlist del display
+@app.route('/api/quotes/next')
+def get_next_quote():
+    display = request.args.get('display', 'default')[:64]
+    no_repeat = request.args.get('no_repeat', '1') != '0'
+    try:
+        snapshot = get_quotes_snapshot()
+    except sqlite3.OperationalError as e:
+        app.logger.error(f"Errore lettura tabella 'quotes': {str(e)}")
+        return jsonify({"error": "Table 'quotes' non trovata"}), 500
+
+    try:
+        snapshot, quote_id = next_playlist_quote(get_db(), display, snapshot, no_repeat)
+    except sqlite3.OperationalError as e:
+        # Playlist bloccata oltre busy_timeout: il display riprova al prossimo giro
+        app.logger.warning(f"Playlist del display {display!r} non disponibile: {str(e)}")
+        resp = jsonify({"error": "Playlist momentaneamente non disponibile"})
+        resp.status_code = 503
+        resp.headers['Retry-After'] = '1'
+        return resp
+    if quote_id is None:
+        return jsonify({"error": "Nessuna frase disponibile"}), 404
+
+    resp = Response(snapshot.items[quote_id], mimetype='application/json')
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+# Autori con almeno una frase validata, in ordine alfabetico. ?q= filtra per inizio del nome
+# (senza distinzione di maiuscole e accenti); paginazione keyset con ?after=<next_after>
+@app.route('/api/authors')
+def get_authors():
+    limit = request.args.get('limit', AUTHORS_PAGE_DEFAULT, type=int)
+    limit = max(1, min(limit, AUTHORS_PAGE_MAX))
+    rows = list_authors(get_read_db(), request.args.get('after'), request.args.get('q'), limit)
+    return jsonify({
+        "authors": [dict(id=r['id'], name=r['name'], quotes=r['validated_count']) for r in rows],
+        "next_after": rows[-1]['key'] if len(rows) == limit else None
+    })
+
+# Frasi validate di un autore, per id crescente (?after_id=<next_after_id>&limit=<n>)
+@app.route('/api/authors/<int:author_id>/quotes')
+def get_author_quotes(author_id):
+    db = get_read_db()
+    author = get_author(db, author_id)
+    if author is None or author['validated_count'] == 0:
+        return jsonify({"error": "Autore non trovato"}), 404
+    limit = request.args.get('limit', QUOTES_PAGE_DEFAULT, type=int)
+    limit = max(1, min(limit, QUOTES_PAGE_MAX))
+    rows = author_quotes(db, author_id, request.args.get('after_id', 0, type=int), limit)
     quotes = [dict(id=r['id'], text=r['text'], author=r['author']) for r in rows]
-    return jsonify(quotes)
+    return jsonify({
+        "author": dict(id=author['id'], name=author['name'], quotes=author['validated_count']),
+        "quotes": quotes,
+        "next_after_id": quotes[-1]['id'] if len(quotes) == limit else None
+    })
+
+# Card PNG di una frase validata (?w=&h=, predefinita la prima di CARD_SIZES). L'ETag è la chiave
+# della cache (contenuto e dimensioni): il 304 non tocca il disco. A regime la card è già pronta;
+# altrimenti la richiesta attende il pool di rendering, condividendo il lavoro con le altre
+@app.route('/api/quotes/<int:quote_id>/card.png')
+def get_quote_card(quote_id):
+    if not card_service.available:
+        return jsonify({"error": "Immagini non disponibili: Pillow non è installato"}), 503
+    width = request.args.get('w', CARD_SIZES[0][0], type=int)
+    height = request.args.get('h', CARD_SIZES[0][1], type=int)
+    if not (CARD_MIN_SIZE <= width <= CARD_MAX_SIZE and CARD_MIN_SIZE <= height <= CARD_MAX_SIZE):
+        return jsonify({"error": f"Dimensioni ammesse: da {CARD_MIN_SIZE} a {CARD_MAX_SIZE} pixel per lato"}), 400
+    try:
+        snapshot = get_quotes_snapshot()
+    except sqlite3.OperationalError as e:
+        app.logger.error(f"Errore lettura tabella 'quotes': {str(e)}")
+        return jsonify({"error": "Table 'quotes' non trovata"}), 500
+
+    item = snapshot.items.get(quote_id)
+    if item is None:
+        return jsonify({"error": "Frase non trovata"}), 404
+    quote = json.loads(item)
+    key = card_cache.key(quote['text'], quote['author'], width, height)
+    if request.if_none_match.contains(key):
+        resp = Response(status=304)
+    else:
+        try:
+            path = card_service.ensure(quote['text'], quote['author'], width, height)[1].result(CARD_RENDER_TIMEOUT)
+        except FutureTimeoutError:
+            resp = jsonify({"error": "Immagine in preparazione, riprovare"})
+            resp.headers['Retry-After'] = '2'
+            return resp, 503
+        except Exception as e:
+            app.logger.error(f"Errore rendering card {quote_id}: {str(e)}")
+            return jsonify({"error": "Errore nella generazione dell'immagine"}), 500
+        resp = send_file(path, mimetype='image/png', etag=False, conditional=False)
+    resp.set_etag(key)
+    resp.headers['Cache-Control'] = f'public, max-age={CARD_MAX_AGE}'
+    return resp
 
 # Inizializzazione
 def init_db():
@@ -115,6 +1021,17 @@ def init_db():
     # Crea le tabelle se non esistono
     with app.app_context():
         db = get_db()
+        # Il journal mode WAL è persistente nel file: basta impostarlo una volta all'avvio
+        mode = db.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}").fetchone()[0]
+        app.logger.debug(f"SQLite journal mode: {mode}")
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS quotes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            author TEXT NOT NULL,
+            validated INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
         # Crea la tabella quotes_da_validare se non esiste
         db.execute('''
         CREATE TABLE IF NOT EXISTS quotes_da_validare (
@@ -126,19 +1043,210 @@ def init_db():
             token_validazione TEXT UNIQUE NOT NULL
         )
         ''')
+        # Contatore di versione delle frasi validate, incrementato dai trigger
+        db.executescript('''
+        CREATE TABLE IF NOT EXISTS quotes_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT OR IGNORE INTO quotes_version (id, version) VALUES (1, 0);
+        CREATE INDEX IF NOT EXISTS idx_quotes_validated_id ON quotes (validated, id);
+        CREATE TRIGGER IF NOT EXISTS quotes_version_insert AFTER INSERT ON quotes
+        WHEN NEW.validated = 1
+        BEGIN
+            UPDATE quotes_version SET version = version + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS quotes_version_update AFTER UPDATE ON quotes
+        WHEN OLD.validated = 1 OR NEW.validated = 1
+        BEGIN
+            UPDATE quotes_version SET version = version + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS quotes_version_delete AFTER DELETE ON quotes
+        WHEN OLD.validated = 1
+        BEGIN
+            UPDATE quotes_version SET version = version + 1 WHERE id = 1;
+        END;
+        ''')
         db.commit()
+        init_counters(db)
+        init_changes(db)
+        init_playlists(db)
+        init_fts(db)
+        init_outbox(db)
+        init_dedup(db)
+        init_retention(db)
+        init_authors(db)
+    publish_quotes_snapshot()
+
+COUNTERS_SCHEMA = '''
+CREATE INDEX IF NOT EXISTS idx_quotes_da_validare_status_id ON quotes_da_validare (email_checked, id);
+CREATE TABLE IF NOT EXISTS quote_counters (
+    tbl TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tbl, status)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS quote_counters_quotes_insert AFTER INSERT ON quotes
+BEGIN
+    INSERT INTO quote_counters (tbl, status, total) VALUES ('quotes', NEW.validated, 1)
+    ON CONFLICT (tbl, status) DO UPDATE SET total = total + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS quote_counters_quotes_delete AFTER DELETE ON quotes
+BEGIN
+    UPDATE quote_counters SET total = total - 1 WHERE tbl = 'quotes' AND status = OLD.validated;
+END;
+CREATE TRIGGER IF NOT EXISTS quote_counters_quotes_update AFTER UPDATE OF validated ON quotes
+WHEN OLD.validated IS NOT NEW.validated
+BEGIN
+    UPDATE quote_counters SET total = total - 1 WHERE tbl = 'quotes' AND status = OLD.validated;
+    INSERT INTO quote_counters (tbl, status, total) VALUES ('quotes', NEW.validated, 1)
+    ON CONFLICT (tbl, status) DO UPDATE SET total = total + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS quote_counters_pending_insert AFTER INSERT ON quotes_da_validare
+BEGIN
+    INSERT INTO quote_counters (tbl, status, total) VALUES ('pending', IFNULL(NEW.email_checked, 0), 1)
+    ON CONFLICT (tbl, status) DO UPDATE SET total = total + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS quote_counters_pending_delete AFTER DELETE ON quotes_da_validare
+BEGIN
+    UPDATE quote_counters SET total = total - 1
+    WHERE tbl = 'pending' AND status = IFNULL(OLD.email_checked, 0);
+END;
+CREATE TRIGGER IF NOT EXISTS quote_counters_pending_update AFTER UPDATE OF email_checked ON quotes_da_validare
+WHEN IFNULL(OLD.email_checked, 0) != IFNULL(NEW.email_checked, 0)
+BEGIN
+    UPDATE quote_counters SET total = total - 1
+    WHERE tbl = 'pending' AND status = IFNULL(OLD.email_checked, 0);
+    INSERT INTO quote_counters (tbl, status, total) VALUES ('pending', IFNULL(NEW.email_checked, 0), 1)
+    ON CONFLICT (tbl, status) DO UPDATE SET total = total + 1;
+END;
+'''
+
+# Totali per stato tenuti esatti dai trigger: la dashboard non esegue COUNT(*) sulle tabelle.
+# Chiave (tabella, stato): validated per quotes, email_checked per quotes_da_validare
+def init_counters(db):
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='quote_counters'"
+    ).fetchone()
+    # Conteggio iniziale sui dati esistenti solo alla prima esecuzione, nella stessa transazione
+    # che crea i trigger: nessuna scrittura concorrente può andare persa
+    seed = '''
+    INSERT OR REPLACE INTO quote_counters (tbl, status, total)
+    SELECT 'quotes', validated, COUNT(*) FROM quotes GROUP BY validated;
+    INSERT OR REPLACE INTO quote_counters (tbl, status, total)
+    SELECT 'pending', IFNULL(email_checked, 0), COUNT(*) FROM quotes_da_validare GROUP BY IFNULL(email_checked, 0);
+    ''' if not exists else ''
+    db.executescript('BEGIN IMMEDIATE;' + COUNTERS_SCHEMA + seed + 'COMMIT;')
+
+# Log delle modifiche alle frasi validate per la sincronizzazione incrementale dei client.
+# Ogni frase ha al massimo una voce (l'ultima modifica): il log non cresce oltre il numero di frasi
+# più i tombstone delle eliminazioni, che vengono compattati dopo CHANGES_TOMBSTONE_TTL
+CHANGES_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS quote_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    quote_id INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    changed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_quote_changes_quote ON quote_changes (quote_id);
+CREATE TABLE IF NOT EXISTS quote_changes_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    compacted_seq INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO quote_changes_state (id, compacted_seq) VALUES (1, 0);
+CREATE TRIGGER IF NOT EXISTS quote_changes_insert AFTER INSERT ON quotes
+WHEN NEW.validated = 1
+BEGIN
+    DELETE FROM quote_changes WHERE quote_id = NEW.id;
+    INSERT INTO quote_changes (quote_id, op, changed_at) VALUES (NEW.id, 'upsert', (julianday('now') - 2440587.5) * 86400.0);
+END;
+CREATE TRIGGER IF NOT EXISTS quote_changes_update AFTER UPDATE OF text, author, validated ON quotes
+WHEN NEW.validated = 1 OR OLD.validated = 1
+BEGIN
+    DELETE FROM quote_changes WHERE quote_id = OLD.id;
+    INSERT INTO quote_changes (quote_id, op, changed_at)
+    VALUES (NEW.id, CASE WHEN NEW.validated = 1 THEN 'upsert' ELSE 'delete' END, (julianday('now') - 2440587.5) * 86400.0);
+END;
+CREATE TRIGGER IF NOT EXISTS quote_changes_delete AFTER DELETE ON quotes
+WHEN OLD.validated = 1
+BEGIN
+    DELETE FROM quote_changes WHERE quote_id = OLD.id;
+    INSERT INTO quote_changes (quote_id, op, changed_at) VALUES (OLD.id, 'delete', (julianday('now') - 2440587.5) * 86400.0);
+END;
+'''
+
+def init_changes(db):
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='quote_changes'"
+    ).fetchone()
+    # Alla prima esecuzione il log parte con tutte le frasi validate: since=0 equivale a un download completo
+    seed = '''
+    INSERT INTO quote_changes (quote_id, op, changed_at)
+    SELECT id, 'upsert', (julianday('now') - 2440587.5) * 86400.0 FROM quotes
+    WHERE validated = 1 AND id NOT IN (SELECT quote_id FROM quote_changes) ORDER BY id;
+    ''' if not exists else ''
+    db.executescript('BEGIN IMMEDIATE;' + CHANGES_SCHEMA + seed + 'COMMIT;')
 
-# Funzione per inviare email di conferma
-def send_confirmation_email(email, token, nome_completo):
+# Totali per stato: {stato: numero} per la tabella indicata ('quotes' o 'pending')
+def get_counts(db, tbl):
+    return {
+        r[0]: r[1] for r in db.execute(
+            "SELECT status, total FROM quote_counters WHERE tbl = ?", (tbl,)
+        ).fetchall()
+    }
+
+# Indice full-text sincronizzato dai trigger; costruito una sola volta sui dati esistenti.
+# remove_diacritics rende la ricerca insensibile agli accenti ("citta" trova "città").
+# Il trigger di inserimento non scatta finché quotes_fts_deferred contiene una riga: vedi fts_defer()
+def init_fts(db):
+    global _fts_enabled
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='quotes_fts'"
+    ).fetchone()
+    trigger = db.execute(
+        "SELECT sql FROM sqlite_master WHERE type='trigger' AND name='quotes_fts_insert'"
+    ).fetchone()
+    # Trigger della versione precedente, senza la condizione sulle importazioni
+    upgrade = 'DROP TRIGGER quotes_fts_insert;' if trigger and 'quotes_fts_deferred' not in trigger[0] else ''
     try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_FROM
-        msg['To'] = email
-        msg['Subject'] = "Conferma la tua citazione"
-        
-        link = f"{SITE_URL}/conferma?token={token}"
-        
-        body = f"""
+        db.executescript(upgrade + '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts USING fts5(
+            text, author,
+            content='quotes', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        );
+        CREATE TABLE IF NOT EXISTS quotes_fts_deferred (id INTEGER PRIMARY KEY CHECK (id = 1));
+        CREATE TRIGGER IF NOT EXISTS quotes_fts_insert AFTER INSERT ON quotes
+        WHEN NOT EXISTS (SELECT 1 FROM quotes_fts_deferred)
+        BEGIN
+            INSERT INTO quotes_fts (rowid, text, author) VALUES (NEW.id, NEW.text, NEW.author);
+        END;
+        CREATE TRIGGER IF NOT EXISTS quotes_fts_delete AFTER DELETE ON quotes
+        BEGIN
+            INSERT INTO quotes_fts (quotes_fts, rowid, text, author) VALUES ('delete', OLD.id, OLD.text, OLD.author);
+        END;
+        CREATE TRIGGER IF NOT EXISTS quotes_fts_update AFTER UPDATE OF text, author ON quotes
+        BEGIN
+            INSERT INTO quotes_fts (quotes_fts, rowid, text, author) VALUES ('delete', OLD.id, OLD.text, OLD.author);
+            INSERT INTO quotes_fts (rowid, text, author) VALUES (NEW.id, NEW.text, NEW.author);
+        END;
+        ''')
+        if not exists:
+            db.execute("INSERT INTO quotes_fts (quotes_fts) VALUES ('rebuild')")
+        db.commit()
+        _fts_enabled = True
+    except sqlite3.OperationalError as e:
+        # SQLite compilato senza FTS5: la dashboard continua a usare LIKE
+        db.rollback()
+        _fts_enabled = False
+        app.logger.warning(f"Indice full-text non disponibile: {str(e)}")
+
+# Testo dell'email di conferma (oggetto, corpo)
+def build_confirmation_email(token, nome_completo):
+    link = f"{SITE_URL}/conferma?token={token}"
+    
+    body = f"""
         Ciao {nome_completo},
         
         Grazie per aver condiviso una citazione con noi.
@@ -150,19 +1258,138 @@ def send_confirmation_email(email, token, nome_completo):
         
         Grazie!
         """
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASSWORD)
-        server.send_message(msg)
-        server.quit()
-        
-        return True
-    except Exception as e:
-        app.logger.error(f"Errore invio email: {str(e)}")
-        return False
+    
+    return "Conferma la tua citazione", body
+
+# Sessione SMTP riusata da ogni worker della coda email
+def create_smtp_session():
+    return SMTPSession(EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD, use_tls=EMAIL_USE_TLS)
+
+# Coda email persistente: /submit salva il messaggio, i worker in background lo consegnano
+outbox_pool = OutboxWorkerPool(
+    connect_db,
+    create_smtp_session,
+    EMAIL_FROM,
+    workers=OUTBOX_WORKERS,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    backoff_base=OUTBOX_BACKOFF_BASE,
+    on_send=observe_smtp
+)
+
+# Archivio append-only del testo delle citazioni inviate
+quote_archive = QuoteArchive(
+    QUOTES_ARCHIVE_DIR,
+    segment_size=ARCHIVE_SEGMENT_SIZE,
+    fsync_every=ARCHIVE_FSYNC_EVERY,
+    fsync_interval=ARCHIVE_FSYNC_INTERVAL
+)
+
+submit_ip_limiter = TokenBucketLimiter(
+    os.path.join(RATE_LIMIT_DIR, 'submit_ip.bin'), SUBMIT_IP_PER_MINUTE / 60, SUBMIT_IP_BURST
+)
+submit_email_limiter = TokenBucketLimiter(
+    os.path.join(RATE_LIMIT_DIR, 'submit_email.bin'), SUBMIT_EMAIL_PER_HOUR / 3600, SUBMIT_EMAIL_BURST
+)
+confirm_ip_limiter = TokenBucketLimiter(
+    os.path.join(RATE_LIMIT_DIR, 'confirm_ip.bin'), CONFIRM_IP_PER_MINUTE / 60, CONFIRM_IP_BURST
+)
+write_concurrency = ConcurrencyLimiter(os.path.join(RATE_LIMIT_DIR, 'write_slots.bin'), WRITE_CONCURRENCY)
+
+def client_ip():
+    if RATE_LIMIT_TRUST_PROXY and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or ''
+
+# Ammissione di una richiesta di scrittura, prima di qualsiasi lavoro su database o email.
+# Restituisce None se ammessa, altrimenti i secondi dopo cui riprovare (risposta 429)
+def admit_write(limits):
+    for limiter, key in limits:
+        allowed, wait = limiter.acquire(key)
+        if not allowed:
+            return max(1, int(wait + 0.999))
+    slot = write_concurrency.acquire()
+    if slot is None:
+        return WRITE_RETRY_AFTER
+    g._write_slot = slot
+    return None
+
+@app.teardown_request
+def release_write_slot(exception):
+    slot = g.pop('_write_slot', None)
+    if slot is not None:
+        write_concurrency.release(slot)
+
+def too_many_requests(retry_after, html=False):
+    message = "Troppe richieste, riprova tra qualche istante"
+    if html:
+        resp = Response(render_template('error.html', message=message), status=429, mimetype='text/html')
+    else:
+        resp = jsonify({"success": False, "error": message})
+        resp.status_code = 429
+    resp.headers['Retry-After'] = str(retry_after)
+    return resp
+
+change_hub = ChangeHub(
+    lambda: connect_db(readonly=True),
+    read_quote_changes,
+    poll_interval=SSE_POLL_INTERVAL,
+    heartbeat=SSE_HEARTBEAT,
+    buffer_size=SSE_BUFFER_SIZE
+)
+
+group_committer = GroupCommitter(
+    connect_db,
+    max_batch=WRITE_BEHIND_BATCH,
+    max_delay=WRITE_BEHIND_DELAY,
+    synchronous=WRITE_BEHIND_SYNCHRONOUS
+)
+
+# Pulizia periodica di invii scaduti, email consegnate, testi orfani e spazio libero del database
+retention_job = RetentionJob(
+    connect_db,
+    quote_archive,
+    QUOTES_FOLDER,
+    unconfirmed_ttl=UNCONFIRMED_TTL,
+    confirmed_ttl=CONFIRMED_TTL,
+    confirmed_mode=RETENTION_CONFIRMED_MODE,
+    outbox_ttl=OUTBOX_RETENTION,
+    interval=RETENTION_INTERVAL,
+    extra_tasks=[('changes_compacted', compact_quote_changes)]
+)
+
+@app.before_request
+def start_retention_job():
+    retention_job.start()
+
+# Card delle frasi: rendering in un pool di thread, in anticipo seguendo il log delle modifiche
+card_cache = CardCache(CARD_CACHE_DIR, CARD_CACHE_MAX_MB * 1024 * 1024)
+card_service = CardService(
+    card_cache,
+    CardRenderer(CARD_LOGO, CARD_FONT),
+    sizes=CARD_SIZES,
+    workers=CARD_RENDER_WORKERS,
+    connect=lambda: connect_db(readonly=True),
+    read_changes=read_quote_changes,
+    last_seq=lambda conn: conn.execute("SELECT IFNULL(MAX(seq), 0) FROM quote_changes").fetchone()[0]
+)
+
+# Snapshot periodici di database, configurazione della manutenzione e archivio dei testi
+backup_manager = BackupManager(
+    DATABASE,
+    BACKUP_DIR,
+    archive=quote_archive,
+    maintenance_config=MAINTENANCE_CONFIG_FILE,
+    keep=BACKUP_KEEP,
+    interval=BACKUP_INTERVAL,
+    pages=BACKUP_PAGES,
+    step_sleep=BACKUP_STEP_SLEEP
+)
+
+snapshot_publisher = SnapshotPublisher(
+    QUOTES_SNAPSHOT_DIR,
+    keep=SNAPSHOT_KEEP_VERSIONS,
+    brotli_quality=SNAPSHOT_BROTLI_QUALITY
+)
 
 # Endpoint per il form di inserimento delle citazioni
 @app.route('/submit', methods=['GET', 'POST'])
@@ -180,86 +1407,126 @@ def submit_quote():
     if not (nome and cognome and frase and email):
         return jsonify({"error": "Tutti i campi sono obbligatori"}), 400
     
+    # Limiti per IP e per indirizzo email, poi il limite di scritture contemporanee
+    retry_after = admit_write([
+        (submit_ip_limiter, client_ip()),
+        (submit_email_limiter, email.casefold())
+    ])
+    if retry_after is not None:
+        return too_many_requests(retry_after)
+    
     # Creazione nome completo
     nome_completo = f"{nome} {cognome}"
     
     # Generazione token univoco
     token = secrets.token_urlsafe(32)
     
-    # Salvataggio nel database
-    db = get_db()
+    # Salvataggio nel database (con WRITE_BEHIND nel prossimo commit di gruppo)
     try:
-        cursor = db.cursor()
-        cursor.execute(
-            "INSERT INTO quotes_da_validare (nome_completo, frase, email, token_validazione) VALUES (?, ?, ?, ?)",
-            (nome_completo, frase, email, token)
-        )
-        db.commit()
-        
-        # Recupera l'ID generato
-        quote_id = cursor.lastrowid
-        
-        # Salva la frase come file di testo
-        quote_file_path = os.path.join(QUOTES_FOLDER, f"quote_{quote_id}.txt")
-        with open(quote_file_path, 'w', encoding='utf-8') as f:
-            f.write(f"Autore: {nome_completo}\n\n{frase}")
-        
-        # Invia email di conferma
-        if send_confirmation_email(email, token, nome_completo):
-            return jsonify({
-                "success": True,
-                "message": "Citazione inviata! Controlla la tua email per confermarla."
-            })
-        else:
-            return jsonify({
-                "success": False,
-                "message": "Citazione salvata ma c'è stato un problema nell'invio dell'email. Contatta l'amministratore."
-            }), 500
-            
+        quote_id = run_write(lambda db: _insert_submission(db, nome_completo, frase, email, token))
     except Exception as e:
         app.logger.error(f"Errore salvataggio citazione: {str(e)}")
         return jsonify({"error": str(e)}), 500
-
-# Endpoint per la conferma via URL
-@app.route('/conferma')
-def confirm_quote():
-    token = request.args.get('token')
     
-    if not token:
-        return render_template('error.html', message="Token mancante")
+    # Citazione già pubblicata o già in attesa di conferma
+    if quote_id is None:
+        return jsonify({
+            "success": False,
+            "message": "Questa citazione è già stata inviata."
+        }), 409
     
-    db = get_db()
+    # Salva la frase nell'archivio. L'invio è già salvato nel database ed è in coda l'email: un errore
+    # dell'archivio (disco pieno, permessi) non deve far credere all'utente di dover inviare di nuovo
+    try:
+        quote_archive.append(quote_id, f"Autore: {nome_completo}\n\n{frase}")
+    except OSError as e:
+        app.logger.error(f"Errore archiviazione citazione {quote_id}: {str(e)}")
     
-    # Verifica il token
+    # L'invio avviene in background
+    outbox_pool.start()
+    outbox_pool.notify()
+    return jsonify({
+        "success": True,
+        "message": "Citazione inviata! Controlla la tua email per confermarla."
+    })
+
+# Nuovo invio con l'email di conferma in coda, nella stessa transazione. None se la citazione è già
+# pubblicata o in attesa (il controllo avviene nella transazione: vale anche tra invii dello stesso blocco)
+def _insert_submission(db, nome_completo, frase, email, token):
+    if find_exact(db, frase) or find_pending_exact(db, frase):
+        return None
+    cursor = db.execute(
+        "INSERT INTO quotes_da_validare (nome_completo, frase, email, token_validazione, fingerprint, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (nome_completo, frase, email, token, exact_fingerprint(frase), time.time())
+    )
+    quote_id = cursor.lastrowid
+    subject, body = build_confirmation_email(token, nome_completo)
+    enqueue_email(db, email, subject, body, quote_id=quote_id)
+    return quote_id
+
+# Conferma dell'invio con il token: lo segna come verificato e lo copia in quotes (validated = 0)
+# se non è già presente. None se il token non esiste
+def _confirm_submission(db, token):
     quote = db.execute(
         "SELECT id, nome_completo, frase FROM quotes_da_validare WHERE token_validazione = ?",
         (token,)
     ).fetchone()
-    
     if not quote:
-        return render_template('error.html', message="Token non valido o già utilizzato")
-    
-    try:
-        # Segna come verificato con email_checked = 3
-        db.execute(
-            "UPDATE quotes_da_validare SET email_checked = 3 WHERE id = ?",
-            (quote['id'],)
-        )
-        
-        # Copia nella tabella quotes con validated = 0
-        db.execute(
+        return None
+    db.execute("UPDATE quotes_da_validare SET email_checked = 3 WHERE id = ?", (quote[0],))
+    if not find_exact(db, quote[2]):
+        cursor = db.execute(
             "INSERT INTO quotes (text, author, validated) VALUES (?, ?, 0)",
-            (quote['frase'], quote['nome_completo'])
+            (quote[2], quote[1])
         )
-        
+        index_quote(db, cursor.lastrowid, quote[2])
+    return quote[1]
+
+# Esegue fn(db) e fa commit: con WRITE_BEHIND nel thread del commit di gruppo, altrimenti subito
+# sulla connessione della richiesta. Il risultato arriva solo a commit avvenuto.
+# Scaduta l'attesa, una scrittura ancora in coda viene annullata (non sarà mai salvata dopo la
+# risposta d'errore, e chi riprova non crea un doppione); se è già nel blocco in corso se ne aspetta l'esito
+def run_write(fn):
+    if WRITE_BEHIND:
+        future = group_committer.submit(fn)
+        try:
+            return future.result(WRITE_BEHIND_TIMEOUT)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise
+            return future.result()
+    db = get_db()
+    try:
+        result = fn(db)
         db.commit()
-        
-        return render_template('success.html', nome=quote['nome_completo'])
-        
-    except Exception as e:
+        return result
+    except Exception:
         db.rollback()
+        raise
+
+# Endpoint per la conferma via URL
+@app.route('/conferma')
+def confirm_quote():
+    token = request.args.get('token')
+    
+    if not token:
+        return render_template('error.html', message="Token mancante")
+    
+    retry_after = admit_write([(confirm_ip_limiter, client_ip())])
+    if retry_after is not None:
+        return too_many_requests(retry_after, html=True)
+    
+    try:
+        nome_completo = run_write(lambda db: _confirm_submission(db, token))
+    except Exception as e:
         app.logger.error(f"Errore conferma citazione: {str(e)}")
         return render_template('error.html', message=f"Errore durante la conferma: {str(e)}")
+    
+    if nome_completo is None:
+        return render_template('error.html', message="Token non valido o già utilizzato")
+    
+    return render_template('success.html', nome=nome_completo)
 
 # Admin login
 @app.route('/admin', methods=['GET', 'POST'])
@@ -319,61 +1586,172 @@ def admin_change_password():
     flash('Password aggiornata con successo', 'success')
     return redirect('/admin/dashboard')
 
+# Ricerca full-text (FTS5) su testo e autore delle frasi
+_fts_enabled = None
+
+def fts_available(db):
+    global _fts_enabled
+    if _fts_enabled is None:
+        _fts_enabled = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='quotes_fts'"
+        ).fetchone() is not None
+    return _fts_enabled
+
+# Importazioni massive: nella transazione del chiamante il trigger per riga resta fermo e
+# fts_index_from() indicizza tutte le righe nuove con una sola istruzione (circa cinque volte più
+# veloce). Nessuna modifica allo schema: le connessioni degli altri worker non devono ripreparare nulla
+def fts_defer(db):
+    if fts_available(db):
+        db.execute("INSERT OR IGNORE INTO quotes_fts_deferred (id) VALUES (1)")
+
+def fts_index_from(db, last_id):
+    if fts_available(db):
+        db.execute("DELETE FROM quotes_fts_deferred")
+        db.execute(
+            "INSERT INTO quotes_fts (rowid, text, author) SELECT id, text, author FROM quotes WHERE id > ?",
+            (last_id,)
+        )
+
+# Converte il testo cercato in una query FTS5: ogni parola è un prefisso, tutte obbligatorie
+def fts_match_query(search):
+    terms = re.findall(r'\w+', search)
+    return ' '.join(f'"{t}"*' for t in terms)
+
+# Paginazione keyset: al massimo per_page righe dopo (after) o prima (before) dell'id indicato,
+# nell'ordine di visualizzazione. Restituisce (righe, c'è una pagina precedente, c'è una successiva)
+def _keyset_page(db, select, key, where, params, per_page, after=None, before=None, descending=False):
+    forward, backward = ('<', '>') if descending else ('>', '<')
+    order, reverse = ('DESC', 'ASC') if descending else ('ASC', 'DESC')
+    if before is not None:
+        rows = db.execute(
+            f"{select} WHERE {where} AND {key} {backward} ? ORDER BY {key} {reverse} LIMIT ?",
+            params + [before, per_page + 1]
+        ).fetchall()
+        return rows[:per_page][::-1], len(rows) > per_page, True
+    cursor = f" AND {key} {forward} ?" if after is not None else ""
+    rows = db.execute(
+        f"{select} WHERE {where}{cursor} ORDER BY {key} {order} LIMIT ?",
+        params + ([after] if after is not None else []) + [per_page + 1]
+    ).fetchall()
+    return rows[:per_page], after is not None, len(rows) > per_page
+
 # Admin dashboard
 @app.route('/admin/dashboard')
 def admin_dashboard():
     if not session.get('admin_logged_in'):
         return redirect('/admin')
     
-    db = get_db()
+    db = get_read_db()
     
-    # Gestione delle citazioni in attesa
-    pending_quotes = db.execute(
-        "SELECT id, nome_completo, frase, email, email_checked FROM quotes_da_validare"
-    ).fetchall()
+    # Coda delle citazioni in attesa, dalla più vecchia, paginata per id
+    pending_status = request.args.get('pending_status', 'all')
+    pending_where = "1=1"
+    if pending_status == 'confirmed':
+        pending_where = "email_checked = 3"
+    elif pending_status == 'unconfirmed':
+        pending_where = "email_checked = 0"
+    pending_quotes, pending_prev, pending_next = _keyset_page(
+        db, "SELECT id, nome_completo, frase, email, email_checked FROM quotes_da_validare",
+        "id", pending_where, [], PENDING_PAGE_SIZE,
+        after=request.args.get('pending_after', type=int),
+        before=request.args.get('pending_before', type=int)
+    )
+    pending_counts = get_counts(db, 'pending')
     
     # Recupero parametri di filtro e paginazione per le frasi
     search = request.args.get('search', '')
     filter_status = request.args.get('filter_status', 'all')
+    author = request.args.get('author', '').strip()
     page = request.args.get('page', 1, type=int)
     per_page = 10  # Numero di elementi per pagina
     
     # Costruzione della query base con i filtri
-    query = "SELECT id, text, author, validated FROM quotes WHERE 1=1"
+    columns = "SELECT quotes.id, quotes.text, quotes.author, quotes.validated"
+    query = " FROM quotes WHERE 1=1"
     params = []
     
-    # Applica filtro di ricerca
-    if search:
-        query += " AND (text LIKE ? OR author LIKE ?)"
-        search_param = f"%{search}%"
-        params.extend([search_param, search_param])
-    
-    # Applica filtro per stato
+    # Applica filtro per stato; con il filtro per autore il "+" esclude l'indice sullo stato,
+    # meno selettivo di (author_key, id)
+    status_column = "+quotes.validated" if author else "quotes.validated"
     if filter_status == 'validated':
-        query += " AND validated = 1"
+        query += f" AND {status_column} = 1"
     elif filter_status == 'not_validated':
-        query += " AND validated = 0"
+        query += f" AND {status_column} = 0"
     
-    # Query per contare il totale dei risultati
-    count_query = query.replace("SELECT id, text, author, validated", "SELECT COUNT(*)")
-    total_count = db.execute(count_query, params).fetchone()[0]
+    quote_counts = get_counts(db, 'quotes')
     
-    # Calcola il numero totale di pagine
-    total_pages = (total_count + per_page - 1) // per_page
+    # Filtro per autore sull'indice (author_key, id); i totali vengono dai contatori dell'autore
+    author_row = None
+    if author:
+        author_row = find_author(db, author)
+        query += " AND quotes.author_key = ?"
+        params.append(author_key(author))
+        validated = author_row['validated_count'] if author_row else 0
+        quote_counts = {1: validated, 0: author_row['quotes_count'] - validated} if author_row else {}
+    prev_cursor = next_cursor = None
+    total_pages = 1
     
-    # Aggiungi ordinamento e paginazione
-    query += " ORDER BY id DESC LIMIT ? OFFSET ?"
-    offset = (page - 1) * per_page
-    params.extend([per_page, offset])
+    # Ricerca full-text: risultati per pertinenza, paginati per numero di pagina
+    match = fts_match_query(search) if search else None
+    if match and fts_available(db):
+        query = query.replace(" FROM quotes WHERE 1=1",
+                              " FROM quotes_fts JOIN quotes ON quotes.id = quotes_fts.rowid WHERE quotes_fts MATCH ?")
+        params.insert(0, match)
+        total_count = db.execute("SELECT COUNT(*)" + query, params).fetchone()[0]
+        total_pages = (total_count + per_page - 1) // per_page
+        query += " ORDER BY quotes_fts.rank, quotes.id DESC LIMIT ? OFFSET ?"
+        params.extend([per_page, (page - 1) * per_page])
+        quotes_list = db.execute(columns + query, params).fetchall()
+    else:
+        if search:
+            query += " AND (quotes.text LIKE ? OR quotes.author LIKE ?)"
+            search_param = f"%{search}%"
+            params.extend([search_param, search_param])
+            total_count = db.execute("SELECT COUNT(*)" + query, params).fetchone()[0]
+        elif filter_status == 'validated':
+            total_count = quote_counts.get(1, 0)
+        elif filter_status == 'not_validated':
+            total_count = quote_counts.get(0, 0)
+        else:
+            total_count = sum(quote_counts.values())
+        # Frasi dalla più recente, paginate per id sugli indici (validated, id) e sulla chiave primaria
+        where = query[len(" FROM quotes WHERE "):]
+        quotes_list, has_prev, has_next = _keyset_page(
+            db, columns + " FROM quotes", "quotes.id", where, params, per_page,
+            after=request.args.get('after', type=int),
+            before=request.args.get('before', type=int),
+            descending=True
+        )
+        if quotes_list:
+            prev_cursor = quotes_list[0]['id'] if has_prev else None
+            next_cursor = quotes_list[-1]['id'] if has_next else None
     
-    # Esegui la query con i filtri e la paginazione
-    quotes_list = db.execute(query, params).fetchall()
+    # Possibili duplicati, cercati nell'indice MinHash solo per le righe mostrate
+    duplicates = {
+        q['id']: [m[0] for m in find_similar(db, q['text'], exclude=q['id'])]
+        for q in quotes_list
+    }
+    pending_duplicates = {}
+    for q in pending_quotes:
+        # La copia identica creata alla conferma non conta come duplicato
+        same = set(find_exact(db, q['frase']))
+        pending_duplicates[q['id']] = [m[0] for m in find_similar(db, q['frase']) if m[0] not in same]
     
     return render_template('admin_dashboard.html', 
                            quotes=pending_quotes, 
+                           pending_status=pending_status,
+                           pending_counts=pending_counts,
+                           pending_prev=pending_quotes[0]['id'] if pending_prev and pending_quotes else None,
+                           pending_next=pending_quotes[-1]['id'] if pending_next and pending_quotes else None,
+                           prev_cursor=prev_cursor,
+                           next_cursor=next_cursor,
                            quotes_list=quotes_list,
+                           duplicates=duplicates,
+                           pending_duplicates=pending_duplicates,
                            search=search,
                            filter_status=filter_status,
+                           author=author,
+                           author_row=author_row,
                            page=page,
                            total_pages=total_pages,
                            total_count=total_count,
@@ -420,11 +1798,19 @@ def admin_approve_quote(quote_id):
         return jsonify({"error": "Citazione non trovata"}), 404
     
     try:
-        # Sposta nella tabella quotes
-        db.execute(
-            "INSERT INTO quotes (text, author, validated) VALUES (?, ?, 1)",
-            (quote['frase'], quote['nome_completo'])
-        )
+        # Sposta nella tabella quotes; se c'è già (es. copiata alla conferma) la pubblica e basta
+        existing = find_exact(db, quote['frase'])
+        if existing:
+            db.execute(
+                "UPDATE quotes SET validated = 1 WHERE id = ?",
+                (existing[0],)
+            )
+        else:
+            cursor = db.execute(
+                "INSERT INTO quotes (text, author, validated) VALUES (?, ?, 1)",
+                (quote['frase'], quote['nome_completo'])
+            )
+            index_quote(db, cursor.lastrowid, quote['frase'])
         
         # Elimina dalla tabella quotes_da_validare
         db.execute(
@@ -433,6 +1819,7 @@ def admin_approve_quote(quote_id):
         )
         
         db.commit()
+        publish_quotes_snapshot()
         
         return redirect('/admin/dashboard')
         
@@ -458,6 +1845,9 @@ def admin_reject_quote(quote_id):
         
         db.commit()
         
+        # Il testo archiviato verrà rimosso alla prossima compattazione
+        quote_archive.delete(quote_id)
+        
         return redirect('/admin/dashboard')
         
     except Exception as e:
@@ -482,13 +1872,19 @@ def admin_add_quote():
     
     db = get_db()
     
+    existing = find_exact(db, text)
+    if existing:
+        return jsonify({"error": f"Frase già presente (id {existing[0]})"}), 409
+    
     try:
-        db.execute(
+        cursor = db.execute(
             "INSERT INTO quotes (text, author, validated) VALUES (?, ?, ?)",
             (text, author, validated)
         )
+        index_quote(db, cursor.lastrowid, text)
         
         db.commit()
+        publish_quotes_snapshot()
         
         return redirect('/admin/dashboard')
         
@@ -513,12 +1909,18 @@ def admin_edit_quote(quote_id):
     db = get_db()
     
     try:
-        db.execute(
+        cursor = db.execute(
             "UPDATE quotes SET text = ?, author = ?, validated = ? WHERE id = ?",
             (text, author, validated, quote_id)
         )
+        # Frase eliminata nel frattempo: nessuna impronta orfana
+        if cursor.rowcount == 0:
+            db.rollback()
+            return jsonify({"error": "Citazione non trovata"}), 404
+        index_quote(db, quote_id, text)
         
         db.commit()
+        publish_quotes_snapshot()
         
         return redirect('/admin/dashboard')
         
@@ -542,6 +1944,7 @@ def admin_delete_quote(quote_id):
         )
         
         db.commit()
+        publish_quotes_snapshot()
         
         return redirect('/admin/dashboard')
         
@@ -550,36 +1953,171 @@ def admin_delete_quote(quote_id):
         app.logger.error(f"Errore eliminazione citazione: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-if __name__ == '__main__':
-    # Carica configurazione manutenzione
-    load_maintenance_config()
+# Righe esistenti tra gli id richiesti, a blocchi per restare sotto il limite di parametri di SQLite
+def _select_by_ids(db, query, ids):
+    rows = []
+    for i in range(0, len(ids), BULK_CHUNK):
+        chunk = ids[i:i + BULK_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        rows.extend(db.execute(query.format(placeholders), chunk).fetchall())
+    return rows
+
+# Approva più citazioni in attesa nella stessa transazione
+def _bulk_approve(db, ids):
+    pending = _select_by_ids(
+        db, "SELECT id, nome_completo, frase FROM quotes_da_validare WHERE id IN ({})", ids
+    )
+    to_publish, seen = [], set()
+    for q in pending:
+        fingerprint = exact_fingerprint(q['frase'])
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        existing = find_exact(db, q['frase'])
+        if existing:
+            to_publish.append((existing[0],))
+        else:
+            # Impronta nella stessa transazione, come nell'approvazione singola
+            cursor = db.execute(
+                "INSERT INTO quotes (text, author, validated) VALUES (?, ?, 1)",
+                (q['frase'], q['nome_completo'])
+            )
+            index_quote(db, cursor.lastrowid, q['frase'])
+    db.executemany("UPDATE quotes SET validated = 1 WHERE id = ?", to_publish)
+    db.executemany("DELETE FROM quotes_da_validare WHERE id = ?", [(q['id'],) for q in pending])
+    return [q['id'] for q in pending]
+
+def _bulk_reject(db, ids):
+    found = [r[0] for r in _select_by_ids(db, "SELECT id FROM quotes_da_validare WHERE id IN ({})", ids)]
+    db.executemany("DELETE FROM quotes_da_validare WHERE id = ?", [(i,) for i in found])
+    return found
+
+def _bulk_delete(db, ids):
+    found = [r[0] for r in _select_by_ids(db, "SELECT id FROM quotes WHERE id IN ({})", ids)]
+    db.executemany("DELETE FROM quotes WHERE id = ?", [(i,) for i in found])
+    return found
+
+BULK_ACTIONS = {
+    'approve': _bulk_approve,
+    'reject': _bulk_reject,
+    'delete': _bulk_delete,
+}
+
+# Moderazione massiva: {"action": "approve" | "reject" | "delete", "ids": [...]} in una sola transazione
+@app.route('/admin/bulk', methods=['POST'])
+def admin_bulk_moderate():
+    if not session.get('admin_logged_in'):
+        return jsonify({"error": "Accesso non autorizzato"}), 401
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Richiesta non valida"}), 400
+    action = data.get('action')
+    if action not in BULK_ACTIONS:
+        return jsonify({"error": "Azione non valida"}), 400
+    # Solo una lista: una stringa come "123" verrebbe letta cifra per cifra
+    raw_ids = data.get('ids')
+    if not isinstance(raw_ids, list):
+        return jsonify({"error": "Id non validi"}), 400
+    try:
+        ids = sorted({int(i) for i in raw_ids})
+    except (TypeError, ValueError):
+        return jsonify({"error": "Id non validi"}), 400
+    if not ids:
+        return jsonify({"error": "Nessuna citazione selezionata"}), 400
+    if len(ids) > BULK_MAX_IDS:
+        return jsonify({"error": f"Al massimo {BULK_MAX_IDS} citazioni per richiesta"}), 400
+    
+    db = get_db()
     
-    # Debug all'avvio e inizializzazione
+    try:
+        processed = BULK_ACTIONS[action](db, ids)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        app.logger.error(f"Errore moderazione massiva ({action}): {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    
+    # Il rifiuto tocca solo le citazioni in attesa: le frasi validate non cambiano
+    if action == 'reject':
+        for quote_id in processed:
+            quote_archive.delete(quote_id)
+    else:
+        publish_quotes_snapshot()
+    
+    missing = sorted(set(ids) - set(processed))
+    return jsonify({
+        "success": True,
+        "action": action,
+        "requested": len(ids),
+        "processed": len(processed),
+        "missing": missing
+    })
+
+# Inizializzazione una tantum: cartelle, configurazione di manutenzione, schema e migrazioni,
+# snapshot delle frasi validate. Con gunicorn (preload_app) gira nel master prima del fork:
+# i worker ereditano lo snapshot già costruito e partono pronti
+_app_ready = False
+
+def create_app():
+    global _app_ready
+    if _app_ready:
+        return app
+    os.makedirs(QUOTES_FOLDER, exist_ok=True)
+    load_maintenance_config()
     with app.app_context():
         init_db()
-        
-        # Crea la directory per i file delle frasi se non esiste
-        if not os.path.exists(QUOTES_FOLDER):
-            os.makedirs(QUOTES_FOLDER)
-            
-        db = sqlite3.connect(DATABASE)
-        tables = [r[0] for r in db.execute(
-            "SELECT name FROM sqlite_master WHERE type='table';"
-        ).fetchall()]
-        app.logger.debug(f"Tabelle presenti: {tables}")
-        # Mostra le colonne delle tabelle
-        cols_quotes = [c[1] for c in db.execute("PRAGMA table_info(quotes);").fetchall()]
-        app.logger.debug(f"Colonne in 'quotes': {cols_quotes}")
-        try:
-            cols_pending = [c[1] for c in db.execute("PRAGMA table_info(quotes_da_validare);").fetchall()]
-            app.logger.debug(f"Colonne in 'quotes_da_validare': {cols_pending}")
-        except:
-            app.logger.debug("Tabella 'quotes_da_validare' non ancora creata")
-        db.close()
-        
-        # Mostra info modalità manutenzione
-        app.logger.debug(f"Modalità manutenzione: {'Attiva' if MAINTENANCE_MODE else 'Disattivata'}")
-        if MAINTENANCE_MODE:
-            app.logger.debug(f"Messaggio manutenzione: {MAINTENANCE_MESSAGE}")
+        get_quotes_snapshot()
+    # Nessuna connessione SQLite aperta deve passare ai worker
+    close_db_pool()
+    _app_ready = True
+    return app
+
+# Thread in background del processo corrente: da chiamare in ogni worker dopo il fork
+def start_background_jobs():
+    outbox_pool.start()
+    if WRITE_BEHIND:
+        group_committer.start()
+    retention_job.start()
+    backup_manager.start()
+    card_service.start()
+    change_hub.start()
+    if METRICS_ENABLED:
+        metrics.start()
+
+# Prontezza del worker: nessun accesso al database, solo lo stato dell'inizializzazione
+@app.route('/healthz')
+def healthz():
+    if not _app_ready:
+        return jsonify({"status": "starting"}), 503
+    snapshot = _quotes_snapshot
+    return jsonify({
+        "status": "ok",
+        "pid": os.getpid(),
+        "maintenance": MAINTENANCE_MODE,
+        "quotes_version": snapshot.version if snapshot is not None else None
+    })
+
+if __name__ == '__main__':
+    create_app()
+    start_background_jobs()
+    
+    # Debug all'avvio
+    db = sqlite3.connect(DATABASE)
+    tables = [r[0] for r in db.execute(
+        "SELECT name FROM sqlite_master WHERE type='table';"
+    ).fetchall()]
+    app.logger.debug(f"Tabelle presenti: {tables}")
+    # Mostra le colonne delle tabelle
+    cols_quotes = [c[1] for c in db.execute("PRAGMA table_info(quotes);").fetchall()]
+    app.logger.debug(f"Colonne in 'quotes': {cols_quotes}")
+    cols_pending = [c[1] for c in db.execute("PRAGMA table_info(quotes_da_validare);").fetchall()]
+    app.logger.debug(f"Colonne in 'quotes_da_validare': {cols_pending}")
+    db.close()
+    
+    # Mostra info modalità manutenzione
+    app.logger.debug(f"Modalità manutenzione: {'Attiva' if MAINTENANCE_MODE else 'Disattivata'}")
+    if MAINTENANCE_MODE:
+        app.logger.debug(f"Messaggio manutenzione: {MAINTENANCE_MESSAGE}")
             
     app.run(port=5001)  # Cambia la porta a 5001 o un'altra porta libera
@@ -0,0 +1,120 @@
+# authors.py
+# Indice degli autori: una riga per autore con chiave normalizzata (la colonna generata
+# quotes.author_key, lower(trim(author))) e conteggi tenuti esatti dai trigger. Le viste "frasi di
+# un autore" e i totali per autore usano gli indici invece di scansioni complete con GROUP BY o LIKE.
+#
+# La chiave è calcolata da SQLite: i trigger non dipendono da funzioni registrate dall'applicazione
+# e funzionano anche con il client sqlite3 o con connessioni aperte da altri script.
+import string
+
+AUTHORS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS authors (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    quotes_count INTEGER NOT NULL DEFAULT 0,
+    validated_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_quotes_author_key ON quotes (author_key, id);
+CREATE TRIGGER IF NOT EXISTS authors_quotes_insert AFTER INSERT ON quotes
+BEGIN
+    INSERT INTO authors (key, name) VALUES (NEW.author_key, NEW.author) ON CONFLICT (key) DO NOTHING;
+    UPDATE authors SET quotes_count = quotes_count + 1, validated_count = validated_count + (NEW.validated = 1)
+    WHERE key = NEW.author_key;
+END;
+CREATE TRIGGER IF NOT EXISTS authors_quotes_delete AFTER DELETE ON quotes
+BEGIN
+    UPDATE authors SET quotes_count = quotes_count - 1, validated_count = validated_count - (OLD.validated = 1)
+    WHERE key = OLD.author_key;
+    DELETE FROM authors WHERE key = OLD.author_key AND quotes_count <= 0;
+END;
+CREATE TRIGGER IF NOT EXISTS authors_quotes_author AFTER UPDATE OF author ON quotes
+WHEN OLD.author_key IS NOT NEW.author_key
+BEGIN
+    UPDATE authors SET quotes_count = quotes_count - 1, validated_count = validated_count - (OLD.validated = 1)
+    WHERE key = OLD.author_key;
+    DELETE FROM authors WHERE key = OLD.author_key AND quotes_count <= 0;
+    INSERT INTO authors (key, name) VALUES (NEW.author_key, NEW.author) ON CONFLICT (key) DO NOTHING;
+    UPDATE authors SET quotes_count = quotes_count + 1, validated_count = validated_count + (NEW.validated = 1)
+    WHERE key = NEW.author_key;
+END;
+CREATE TRIGGER IF NOT EXISTS authors_quotes_validated AFTER UPDATE OF validated ON quotes
+WHEN OLD.validated IS NOT NEW.validated AND OLD.author_key IS NEW.author_key
+BEGIN
+    UPDATE authors SET validated_count = validated_count + (NEW.validated = 1) - (OLD.validated = 1)
+    WHERE key = NEW.author_key;
+END;
+'''
+
+# Versione precedente: author_id riempito dai trigger con la funzione Python author_key()
+LEGACY_AUTHORS_SCHEMA = '''
+DROP TRIGGER IF EXISTS authors_quotes_insert;
+DROP TRIGGER IF EXISTS authors_quotes_delete;
+DROP TRIGGER IF EXISTS authors_quotes_author;
+DROP TRIGGER IF EXISTS authors_quotes_validated;
+DROP INDEX IF EXISTS idx_quotes_author_id;
+DELETE FROM authors;
+'''
+
+_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Stessa chiave della colonna generata: trim() di SQLite toglie solo gli spazi e lower() cambia
+# solo le lettere ASCII. "Mario Rossi" e " mario rossi " sono lo stesso autore
+def author_key(name):
+    return (name or '').strip(' ').translate(_LOWER)
+
+# Colonna generata author_key e tabella authors; alla prima esecuzione (o passando dalla versione
+# con author_id) autori e conteggi si calcolano dai dati esistenti nella stessa transazione che crea i trigger
+def init_authors(db):
+    columns = [c[1] for c in db.execute("PRAGMA table_xinfo(quotes)").fetchall()]
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='authors'"
+    ).fetchone()
+    alter = ''
+    if 'author_key' not in columns:
+        alter = (LEGACY_AUTHORS_SCHEMA if exists else '') + \
+            ('ALTER TABLE quotes DROP COLUMN author_id;' if 'author_id' in columns else '') + \
+            'ALTER TABLE quotes ADD COLUMN author_key TEXT GENERATED ALWAYS AS (lower(trim(author))) VIRTUAL;'
+    seed = '''
+    INSERT INTO authors (key, name, quotes_count, validated_count)
+    SELECT author_key, MIN(author), COUNT(*), SUM(validated = 1) FROM quotes
+    GROUP BY author_key ORDER BY MIN(id);
+    ''' if alter or not exists else ''
+    db.executescript('BEGIN IMMEDIATE;' + alter + AUTHORS_SCHEMA + seed + 'COMMIT;')
+
+def get_author(db, author_id):
+    return db.execute(
+        "SELECT id, name, quotes_count, validated_count FROM authors WHERE id = ?", (author_id,)
+    ).fetchone()
+
+def find_author(db, name):
+    return db.execute(
+        "SELECT id, name, quotes_count, validated_count FROM authors WHERE key = ?", (author_key(name),)
+    ).fetchone()
+
+# Autori con almeno una frase validata in ordine alfabetico (per chiave), dopo la chiave after;
+# prefix filtra sull'inizio della chiave normalizzata. Paginazione keyset sull'indice UNIQUE (key)
+def list_authors(db, after=None, prefix=None, limit=100):
+    where, params = ["validated_count > 0"], []
+    if after is not None:
+        where.append("key > ?")
+        params.append(after)
+    if prefix:
+        prefix = author_key(prefix)
+        where.append("key >= ? AND key < ?")
+        params.extend([prefix, prefix + '\U0010ffff'])
+    return db.execute(
+        f"SELECT id, key, name, validated_count FROM authors WHERE {' AND '.join(where)} ORDER BY key LIMIT ?",
+        params + [limit]
+    ).fetchall()
+
+# Frasi validate di un autore per id crescente, dopo after_id, sull'indice (author_key, id)
+# (il "+" esclude l'indice su validated, che a parità di costo SQLite sceglierebbe)
+def author_quotes(db, author_id, after_id=0, limit=100):
+    row = db.execute("SELECT key FROM authors WHERE id = ?", (author_id,)).fetchone()
+    if row is None:
+        return []
+    return db.execute(
+        "SELECT id, text, author FROM quotes WHERE author_key = ? AND +validated = 1 AND id > ? ORDER BY id LIMIT ?",
+        (row[0], after_id, limit)
+    ).fetchall()
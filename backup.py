@@ -0,0 +1,429 @@
+# backup.py
+# Backup a caldo: copia del database con l'API di backup di SQLite a piccoli blocchi di pagine,
+# dentro una transazione di lettura (in WAL le scritture continuano e la copia resta quella
+# dell'istante di inizio, senza ripartire a ogni modifica). Ogni snapshot è un file
+# quotes-<data>.tar.gz con il database, maintenance_config.json, l'archivio a segmenti dei testi
+# e un manifest.json con lo SHA-256 di ogni file; accanto, <file>.sha256 (formato sha256sum).
+#
+# Uso da riga di comando:
+#   python backup.py create                  crea subito uno snapshot (e applica la rotazione)
+#   python backup.py list
+#   python backup.py verify <file>           checksum e integrity_check del database
+#   python backup.py restore <file> [--no-safety-backup] [--skip-config] [--skip-archive]
+#                                            ripristina (prima salva uno snapshot dello stato attuale)
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tarfile
+import argparse
+import tempfile
+import threading
+
+from quote_archive import SEGMENT_PATTERN
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATTERN = re.compile(r'^quotes-(\d{8}T\d{6})(\d{3})?Z\.tar\.gz$')  # Millisecondi assenti nei nomi vecchi
+MANIFEST_NAME = 'manifest.json'
+DATABASE_NAME = 'quotes.db'
+CONFIG_NAME = 'maintenance_config.json'
+ARCHIVE_PREFIX = 'archive/'
+FORMAT_VERSION = 1
+
+class BackupError(Exception):
+    pass
+
+# File che tiene lo SHA-256 di quello che ci passa: scritture (output del gzip) o letture (file sorgenti)
+class _Hashing(io.RawIOBase):
+    def __init__(self, f, limit=None):
+        self.f = f
+        self.limit = limit  # Letture: byte massimi, oltre si restituisce EOF
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.f.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def read(self, n=-1):
+        if self.limit is not None:
+            n = self.limit - self.size if n < 0 else min(n, self.limit - self.size)
+        data = self.f.read(n)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Nomi ammessi in un archivio: nient'altro viene estratto (niente percorsi assoluti o con ..)
+def _allowed_member(name):
+    if name in (DATABASE_NAME, CONFIG_NAME, MANIFEST_NAME):
+        return True
+    if name.startswith(ARCHIVE_PREFIX):
+        rest = name[len(ARCHIVE_PREFIX):]
+        return rest == 'index.dat' or bool(SEGMENT_PATTERN.match(rest))
+    return False
+
+class BackupManager:
+    # pages: pagine copiate per passo; step_sleep: pausa tra due passi (lascia I/O alle richieste)
+    def __init__(self, database, directory, archive=None, maintenance_config=None, keep=7,
+                 interval=86400, pages=256, step_sleep=0.005, compresslevel=6):
+        self.database = database
+        self.directory = directory
+        self.archive = archive
+        self.maintenance_config = maintenance_config
+        self.keep = keep  # Snapshot conservati dalla rotazione (0 = tutti)
+        self.interval = interval  # 0 = nessuno snapshot programmato
+        self.pages = pages
+        self.step_sleep = step_sleep
+        self.compresslevel = compresslevel
+        self._stop = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # Avvia il thread nel processo corrente (idempotente, da richiamare anche dopo un fork)
+    def start(self):
+        if self._pid == os.getpid() or self.interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            threading.Thread(target=self._loop, name='backup', daemon=True).start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+        self._pid = None
+
+    # Snapshot dal più vecchio al più recente (ordine della data nel nome)
+    def snapshots(self):
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for name in os.listdir(self.directory):
+            m = SNAPSHOT_PATTERN.match(name)
+            if m:
+                found.append(((m.group(1), m.group(2) or '000'), os.path.join(self.directory, name)))
+        return [path for _, path in sorted(found)]
+
+    def _due(self):
+        snapshots = self.snapshots()
+        return not snapshots or time.time() - os.path.getmtime(snapshots[-1]) >= self.interval
+
+    # Un solo worker alla volta: lock sul file .lock della cartella; chi non lo ottiene salta il giro
+    def _locked(self, blocking=True):
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                os.close(fd)
+                return None
+        return fd
+
+    def _unlock(self, fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _loop(self):
+        # Attesa iniziale sfalsata per pid, come per la pulizia periodica
+        self._stop.wait(60 + (os.getpid() % 30))
+        while not self._stop.is_set():
+            try:
+                if self._due():
+                    fd = self._locked(blocking=False)
+                    if fd is not None:
+                        try:
+                            # Ricontrollo sotto lock: un altro worker può averlo appena creato
+                            if self._due():
+                                report = self._create()
+                                logger.info(f"Backup creato: {json.dumps(report)}")
+                        finally:
+                            self._unlock(fd)
+            except Exception as e:
+                logger.error(f"Errore backup: {str(e)}")
+            self._stop.wait(min(self.interval, 300))
+
+    def create(self):
+        fd = self._locked()
+        try:
+            return self._create()
+        finally:
+            self._unlock(fd)
+
+    # Copia del database nell'istante di inizio, a blocchi di self.pages pagine
+    def _copy_database(self, target):
+        if not os.path.exists(self.database):
+            raise BackupError(f"Database {self.database} non trovato")
+        src = sqlite3.connect(self.database)
+        dst = sqlite3.connect(target)
+        steps = 0
+        try:
+            # La transazione di lettura fissa lo snapshot WAL: il backup non riparte per le scritture altrui
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+            def progress(status, remaining, total):
+                nonlocal steps
+                steps += 1
+                if remaining and self.step_sleep > 0:
+                    time.sleep(self.step_sleep)
+
+            src.backup(dst, pages=self.pages, progress=progress)
+            src.rollback()
+            # Un solo file, senza -wal: la copia si apre ovunque
+            dst.execute("PRAGMA journal_mode = DELETE")
+            check = dst.execute("PRAGMA quick_check").fetchone()[0]
+            if check != 'ok':
+                raise BackupError(f"Copia del database non valida: {check}")
+            return {
+                'pages': dst.execute("PRAGMA page_count").fetchone()[0],
+                'steps': steps,
+                'user_version': dst.execute("PRAGMA user_version").fetchone()[0],
+            }
+        finally:
+            dst.close()
+            src.close()
+
+    def _add(self, tar, name, f, size, manifest):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        reader = _Hashing(f, size)
+        tar.addfile(info, reader)
+        manifest['files'][name] = {'sha256': reader.sha256.hexdigest(), 'size': size}
+
+    def _create(self):
+        started = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        # Nome al millesimo di secondo; due snapshot nello stesso millisecondo (es. il backup di sicurezza
+        # di un restore subito dopo uno snapshot) prendono il millisecondo successivo. Si è sotto flock
+        stamp = int(started * 1000)
+        while True:
+            name = f"quotes-{time.strftime('%Y%m%dT%H%M%S', time.gmtime(stamp // 1000))}{stamp % 1000:03d}Z.tar.gz"
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(path):
+                break
+            stamp += 1
+        work = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        tmp_path = path + '.tmp'
+        try:
+            db_copy = os.path.join(work, DATABASE_NAME)
+            database = self._copy_database(db_copy)
+            manifest = {
+                'format': FORMAT_VERSION,
+                'created_at': started,
+                'sqlite_version': sqlite3.sqlite_version,
+                'database': database,
+                'files': {},
+            }
+            with open(tmp_path, 'wb') as out:
+                hashing = _Hashing(out)
+                with tarfile.open(fileobj=hashing, mode='w:gz', compresslevel=self.compresslevel) as tar:
+                    with open(db_copy, 'rb') as f:
+                        self._add(tar, DATABASE_NAME, f, os.fstat(f.fileno()).st_size, manifest)
+                    if self.maintenance_config and os.path.exists(self.maintenance_config):
+                        with open(self.maintenance_config, 'rb') as f:
+                            self._add(tar, CONFIG_NAME, f, os.fstat(f.fileno()).st_size, manifest)
+                    if self.archive is not None:
+                        files = self.archive.open_files()
+                        try:
+                            for member, f, size in files:
+                                self._add(tar, ARCHIVE_PREFIX + member, f, size, manifest)
+                        finally:
+                            for _, f, _ in files:
+                                f.close()
+                    data = json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')
+                    info = tarfile.TarInfo(MANIFEST_NAME)
+                    info.size = len(data)
+                    info.mtime = int(started)
+                    info.mode = 0o644
+                    tar.addfile(info, io.BytesIO(data))
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, path)
+            with open(path + '.sha256', 'w', encoding='utf-8') as f:
+                f.write(f"{hashing.sha256.hexdigest()}  {name}\n")
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        removed = self.rotate()
+        return {
+            'file': path,
+            'bytes': os.path.getsize(path),
+            'files': len(manifest['files']),
+            'pages': database['pages'],
+            'steps': database['steps'],
+            'rotated': [os.path.basename(p) for p in removed],
+            'seconds': round(time.time() - started, 2),
+        }
+
+    # Elimina gli snapshot più vecchi oltre i self.keep più recenti
+    def rotate(self):
+        if self.keep <= 0:
+            return []
+        removed = self.snapshots()[:-self.keep]
+        for path in removed:
+            os.remove(path)
+            if os.path.exists(path + '.sha256'):
+                os.remove(path + '.sha256')
+        return removed
+
+    # Controlla checksum del file e di ogni membro; con extract_to estrae anche i file verificati.
+    # check_db esegue PRAGMA integrity_check sul database estratto
+    def verify(self, path, check_db=True, extract_to=None):
+        sidecar = path + '.sha256'
+        if os.path.exists(sidecar):
+            with open(sidecar, encoding='utf-8') as f:
+                expected = f.read().split()[0]
+            if _sha256_file(path) != expected:
+                raise BackupError(f"Checksum di {os.path.basename(path)} non corrispondente")
+        work = extract_to or tempfile.mkdtemp(prefix='.verify-', dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            hashes = {}
+            manifest = None
+            try:
+                with tarfile.open(path, 'r:gz') as tar:
+                    for info in tar:
+                        if not info.isfile() or not _allowed_member(info.name):
+                            raise BackupError(f"Contenuto inatteso nel backup: {info.name}")
+                        src = tar.extractfile(info)
+                        if info.name == MANIFEST_NAME:
+                            manifest = json.loads(src.read().decode('utf-8'))
+                            continue
+                        target = os.path.join(work, info.name)
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        with open(target, 'wb') as out:
+                            hashing = _Hashing(out)
+                            shutil.copyfileobj(src, hashing, 1024 * 1024)
+                        hashes[info.name] = hashing.sha256.hexdigest()
+            except (tarfile.TarError, OSError, EOFError) as e:
+                raise BackupError(f"Backup illeggibile: {str(e)}")
+            if manifest is None or manifest.get('format') != FORMAT_VERSION:
+                raise BackupError("Manifest mancante o di formato non supportato")
+            expected = {name: entry['sha256'] for name, entry in manifest['files'].items()}
+            if hashes != expected:
+                bad = sorted(set(hashes) ^ set(expected) | {n for n in hashes if hashes[n] != expected.get(n)})
+                raise BackupError(f"Checksum non corrispondenti: {', '.join(bad)}")
+            if DATABASE_NAME not in hashes:
+                raise BackupError("Database mancante nel backup")
+            if check_db:
+                db = sqlite3.connect(os.path.join(work, DATABASE_NAME))
+                try:
+                    result = db.execute("PRAGMA integrity_check").fetchone()[0]
+                finally:
+                    db.close()
+                if result != 'ok':
+                    raise BackupError(f"integrity_check del database: {result}")
+            return manifest
+        finally:
+            if extract_to is None:
+                shutil.rmtree(work, ignore_errors=True)
+
+    # Ripristino a caldo: il database viene riscritto con l'API di backup (gli altri processi vedono
+    # il nuovo contenuto alla prossima transazione), configurazione e archivio sostituiti in modo atomico.
+    # Prima del ripristino, se safety_backup, si salva uno snapshot dello stato attuale
+    def restore(self, path, safety_backup=True, config=True, archive=True):
+        work = tempfile.mkdtemp(prefix='.restore-', dir=self.directory)
+        try:
+            manifest = self.verify(path, extract_to=work)
+            report = {'file': path, 'created_at': manifest['created_at']}
+            if safety_backup:
+                report['safety_backup'] = self.create()['file']
+            src = sqlite3.connect(os.path.join(work, DATABASE_NAME))
+            dst = sqlite3.connect(self.database, timeout=30)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+                src.close()
+            report['database'] = True
+            config_copy = os.path.join(work, CONFIG_NAME)
+            if config and self.maintenance_config and os.path.exists(config_copy):
+                with open(config_copy, 'rb') as f:
+                    data = f.read()
+                tmp = f"{self.maintenance_config}.{os.getpid()}.tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                try:
+                    os.replace(tmp, self.maintenance_config)
+                except OSError:
+                    # File montato direttamente come volume Docker: si riscrive al suo posto
+                    os.remove(tmp)
+                    with open(self.maintenance_config, 'wb') as f:
+                        f.write(data)
+                report['maintenance_config'] = True
+            archive_copy = os.path.join(work, ARCHIVE_PREFIX.rstrip('/'))
+            if archive and self.archive is not None and os.path.isdir(archive_copy):
+                report['archive_records'] = self.archive.replace_with(archive_copy)
+            return report
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backup e ripristino di database, configurazione e archivio")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('create', help="Crea uno snapshot")
+    sub.add_parser('list', help="Elenca gli snapshot")
+    p = sub.add_parser('verify', help="Verifica checksum e integrità di uno snapshot")
+    p.add_argument('file')
+    p = sub.add_parser('restore', help="Ripristina uno snapshot")
+    p.add_argument('file')
+    p.add_argument('--no-safety-backup', action='store_true', help="Non salva lo stato attuale prima del ripristino")
+    p.add_argument('--skip-config', action='store_true', help="Non ripristina maintenance_config.json")
+    p.add_argument('--skip-archive', action='store_true', help="Non ripristina l'archivio dei testi")
+    args = parser.parse_args(argv)
+
+    from app import backup_manager
+    try:
+        if args.command == 'create':
+            print(json.dumps(backup_manager.create(), indent=2))
+        elif args.command == 'list':
+            for path in backup_manager.snapshots():
+                print(f"{os.path.basename(path)}\t{os.path.getsize(path)}")
+        elif args.command == 'verify':
+            manifest = backup_manager.verify(args.file)
+            print(json.dumps({'ok': True, 'created_at': manifest['created_at'], 'files': len(manifest['files'])}))
+        else:
+            print(json.dumps(backup_manager.restore(
+                args.file,
+                safety_backup=not args.no_safety_backup,
+                config=not args.skip_config,
+                archive=not args.skip_archive
+            ), indent=2))
+    except BackupError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+# bench
+# Benchmark e test di carico riproducibili:
+#   bench.datagen    database sintetico di dimensione configurabile (1k, 100k, 1M citazioni, code lunghe)
+#   bench.smtp_stub  server SMTP locale che accetta e scarta le email (tiene i token di conferma)
+#   bench.runner     scenari concorrenti su /api/quotes, /submit, /conferma e dashboard admin,
+#                    con throughput e latenze p50/p95/p99 per endpoint salvati in JSON
+#
+# Esempio:
+#   python -m bench.datagen --size medium --db bench_data/quotes.db
+#   python -m bench.runner --spawn --db bench_data/quotes.db --duration 60 --concurrency 32
+#   python -m bench.runner --url http://localhost:5001 --baseline bench_results/<commit>.json
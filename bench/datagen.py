@@ -0,0 +1,150 @@
+# bench/datagen.py
+# Genera un database sintetico con lo schema completo dell'applicazione (trigger, contatori, FTS,
+# impronte) e testi deterministici a partire da un seed: due esecuzioni con gli stessi parametri
+# producono gli stessi dati, così i risultati dei benchmark sono confrontabili tra commit.
+#
+# Gli invii hanno token prevedibili (bench-<seed>-<n>): il runner usa quelli non confermati per /conferma.
+#
+# Uso:
+#   python -m bench.datagen --size small|medium|large --db bench_data/quotes.db
+#   python -m bench.datagen --quotes 250000 --pending 50000 --db bench_data/quotes.db
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DB = os.path.join(BASE_DIR, 'bench_data', 'quotes.db')
+
+# Citazioni validate, invii in attesa
+SIZES = {
+    'small': (1000, 200),
+    'medium': (100000, 20000),
+    'large': (1000000, 200000),
+}
+
+BATCH = 5000
+
+WORDS = (
+    "vita amore tempo mare cuore notte luce strada casa sogno parola silenzio vento terra fuoco "
+    "acqua cielo memoria libertà coraggio paura speranza domani ieri sempre mai forse ancora "
+    "guardare cercare trovare perdere vincere ridere piangere partire tornare restare credere "
+    "grande piccolo lungo breve vero falso nuovo vecchio primo ultimo solo insieme lontano vicino"
+).split()
+NAMES = "Marco Giulia Luca Sara Paolo Anna Davide Chiara Matteo Elena Andrea Laura Simone Marta".split()
+SURNAMES = "Rossi Bianchi Russo Ferrari Esposito Romano Colombo Ricci Marino Greco Bruno Gallo".split()
+
+def bench_token(seed, n):
+    return f"bench-{seed}-{n}"
+
+def _sentence(rng, n):
+    # Il numero progressivo rende ogni testo unico (nessun falso duplicato per dedup)
+    words = rng.choices(WORDS, k=rng.randint(6, 24))
+    return f"{' '.join(words).capitalize()} ({n})."
+
+def _author(rng):
+    return f"{rng.choice(NAMES)} {rng.choice(SURNAMES)}"
+
+BENCH_ENV = ('DATABASE_PATH', 'QUOTES_FOLDER', 'QUOTES_SNAPSHOT_DIR', 'RATE_LIMIT_DIR')
+
+# Database e cartelle dei dati accanto al file indicato. Le variabili vanno impostate prima di
+# importare app, che le legge all'avvio
+def configure_env(db_path, env=None):
+    env = os.environ if env is None else env
+    data_dir = os.path.dirname(os.path.abspath(db_path))
+    env['DATABASE_PATH'] = os.path.abspath(db_path)
+    env.setdefault('QUOTES_FOLDER', os.path.join(data_dir, 'quotes_files'))
+    env.setdefault('QUOTES_SNAPSHOT_DIR', os.path.join(data_dir, 'snapshot'))
+    env.setdefault('RATE_LIMIT_DIR', os.path.join(data_dir, 'ratelimit'))
+    return env
+
+def generate(db_path, quotes, pending, unvalidated_ratio=0.05, unconfirmed_ratio=0.5, seed=42, batch=BATCH):
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} esiste già: usare --force per rigenerarlo")
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    configure_env(db_path)
+
+    import app
+    from dedup import backfill as backfill_fingerprints, exact_fingerprint
+
+    app.init_db()
+    rng = random.Random(seed)
+    started = time.time()
+    db = app.connect_db()
+    try:
+        for start in range(0, quotes, batch):
+            rows = [
+                (_sentence(rng, n), _author(rng), 0 if rng.random() < unvalidated_ratio else 1)
+                for n in range(start, min(quotes, start + batch))
+            ]
+            db.executemany("INSERT INTO quotes (text, author, validated) VALUES (?, ?, ?)", rows)
+            db.commit()
+        backfill_fingerprints(db)
+
+        now = time.time()
+        for start in range(0, pending, batch):
+            rows = []
+            for n in range(start, min(pending, start + batch)):
+                frase = _sentence(rng, quotes + n)
+                confirmed = rng.random() >= unconfirmed_ratio
+                rows.append((
+                    _author(rng), frase, f"bench{n}@example.com",
+                    bench_token(seed, n),
+                    3 if confirmed else 0, exact_fingerprint(frase),
+                    now - rng.uniform(0, 3 * 86400)  # Entro il TTL: la pulizia periodica non li tocca
+                ))
+            db.executemany(
+                "INSERT INTO quotes_da_validare (nome_completo, frase, email, token_validazione, email_checked, "
+                "fingerprint, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            db.commit()
+        db.execute("PRAGMA optimize")
+        counts = {
+            'quotes': app.get_counts(db, 'quotes'),
+            'pending': app.get_counts(db, 'pending'),
+        }
+    finally:
+        db.close()
+    app.publish_quotes_snapshot()
+    return {
+        'db': os.path.abspath(db_path),
+        'seed': seed,
+        'quotes': quotes,
+        'pending': pending,
+        'counts': counts,
+        'bytes': os.path.getsize(db_path),
+        'seconds': round(time.time() - started, 1),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un database sintetico per i benchmark")
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--quotes', type=int, help="Citazioni (sostituisce --size)")
+    parser.add_argument('--pending', type=int, help="Invii in attesa (sostituisce --size)")
+    parser.add_argument('--unvalidated-ratio', type=float, default=0.05, help="Quota di citazioni non approvate")
+    parser.add_argument('--unconfirmed-ratio', type=float, default=0.5, help="Quota di invii non confermati")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help="Sovrascrive il database esistente")
+    args = parser.parse_args(argv)
+
+    quotes, pending = SIZES[args.size]
+    quotes = quotes if args.quotes is None else args.quotes
+    pending = pending if args.pending is None else args.pending
+    if args.force:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    try:
+        report = generate(args.db, quotes, pending, args.unvalidated_ratio, args.unconfirmed_ratio, args.seed)
+    except FileExistsError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,490 @@
+# bench/runner.py
+# Scenari di carico concorrenti sugli endpoint principali. Ogni client virtuale usa una propria
+# connessione HTTP keep-alive e sceglie a ogni iterazione uno scenario secondo i pesi di --mix:
+#   quotes          GET /api/quotes (metà delle volte con If-None-Match, come i display)
+#   quotes_page     GET /api/quotes?after_id=..., seguendo next_after_id
+#   submit          POST /submit con testi sempre nuovi
+#   conferma        GET /conferma con i token ricevuti dal server SMTP finto o presi dal database
+#   dashboard       GET /admin/dashboard con ricerca e numero di pagina
+#   dashboard_page  GET /admin/dashboard seguendo i cursori delle due liste
+#
+# Con --spawn il runner copia il database indicato in una cartella temporanea (il database di
+# partenza non cambia tra un'esecuzione e l'altra), avvia il server SMTP finto e l'applicazione con
+# i limiti di invio disattivati, e alla fine li ferma. Il risultato (throughput, latenze p50/p95/p99,
+# codici di risposta per endpoint) è salvato in JSON insieme al commit; con --baseline viene
+# confrontato con un risultato precedente e il comando esce con codice 1 se un endpoint peggiora.
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import signal
+import sqlite3
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode, urlsplit
+
+from bench.datagen import BASE_DIR, BENCH_ENV, DEFAULT_DB, WORDS, configure_env
+from bench.smtp_stub import SMTPStub
+
+RESULTS_DIR = os.path.join(BASE_DIR, 'bench_results')
+DEFAULT_MIX = 'quotes=40,quotes_page=15,submit=10,conferma=10,dashboard=10,dashboard_page=15'
+ADMIN_USERNAME = 'bench'
+ADMIN_PASSWORD = 'bench'
+
+_PENDING_CURSOR = re.compile(r'pending_after=(\d+)')
+_QUOTES_CURSOR = re.compile(r'[?&;]after=(\d+)')
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+# Connessione HTTP keep-alive con il cookie di sessione; si riconnette dopo un errore
+class Client:
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.cookie = None
+        self._conn = None
+
+    def request(self, method, path, form=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if form is not None:
+            body = urlencode(form).encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self._conn.request(method, path, body=body, headers=headers)
+            resp = self._conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+        cookie = resp.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        if resp.getheader('Connection', '').lower() == 'close':
+            self.close()
+        return resp.status, data, resp
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+# Stato condiviso della prova: token di conferma, contatori e latenze per endpoint
+class Run:
+    def __init__(self, smtp=None, tokens=(), seed=42, admin=(ADMIN_USERNAME, ADMIN_PASSWORD)):
+        self.smtp = smtp
+        self.admin = admin
+        self.tokens = list(tokens)
+        self.seed = seed
+        self.recording = False
+        self.results = {}
+        self.skipped = {}
+        self._lock = threading.Lock()
+        self._serial = 0
+
+    def serial(self):
+        with self._lock:
+            self._serial += 1
+            return self._serial
+
+    def next_token(self):
+        token = self.smtp.pop_token() if self.smtp is not None else None
+        if token is None:
+            with self._lock:
+                token = self.tokens.pop() if self.tokens else None
+        return token
+
+    def record(self, endpoint, status, seconds):
+        if not self.recording:
+            return
+        with self._lock:
+            entry = self.results.setdefault(endpoint, {'latencies': [], 'status': {}})
+            entry['latencies'].append(seconds)
+            key = str(status)
+            entry['status'][key] = entry['status'].get(key, 0) + 1
+
+    def skip(self, scenario):
+        if self.recording:
+            with self._lock:
+                self.skipped[scenario] = self.skipped.get(scenario, 0) + 1
+
+# Un client virtuale: login admin all'inizio, poi scenari a caso secondo i pesi fino alla scadenza
+class VirtualUser:
+    def __init__(self, number, base_url, run, mix):
+        self.number = number
+        self.client = Client(base_url)
+        self.run = run
+        self.rng = random.Random(run.seed * 1000 + number)
+        self.names = list(mix)
+        self.weights = [mix[n] for n in self.names]
+        self.etag = None
+        self.after_id = 0
+        self.pending_after = None
+        self.quotes_after = None
+
+    def _timed(self, endpoint, method, path, form=None, headers=None):
+        started = time.perf_counter()
+        try:
+            status, data, resp = self.client.request(method, path, form, headers)
+        except (OSError, http.client.HTTPException):
+            self.run.record(endpoint, 'error', time.perf_counter() - started)
+            return None, b'', None
+        self.run.record(endpoint, status, time.perf_counter() - started)
+        return status, data, resp
+
+    def login(self):
+        self.client.request('POST', '/admin', {'username': self.run.admin[0], 'password': self.run.admin[1]})
+
+    def quotes(self):
+        headers = {'Accept-Encoding': 'gzip'}
+        revalidate = self.etag is not None and self.rng.random() < 0.5
+        if revalidate:
+            headers['If-None-Match'] = self.etag
+        status, _, resp = self._timed(
+            'GET /api/quotes (304)' if revalidate else 'GET /api/quotes', 'GET', '/api/quotes', headers=headers
+        )
+        if status == 200:
+            self.etag = resp.getheader('ETag')
+
+    def quotes_page(self):
+        status, data, _ = self._timed(
+            'GET /api/quotes?after_id', 'GET', f'/api/quotes?after_id={self.after_id}&limit=100'
+        )
+        if status == 200:
+            self.after_id = json.loads(data).get('next_after_id') or 0
+
+    def submit(self):
+        n = self.run.serial()
+        words = ' '.join(self.rng.choices(WORDS, k=self.rng.randint(6, 20)))
+        self._timed('POST /submit', 'POST', '/submit', {
+            'nome': 'Bench',
+            'cognome': f'Utente{self.number}',
+            'frase': f"{words.capitalize()} [{self.run.seed}-{self.number}-{n}-{time.time_ns()}]",
+            'email': f'bench{self.number}-{n}@example.com',
+        })
+
+    def conferma(self):
+        token = self.run.next_token()
+        if token is None:
+            self.run.skip('conferma')
+            return
+        self._timed('GET /conferma', 'GET', '/conferma?' + urlencode({'token': token}))
+
+    def dashboard(self):
+        params = {'search': self.rng.choice(WORDS), 'page': self.rng.randint(1, 5)}
+        self._timed('GET /admin/dashboard (search)', 'GET', '/admin/dashboard?' + urlencode(params))
+
+    def dashboard_page(self):
+        params = {'pending_status': self.rng.choice(('all', 'confirmed', 'unconfirmed'))}
+        if self.pending_after:
+            params['pending_after'] = self.pending_after
+        if self.quotes_after:
+            params['after'] = self.quotes_after
+        status, data, _ = self._timed('GET /admin/dashboard (page)', 'GET', '/admin/dashboard?' + urlencode(params))
+        if status == 200:
+            text = data.decode('utf-8', 'replace')
+            m = _PENDING_CURSOR.search(text)
+            self.pending_after = int(m.group(1)) if m and self.rng.random() < 0.9 else None
+            m = _QUOTES_CURSOR.search(text)
+            self.quotes_after = int(m.group(1)) if m and self.rng.random() < 0.9 else None
+
+    def loop(self, deadline):
+        try:
+            self.login()
+        except (OSError, http.client.HTTPException):
+            pass
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(self.names, self.weights)[0])()
+        self.client.close()
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if not hasattr(VirtualUser, name) or name in ('login', 'loop'):
+            raise ValueError(f"Scenario sconosciuto: {name}")
+        if float(weight or 1) > 0:
+            mix[name] = float(weight or 1)
+    return mix
+
+def _db_tokens(db_path, seed, limit=50000):
+    if not db_path or not os.path.exists(db_path):
+        return []
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        tokens = [r[0] for r in db.execute(
+            "SELECT token_validazione FROM quotes_da_validare WHERE email_checked = 0 LIMIT ?", (limit,)
+        )]
+    finally:
+        db.close()
+    random.Random(seed).shuffle(tokens)
+    return tokens
+
+def _dataset(db_path):
+    if not db_path or not os.path.exists(db_path):
+        return None
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return {
+            'quotes': db.execute("SELECT COUNT(*) FROM quotes").fetchone()[0],
+            'pending': db.execute("SELECT COUNT(*) FROM quotes_da_validare").fetchone()[0],
+            'bytes': os.path.getsize(db_path),
+        }
+    finally:
+        db.close()
+
+def _git_commit():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BASE_DIR, capture_output=True, text=True
+        ).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# Copia coerente del database (anche con il WAL in uso) nella cartella di lavoro
+def _copy_db(src, dst):
+    source = sqlite3.connect(f"file:{src}?mode=ro", uri=True)
+    target = sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+def _wait_ready(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    client = Client(base_url, timeout=5)
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Il server è terminato con codice {process.returncode}")
+        try:
+            status, _, _ = client.request('GET', '/api/quotes?limit=1')
+            if status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Il server non risponde")
+
+# Avvia l'applicazione su una copia del database, con il server SMTP finto e senza limiti di invio
+def spawn_server(args, workdir, smtp):
+    db_path = os.path.join(workdir, 'quotes.db')
+    _copy_db(os.path.abspath(args.db), db_path)
+    env = configure_env(db_path, {k: v for k, v in os.environ.items() if k not in BENCH_ENV})
+    host, port = '127.0.0.1', args.port
+    env.update({
+        'PYTHONUNBUFFERED': '1',
+        'EMAIL_HOST': smtp.host,
+        'EMAIL_PORT': str(smtp.port),
+        'EMAIL_USE_TLS': '0',
+        'EMAIL_USER': '',
+        'SITE_URL': f'http://{host}:{port}',
+        'ADMIN_USERNAME': args.admin_user,
+        'ADMIN_PASSWORD': args.admin_password,
+        'SUBMIT_IP_PER_MINUTE': '0',
+        'SUBMIT_EMAIL_PER_HOUR': '0',
+        'CONFIRM_IP_PER_MINUTE': '0',
+        'RETENTION_INTERVAL': '0',
+    })
+    if args.server == 'gunicorn':
+        env.update({'GUNICORN_BIND': f'{host}:{port}', 'WEB_CONCURRENCY': str(args.workers)})
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-c',
+               "import app; app.create_app(); app.start_background_jobs(); "
+               f"app.app.run(host='{host}', port={port}, debug=False, threaded=True)"]
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    process = subprocess.Popen(cmd, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+                               start_new_session=True)
+    base_url = f'http://{host}:{port}'
+    try:
+        _wait_ready(base_url, process)
+    except RuntimeError:
+        stop_server(process)
+        log.close()
+        with open(os.path.join(workdir, 'server.log'), 'rb') as f:
+            sys.stderr.write(f.read().decode('utf-8', 'replace')[-4000:])
+        raise
+    return process, base_url, db_path
+
+def stop_server(process):
+    if process.poll() is None:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+def summarize(run, seconds):
+    endpoints = {}
+    for endpoint, entry in sorted(run.results.items()):
+        latencies = sorted(entry['latencies'])
+        errors = sum(n for code, n in entry['status'].items() if code == 'error' or code.startswith('5'))
+        endpoints[endpoint] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'status': entry['status'],
+            'throughput_rps': round(len(latencies) / seconds, 2),
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50) * 1000, 2),
+                'p95': round(percentile(latencies, 95) * 1000, 2),
+                'p99': round(percentile(latencies, 99) * 1000, 2),
+                'mean': round(sum(latencies) / len(latencies) * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2),
+            },
+        }
+    total = sum(e['requests'] for e in endpoints.values())
+    return endpoints, {
+        'requests': total,
+        'errors': sum(e['errors'] for e in endpoints.values()),
+        'throughput_rps': round(total / seconds, 2),
+        'skipped': run.skipped,
+    }
+
+def print_table(result, out=sys.stdout):
+    out.write(f"{'endpoint':<32}{'req':>8}{'err':>6}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}\n")
+    for endpoint, e in result['endpoints'].items():
+        lat = e['latency_ms']
+        out.write(f"{endpoint:<32}{e['requests']:>8}{e['errors']:>6}{e['throughput_rps']:>10}"
+                  f"{lat['p50']:>10}{lat['p95']:>10}{lat['p99']:>10}\n")
+    t = result['total']
+    out.write(f"{'totale':<32}{t['requests']:>8}{t['errors']:>6}{t['throughput_rps']:>10}\n")
+
+# Peggioramenti rispetto a un risultato precedente: p95 più alto o throughput più basso oltre la tolleranza
+def compare(result, baseline, tolerance):
+    regressions = []
+    for endpoint, e in result['endpoints'].items():
+        base = baseline.get('endpoints', {}).get(endpoint)
+        if not base:
+            continue
+        p95, base_p95 = e['latency_ms']['p95'], base['latency_ms']['p95']
+        if base_p95 and p95 > base_p95 * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {base_p95} -> {p95} ms")
+        rps, base_rps = e['throughput_rps'], base['throughput_rps']
+        if base_rps and rps < base_rps * (1 - tolerance):
+            regressions.append(f"{endpoint}: throughput {base_rps} -> {rps} req/s")
+        if e['errors'] > base['errors']:
+            regressions.append(f"{endpoint}: errori {base['errors']} -> {e['errors']}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test di carico sugli endpoint dell'applicazione")
+    parser.add_argument('--url', help="Applicazione già avviata (alternativa a --spawn)")
+    parser.add_argument('--spawn', action='store_true', help="Avvia applicazione e SMTP finto su una copia di --db")
+    parser.add_argument('--db', default=DEFAULT_DB, help="Database generato con bench.datagen")
+    parser.add_argument('--server', choices=('gunicorn', 'flask'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help="Worker gunicorn")
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--admin-user', default=ADMIN_USERNAME)
+    parser.add_argument('--admin-password', default=ADMIN_PASSWORD)
+    parser.add_argument('--concurrency', type=int, default=16, help="Client virtuali")
+    parser.add_argument('--duration', type=float, default=30, help="Secondi misurati")
+    parser.add_argument('--warmup', type=float, default=5, help="Secondi iniziali non misurati")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Pesi degli scenari, es. quotes=50,submit=10")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help="File JSON dei risultati (default bench_results/<commit>-<data>.json)")
+    parser.add_argument('--baseline', help="Risultato precedente da confrontare")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Peggioramento ammesso rispetto a --baseline")
+    args = parser.parse_args(argv)
+
+    if not args.spawn and not args.url:
+        parser.error("indicare --url oppure --spawn")
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.spawn and not os.path.exists(args.db):
+        parser.error(f"{args.db} non esiste: generarlo con python -m bench.datagen")
+
+    workdir = process = smtp = None
+    try:
+        if args.spawn:
+            workdir = tempfile.mkdtemp(prefix='bench-')
+            smtp = SMTPStub().start()
+            process, base_url, db_path = spawn_server(args, workdir, smtp)
+        else:
+            base_url, db_path = args.url.rstrip('/'), args.db
+        run = Run(smtp, _db_tokens(db_path, args.seed), args.seed, (args.admin_user, args.admin_password))
+        users = [VirtualUser(i, base_url, run, mix) for i in range(args.concurrency)]
+        started = time.monotonic()
+        deadline = started + args.warmup + args.duration
+        threads = [threading.Thread(target=u.loop, args=(deadline,), daemon=True) for u in users]
+        for t in threads:
+            t.start()
+        time.sleep(args.warmup)
+        run.recording = True
+        measured_from = time.monotonic()
+        for t in threads:
+            t.join()
+        run.recording = False
+        seconds = time.monotonic() - measured_from
+    finally:
+        if process is not None:
+            stop_server(process)
+        if smtp is not None:
+            smtp.stop()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    endpoints, total = summarize(run, seconds)
+    commit = _git_commit()
+    result = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {
+            'server': args.server if args.spawn else args.url,
+            'workers': args.workers if args.spawn else None,
+            'concurrency': args.concurrency,
+            'duration': round(seconds, 2),
+            'warmup': args.warmup,
+            'mix': mix,
+            'seed': args.seed,
+        },
+        'dataset': _dataset(args.db),
+        'system': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'emails_received': smtp.messages if smtp is not None else None,
+        'endpoints': endpoints,
+        'total': total,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{commit}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print_table(result)
+    print(f"Risultati salvati in {out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"PEGGIORAMENTO {line}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
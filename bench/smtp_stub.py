@@ -0,0 +1,109 @@
+# bench/smtp_stub.py
+# Server SMTP minimo per i benchmark: accetta ogni messaggio senza consegnarlo, conta i messaggi
+# e tiene i token dei link di conferma, che il runner usa per /conferma. Niente STARTTLS né
+# autenticazione: l'applicazione va avviata con EMAIL_USE_TLS=0 ed EMAIL_USER vuoto.
+#
+# Uso stand-alone:
+#   python -m bench.smtp_stub --port 2525
+import re
+import sys
+import email
+import time
+import argparse
+import threading
+import socketserver
+from collections import deque
+
+TOKEN_PATTERN = re.compile(r'/conferma\?token=([A-Za-z0-9_\-]+)')
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        stub = self.server.stub
+        self._reply('220 bench-smtp ESMTP')
+        data = None
+        while True:
+            line = self.rfile.readline(65536)
+            if not line:
+                return
+            if data is not None:
+                # Fine del messaggio: riga con il solo punto
+                if line in (b'.\r\n', b'.\n'):
+                    stub._received(b''.join(data))
+                    data = None
+                    self._reply('250 OK')
+                else:
+                    data.append(line)
+                continue
+            command = line.strip().split(b' ', 1)[0].upper()
+            if command == b'EHLO':
+                self._reply('250-bench-smtp')
+                self._reply('250 8BITMIME')
+            elif command in (b'HELO', b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self._reply('250 OK')
+            elif command == b'DATA':
+                data = []
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class SMTPStub:
+    def __init__(self, host='127.0.0.1', port=0, max_tokens=100000):
+        self._server = _Server((host, port), _Handler)
+        self._server.stub = self
+        self.host, self.port = self._server.server_address[:2]
+        self.tokens = deque(maxlen=max_tokens)
+        self.messages = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def _received(self, message):
+        with self._lock:
+            self.messages += 1
+            self.bytes += len(message)
+        # Il corpo è codificato (base64 o quoted-printable): il token si cerca nelle parti decodificate
+        for part in email.message_from_bytes(message).walk():
+            payload = part.get_payload(decode=True)
+            if payload:
+                self.tokens.extend(TOKEN_PATTERN.findall(payload.decode('utf-8', 'replace')))
+
+    def pop_token(self):
+        try:
+            return self.tokens.popleft()
+        except IndexError:
+            return None
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='smtp-stub', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Server SMTP finto per i benchmark")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    args = parser.parse_args(argv)
+    stub = SMTPStub(args.host, args.port).start()
+    print(f"SMTP in ascolto su {stub.host}:{stub.port}", flush=True)
+    try:
+        while True:
+            time.sleep(10)
+            print(f"messaggi ricevuti: {stub.messages}", flush=True)
+    except KeyboardInterrupt:
+        stub.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+# change_hub.py
+# Diffusione in tempo reale delle modifiche alle frasi (Server-Sent Events). In ogni worker un solo
+# thread controlla il database (PRAGMA data_version) e mette le nuove modifiche in un buffer
+# condiviso di dimensione fissa, già formattate come eventi SSE; ogni client tiene solo la propria
+# posizione (seq). Un client rimasto indietro oltre il buffer recupera dal database, una sola volta.
+#
+# Con il worker gthread ogni connessione occupa un thread; con moltissimi display si può usare il
+# worker gevent, dove le connessioni inattive non costano un thread ciascuna.
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = b': ping\n\n'
+RESYNC = b'event: resync\ndata: {}\n\n'
+
+class ChangeHub:
+    def __init__(self, connect, read_changes, poll_interval=0.25, heartbeat=15, buffer_size=1000,
+                 batch=500, retry=3000):
+        self.connect = connect
+        self.read_changes = read_changes  # read_changes(conn, since, limit) -> {resync, seq, changes, more}
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.buffer_size = buffer_size
+        self.batch = batch
+        self.retry = retry  # Millisecondi prima che il browser si riconnetta
+        self._cond = threading.Condition()
+        self._seqs = []
+        self._events = []
+        self._floor = None  # Il buffer contiene tutte le modifiche con floor < seq <= head
+        self._head = None
+        self._epoch = 0  # Incrementato quando il log riparte (es. database ripristinato)
+        self._clients = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # Avvia il thread di controllo nel processo corrente (idempotente, da richiamare anche dopo un fork)
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            with self._cond:
+                self._seqs, self._events = [], []
+                self._floor = self._head = None
+                self._clients = 0
+            threading.Thread(target=self._run, name='change-hub', daemon=True).start()
+            self._pid = os.getpid()
+
+    def stats(self):
+        with self._cond:
+            return {'clients': self._clients, 'head': self._head, 'floor': self._floor, 'buffered': len(self._seqs)}
+
+    @staticmethod
+    def _format(change):
+        data = json.dumps(change, ensure_ascii=False, separators=(',', ':'))
+        return f"id: {change['seq']}\ndata: {data}\n\n".encode('utf-8')
+
+    def _read_all(self, conn, since):
+        changes = []
+        while True:
+            result = self.read_changes(conn, since, self.batch)
+            if result['resync']:
+                return None, since
+            changes.extend(result['changes'])
+            since = result['seq']
+            if not result['more']:
+                return changes, since
+
+    # Stato iniziale: ultima sequenza del log e, se possibile, le ultime buffer_size modifiche già in memoria
+    def _init_head(self, conn):
+        head = conn.execute("SELECT IFNULL(MAX(seq), 0) FROM quote_changes").fetchone()[0]
+        floor = max(0, head - self.buffer_size)
+        changes, seq = self._read_all(conn, floor)
+        if changes is None:
+            floor, seq, changes = head, head, []
+        with self._cond:
+            self._floor, self._head = floor, max(head, seq)
+            self._seqs = [c['seq'] for c in changes]
+            self._events = [self._format(c) for c in changes]
+            self._cond.notify_all()
+
+    def _poll(self, conn):
+        changes, seq = self._read_all(conn, self._head)
+        if changes is None:
+            # Log ripartito da capo: tutti i client devono risincronizzarsi
+            head = conn.execute("SELECT IFNULL(MAX(seq), 0) FROM quote_changes").fetchone()[0]
+            with self._cond:
+                self._epoch += 1
+                self._seqs, self._events = [], []
+                self._floor = self._head = head
+                self._cond.notify_all()
+            return
+        if not changes:
+            return
+        with self._cond:
+            self._seqs.extend(c['seq'] for c in changes)
+            self._events.extend(self._format(c) for c in changes)
+            self._head = seq
+            excess = len(self._seqs) - self.buffer_size
+            if excess > 0:
+                self._floor = self._seqs[excess - 1]
+                del self._seqs[:excess]
+                del self._events[:excess]
+            self._cond.notify_all()
+
+    def _run(self):
+        conn = None
+        data_version = None
+        while True:
+            try:
+                if conn is None:
+                    conn = self.connect()
+                    self._init_head(conn)
+                    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+                # data_version cambia solo quando un'altra connessione fa commit: controllo quasi gratuito
+                current = conn.execute("PRAGMA data_version").fetchone()[0]
+                if current != data_version:
+                    data_version = current
+                    self._poll(conn)
+            except Exception as e:
+                logger.error(f"Errore lettura modifiche per lo stream: {str(e)}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+            time.sleep(self.poll_interval)
+
+    # Recupero dal database per un client fuori dal buffer. None se deve risincronizzarsi
+    def _backlog(self, since):
+        conn = self.connect()
+        try:
+            return self._read_all(conn, since)
+        finally:
+            conn.close()
+
+    # Generatore della risposta SSE per un client; last_id è l'ultima modifica ricevuta
+    def stream(self, last_id=None):
+        with self._cond:
+            self._clients += 1
+        try:
+            yield f"retry: {self.retry}\n\n".encode('utf-8')
+            with self._cond:
+                self._cond.wait_for(lambda: self._head is not None, self.heartbeat)
+                head, floor, epoch = self._head, self._floor, self._epoch
+            if head is None:
+                yield RESYNC
+                return
+            cursor = head if last_id is None else last_id
+            if cursor < floor or cursor > head:
+                changes, cursor = self._backlog(cursor)
+                if changes is None:
+                    yield RESYNC
+                    return
+                if changes:
+                    yield b''.join(self._format(c) for c in changes)
+
+            while True:
+                events, lagged, restarted = [], False, False
+                with self._cond:
+                    if self._epoch == epoch and self._head <= cursor:
+                        self._cond.wait(self.heartbeat)
+                    if self._epoch != epoch:
+                        restarted = True
+                    elif cursor < self._floor:
+                        lagged = True
+                    else:
+                        start = bisect.bisect_right(self._seqs, cursor)
+                        events = self._events[start:]
+                        if events:
+                            cursor = self._seqs[-1]
+                if restarted:
+                    yield RESYNC
+                    return
+                if lagged:
+                    # Client troppo lento rispetto al buffer: recupero dal database
+                    changes, cursor = self._backlog(cursor)
+                    if changes is None:
+                        yield RESYNC
+                        return
+                    if changes:
+                        yield b''.join(self._format(c) for c in changes)
+                elif events:
+                    yield b''.join(events)
+                else:
+                    yield HEARTBEAT
+        finally:
+            with self._cond:
+                self._clients -= 1
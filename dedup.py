@@ -0,0 +1,199 @@
+# dedup.py
+# Rilevamento dei duplicati: impronta esatta del testo normalizzato e firma MinHash per i
+# quasi-duplicati. La firma (one-permutation hashing su shingle di 4 caratteri) è divisa in bande
+# indicizzate (LSH): solo le citazioni con almeno una banda uguale vengono confrontate.
+import re
+import sys
+import hashlib
+import unicodedata
+from array import array
+
+SHINGLE_SIZE = 4
+MINHASH_BINS = 30
+BAND_ROWS = 3
+MINHASH_BANDS = MINHASH_BINS // BAND_ROWS
+NEAR_DUPLICATE_SIMILARITY = 0.6  # Frazione di valori MinHash uguali (stima della similarità di Jaccard)
+BACKFILL_BATCH = 1000
+
+_NON_WORD = re.compile(r'[\W_]+')
+_COMBINING = dict.fromkeys(c for c in range(sys.maxunicode + 1) if unicodedata.combining(chr(c)))
+
+DEDUP_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS quote_fingerprints (
+    quote_id INTEGER PRIMARY KEY,
+    exact INTEGER NOT NULL,
+    minhash BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_quote_fingerprints_exact ON quote_fingerprints (exact);
+CREATE TABLE IF NOT EXISTS quote_minhash_bands (
+    band INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    quote_id INTEGER NOT NULL,
+    PRIMARY KEY (band, value, quote_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_quote_minhash_bands_quote ON quote_minhash_bands (quote_id);
+CREATE TRIGGER IF NOT EXISTS quote_fingerprints_delete AFTER DELETE ON quotes
+BEGIN
+    DELETE FROM quote_fingerprints WHERE quote_id = OLD.id;
+    DELETE FROM quote_minhash_bands WHERE quote_id = OLD.id;
+END;
+'''
+
+# Minuscole, senza accenti né punteggiatura, spazi compattati
+def normalize_text(text):
+    text = unicodedata.normalize('NFKD', text.casefold()).translate(_COMBINING)
+    return _NON_WORD.sub(' ', text).strip()
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data.encode('utf-8'), digest_size=8).digest(), 'big')
+
+# SQLite memorizza interi con segno a 64 bit
+def _signed(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def exact_fingerprint(text):
+    return _signed(_hash64(normalize_text(text)))
+
+# Firma MinHash con una sola funzione di hash: i bit bassi scelgono il bin, si tiene il minimo per bin.
+# hashes: cache shingle -> hash condivisa tra più firme (gli shingle si ripetono molto tra frasi diverse)
+def minhash(text, hashes=None):
+    return _minhash(normalize_text(text), hashes)
+
+def _minhash(normalized, hashes):
+    shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(max(1, len(normalized) - SHINGLE_SIZE + 1))}
+    bins = [None] * MINHASH_BINS
+    for shingle in shingles:
+        if hashes is None:
+            h = _hash64(shingle)
+        else:
+            h = hashes.get(shingle)
+            if h is None:
+                h = hashes[shingle] = _hash64(shingle)
+        b = h % MINHASH_BINS
+        value = h >> 32
+        if bins[b] is None or value < bins[b]:
+            bins[b] = value
+    # Densificazione: un bin vuoto prende il valore del primo bin pieno successivo
+    if any(v is not None for v in bins):
+        for i in range(MINHASH_BINS):
+            if bins[i] is None:
+                j = 1
+                while bins[(i + j) % MINHASH_BINS] is None:
+                    j += 1
+                bins[i] = (bins[(i + j) % MINHASH_BINS] + j) & 0xFFFFFFFF
+    else:
+        bins = [0] * MINHASH_BINS
+    return array('I', bins)
+
+def band_values(signature):
+    return [
+        _signed(_hash64(','.join(map(str, signature[i:i + BAND_ROWS]))))
+        for i in range(0, MINHASH_BINS, BAND_ROWS)
+    ]
+
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / MINHASH_BINS
+
+# Registra (o aggiorna) l'impronta di una citazione; il commit è a carico del chiamante
+def index_quote(db, quote_id, text):
+    signature = minhash(text)
+    db.execute(
+        "INSERT OR REPLACE INTO quote_fingerprints (quote_id, exact, minhash) VALUES (?, ?, ?)",
+        (quote_id, exact_fingerprint(text), signature.tobytes())
+    )
+    db.execute("DELETE FROM quote_minhash_bands WHERE quote_id = ?", (quote_id,))
+    db.executemany(
+        "INSERT OR IGNORE INTO quote_minhash_bands (band, value, quote_id) VALUES (?, ?, ?)",
+        [(band, value, quote_id) for band, value in enumerate(band_values(signature))]
+    )
+
+# Impronte di un blocco di citazioni nuove [(quote_id, testo)] con due sole istruzioni e la cache
+# degli shingle condivisa: per importazioni e backfill, dove index_quote riga per riga costa il triplo.
+# Il commit è a carico del chiamante
+def index_quotes(db, rows):
+    hashes = {}
+    fingerprints, bands = [], []
+    for quote_id, text in rows:
+        normalized = normalize_text(text)
+        signature = _minhash(normalized, hashes)
+        fingerprints.append((quote_id, _signed(_hash64(normalized)), signature.tobytes()))
+        bands.extend((band, value, quote_id) for band, value in enumerate(band_values(signature)))
+    db.executemany(
+        "INSERT OR REPLACE INTO quote_fingerprints (quote_id, exact, minhash) VALUES (?, ?, ?)", fingerprints
+    )
+    db.executemany("INSERT OR IGNORE INTO quote_minhash_bands (band, value, quote_id) VALUES (?, ?, ?)", bands)
+
+def init_dedup(db):
+    db.executescript(DEDUP_SCHEMA)
+    # Impronta anche per le citazioni in attesa, per bloccare invii ripetuti
+    columns = [c[1] for c in db.execute("PRAGMA table_info(quotes_da_validare)").fetchall()]
+    if 'fingerprint' not in columns:
+        db.execute("ALTER TABLE quotes_da_validare ADD COLUMN fingerprint INTEGER")
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_quotes_da_validare_fingerprint ON quotes_da_validare (fingerprint)"
+    )
+    db.commit()
+    backfill(db)
+
+# Calcola le impronte mancanti (righe inserite prima dell'indice o da importazioni massive)
+def backfill(db):
+    indexed = 0
+    while True:
+        rows = db.execute(
+            "SELECT quotes.id, quotes.text FROM quotes "
+            "LEFT JOIN quote_fingerprints ON quote_fingerprints.quote_id = quotes.id "
+            "WHERE quote_fingerprints.quote_id IS NULL LIMIT ?",
+            (BACKFILL_BATCH,)
+        ).fetchall()
+        if not rows:
+            break
+        index_quotes(db, rows)
+        db.commit()
+        indexed += len(rows)
+    rows = db.execute("SELECT id, frase FROM quotes_da_validare WHERE fingerprint IS NULL").fetchall()
+    if rows:
+        db.executemany(
+            "UPDATE quotes_da_validare SET fingerprint = ? WHERE id = ?",
+            [(exact_fingerprint(r[1]), r[0]) for r in rows]
+        )
+        db.commit()
+    return indexed
+
+# Id delle citazioni con lo stesso testo normalizzato; il join con quotes esclude le impronte
+# rimaste senza citazione, che farebbero scartare un invio come duplicato di una frase inesistente
+def find_exact(db, text):
+    return [r[0] for r in db.execute(
+        "SELECT f.quote_id FROM quote_fingerprints f JOIN quotes ON quotes.id = f.quote_id "
+        "WHERE f.exact = ? ORDER BY f.quote_id",
+        (exact_fingerprint(text),)
+    ).fetchall()]
+
+# Citazioni simili: [(quote_id, similarità)] dalla più simile
+def find_similar(db, text, min_similarity=NEAR_DUPLICATE_SIMILARITY, exclude=None):
+    signature = minhash(text)
+    values = band_values(signature)
+    clauses = ' OR '.join(['(b.band = ? AND b.value = ?)'] * len(values))
+    params = [p for band, value in enumerate(values) for p in (band, value)]
+    rows = db.execute(
+        "SELECT DISTINCT f.quote_id, f.minhash FROM quote_minhash_bands b "
+        "JOIN quote_fingerprints f ON f.quote_id = b.quote_id "
+        "JOIN quotes ON quotes.id = f.quote_id WHERE " + clauses,
+        params
+    ).fetchall()
+    matches = []
+    for quote_id, blob in rows:
+        if quote_id == exclude:
+            continue
+        score = similarity(signature, array('I', blob))
+        if score >= min_similarity:
+            matches.append((quote_id, score))
+    matches.sort(key=lambda m: (-m[1], m[0]))
+    return matches
+
+# Id della citazione in attesa con lo stesso testo, se presente
+def find_pending_exact(db, text):
+    row = db.execute(
+        "SELECT id FROM quotes_da_validare WHERE fingerprint = ? AND email_checked != 3 LIMIT 1",
+        (exact_fingerprint(text),)
+    ).fetchone()
+    return row[0] if row else None
@@ -0,0 +1,138 @@
+# group_commit.py
+# Commit di gruppo per le scritture brevi e frequenti (/submit, /conferma). Le richieste accodano
+# una funzione di scrittura e aspettano il risultato; un solo thread per worker le esegue in blocco
+# dentro un'unica transazione, ognuna nel proprio SAVEPOINT, e fa un solo COMMIT (quindi un solo
+# fsync) per blocco. Il risultato arriva alla richiesta solo dopo il COMMIT: l'id generato e il
+# token restituiti al client corrispondono a righe già salvate.
+#
+# Un errore in una scrittura annulla solo il suo SAVEPOINT; un errore nel COMMIT fallisce tutto il blocco.
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class GroupCommitter:
+    # max_batch scritture per transazione; max_delay secondi di attesa massima dopo la prima scrittura
+    # del blocco. synchronous è il PRAGMA della connessione del thread: FULL = fsync a ogni commit,
+    # NORMAL = in WAL nessun fsync al commit (sicuro se crasha il processo, non se manca la corrente)
+    def __init__(self, connect, max_batch=256, max_delay=0.002, synchronous='FULL'):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.synchronous = synchronous
+        self._queue = queue.Queue()
+        self._pid = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.writes = 0
+
+    # Avvia il thread nel processo corrente (idempotente, da richiamare anche dopo un fork)
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout=5):
+        if self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._pid = None
+
+    # fn(conn) esegue le scritture senza commit e restituisce il risultato per la richiesta.
+    # Finché è in coda la scrittura si può annullare con future.cancel()
+    def submit(self, fn):
+        self.start()
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                # Prima quello che è già in coda, poi si aspetta fino alla scadenza
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _flush(self, conn, batch):
+        # Le scritture annullate da chi ha smesso di aspettare non si eseguono; le altre da qui in poi
+        # non sono più annullabili
+        batch = [(fn, future) for fn, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for i, (fn, future) in enumerate(batch):
+                conn.execute(f"SAVEPOINT w{i}")
+                try:
+                    result = fn(conn)
+                except Exception as e:
+                    conn.execute(f"ROLLBACK TO w{i}")
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+                conn.execute(f"RELEASE w{i}")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            raise
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        self.batches += 1
+        self.writes += len(batch)
+
+    def _run(self):
+        conn = None
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = self._collect(item)
+            try:
+                if conn is None:
+                    conn = self.connect()
+                    conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+                self._flush(conn, batch)
+            except Exception as e:
+                logger.error(f"Errore commit di gruppo ({len(batch)} scritture): {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                if conn is not None:
+                    conn.close()
+                conn = None
+        if conn is not None:
+            conn.close()
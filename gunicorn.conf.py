@@ -0,0 +1,55 @@
+# gunicorn.conf.py
+# Profilo di produzione: app precaricata nel master (create_app() esegue schema, migrazioni e
+# snapshot una sola volta prima del fork), worker dimensionati sui core disponibili, thread in
+# background avviati in ogni worker dopo il fork.
+#
+# Uso: gunicorn -c gunicorn.conf.py
+# Variabili: GUNICORN_BIND, GUNICORN_WORKER_CLASS (gthread, gevent o sync), WEB_CONCURRENCY (worker),
+# GUNICORN_THREADS (solo gthread), GUNICORN_WORKER_CONNECTIONS (solo gevent), GUNICORN_TIMEOUT
+import os
+import sys
+import multiprocessing
+
+_cpus = multiprocessing.cpu_count()
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5001')
+# gthread come predefinito: ogni chiamata sqlite3 è una chiamata C bloccante e sotto gevent un'attesa
+# del lock di scrittura (fino a busy_timeout) ferma tutti i greenlet del worker, stream SSE compresi.
+# gevent resta una scelta esplicita per installazioni con moltissimi display collegati in SSE, dove
+# le connessioni inattive contano più di queste pause
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+# gevent: un processo per core (più uno) gestisce da solo migliaia di connessioni (display SSE).
+# gthread/sync: la classica formula 2 x core + 1
+if worker_class == 'gevent':
+    workers = int(os.environ.get('WEB_CONCURRENCY', _cpus + 1))
+else:
+    workers = int(os.environ.get('WEB_CONCURRENCY', _cpus * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 2000))
+
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+errorlog = '-'
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+
+# Con il precaricamento l'applicazione viene importata nel master: il monkey patching di gevent va
+# fatto prima, altrimenti lock e socket creati all'import non cedono il controllo agli altri greenlet
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+# Le connessioni SQLite del master non devono essere condivise con i worker
+def pre_fork(server, worker):
+    quotes_app = sys.modules.get('app')
+    if quotes_app is not None:
+        quotes_app.close_db_pool()
+
+# Coda email, pulizia periodica, stream delle modifiche e metriche: thread propri di ogni worker
+def post_worker_init(worker):
+    quotes_app = sys.modules.get('app')
+    if quotes_app is not None:
+        quotes_app.start_background_jobs()
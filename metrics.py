@@ -0,0 +1,357 @@
+# metrics.py
+# Metriche dell'applicazione in formato Prometheus: contatori e istogrammi tenuti in memoria da
+# ogni worker, scritti periodicamente in un file per processo (metrics_<pid>.json) e sommati da
+# /metrics, così la risposta copre tutti i worker gunicorn qualunque sia quello che la serve.
+# I file dei processi terminati vengono accorpati in archived.json: i totali non tornano indietro.
+#
+# Contiene anche la connessione SQLite strumentata (tempo di ogni query, letture comprese) e il log delle
+# richieste/query lente, con i valori letterali e i parametri oscurati.
+import os
+import re
+import json
+import time
+import bisect
+import logging
+import sqlite3
+import threading
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE_NAME = 'archived.json'
+ITER_BATCH = 256  # Righe lette per blocco iterando un cursore strumentato
+
+slow_log = logging.getLogger('slow')
+
+class MetricsRegistry:
+    def __init__(self, directory, flush_interval=5.0, buckets=DEFAULT_BUCKETS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self._types = {}  # nome -> (tipo, descrizione)
+        self._counters = {}  # (nome, etichette) -> valore
+        self._histograms = {}  # (nome, etichette) -> [conteggi per bucket..., +Inf, somma]
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._thread_pid = None
+
+    def describe(self, name, kind, help_text):
+        self._types[name] = (kind, help_text)
+
+    # Dopo un fork i valori ereditati appartengono al processo padre (che ha il suo file)
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._counters, self._histograms = {}, {}
+            self._pid = os.getpid()
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._check_pid()
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            self._check_pid()
+            key = (name, labels)
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            h[bisect.bisect_left(self.buckets, value)] += 1
+            h[-1] += value
+
+    # Thread di scrittura periodica (idempotente, da richiamare anche dopo un fork)
+    def start(self):
+        if self._thread_pid == os.getpid() or self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+            self._thread_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logging.getLogger(__name__).warning(f"Scrittura metriche non riuscita: {str(e)}")
+
+    def _snapshot(self):
+        with self._lock:
+            self._check_pid()
+            return {
+                'counters': [[n, list(map(list, l)), v] for (n, l), v in self._counters.items()],
+                'histograms': [[n, list(map(list, l)), list(h)] for (n, l), h in self._histograms.items()],
+            }
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'metrics_{pid}.json')
+
+    def flush(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(os.getpid())
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._snapshot(), f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _merge(self, counters, histograms, data):
+        for name, labels, value in data.get('counters', ()):
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data.get('histograms', ()):
+            key = (name, tuple(map(tuple, labels)))
+            h = histograms.get(key)
+            if h is None:
+                histograms[key] = list(values)
+            elif len(h) == len(values):  # Bucket cambiati tra un avvio e l'altro: il dato vecchio si perde
+                for i, v in enumerate(values):
+                    h[i] += v
+
+    def _encode(self, counters, histograms):
+        return {
+            'counters': [[n, list(map(list, l)), v] for (n, l), v in counters.items()],
+            'histograms': [[n, list(map(list, l)), h] for (n, l), h in histograms.items()],
+        }
+
+    # Somma dei file di tutti i processi; quelli dei processi terminati finiscono nell'archivio
+    def aggregate(self):
+        self.flush()
+        lock_fd = os.open(os.path.join(self.directory, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            archive_path = os.path.join(self.directory, ARCHIVE_NAME)
+            archived_c, archived_h = {}, {}
+            self._merge(archived_c, archived_h, self._read(archive_path) or {})
+            live, dead = [], []
+            for name in os.listdir(self.directory):
+                m = re.match(r'^metrics_(\d+)\.json$', name)
+                if m:
+                    (live if self._alive(int(m.group(1))) else dead).append(os.path.join(self.directory, name))
+            if dead:
+                for path in dead:
+                    self._merge(archived_c, archived_h, self._read(path) or {})
+                tmp = archive_path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(self._encode(archived_c, archived_h), f, separators=(',', ':'))
+                os.replace(tmp, archive_path)
+                for path in dead:
+                    os.remove(path)
+            counters, histograms = dict(archived_c), {k: list(v) for k, v in archived_h.items()}
+            for path in live:
+                self._merge(counters, histograms, self._read(path) or {})
+            return counters, histograms
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+    def render(self):
+        counters, histograms = self.aggregate()
+        by_name = {}
+        for (name, labels), value in counters.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), values in histograms.items():
+            by_name.setdefault(name, []).append((labels, values))
+        lines = []
+        for name in sorted(by_name):
+            kind, help_text = self._types.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(by_name[name]):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                    continue
+                cumulative = 0
+                bounds = [str(b) for b in self.buckets] + ['+Inf']
+                for bound, count in zip(bounds, value[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(value[-1])}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+_STATEMENT = re.compile(r'^\s*(\w+)')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?["\[]?(\w+)', re.IGNORECASE)
+
+# Etichette di una query: tipo di istruzione e prima tabella citata (numero di combinazioni limitato)
+@lru_cache(maxsize=1024)
+def statement_labels(sql):
+    m = _STATEMENT.match(sql)
+    op = m.group(1).upper() if m else 'OTHER'
+    if op == 'PRAGMA':
+        return (('op', op), ('table', ''))
+    t = _TABLE.search(sql)
+    return (('op', op), ('table', t.group(1) if t else ''))
+
+# Testo della query senza valori letterali: stringhe e numeri diventano ?
+@lru_cache(maxsize=1024)
+def redact_sql(sql):
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])', '?', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+# Parametri ridotti a tipo e lunghezza: email, token e testi non finiscono nei log
+def redact_params(params):
+    def one(value):
+        if value is None:
+            return 'NULL'
+        if isinstance(value, (str, bytes)):
+            return f'{type(value).__name__}({len(value)})'
+        return type(value).__name__
+    if params is None:  # executemany/executescript
+        return '-'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{k}: {one(v)}' for k, v in params.items()) + '}'
+    return '[' + ', '.join(one(v) for v in params) + ']'
+
+# Connessione SQLite che misura ogni execute/executemany/executescript e lo passa a observer(sql, parametri, secondi).
+# Per le query che restituiscono righe il tempo comprende preparazione, primo passo e tutte le letture
+# successive (fetch* e iterazione): la misura si chiude quando il cursore è esaurito, chiuso, rieseguito
+# o abbandonato. Il tempo del codice chiamante tra due letture non è incluso
+def instrumented_connection(observer):
+    class InstrumentedCursor(sqlite3.Cursor):
+        _pending = None  # [sql, parametri, secondi] di una query con righe ancora da leggere
+
+        def _report(self):
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                observer(*pending)
+
+        def _executed(self, sql, parameters, seconds):
+            if self.description is None:
+                # Nessuna riga da leggere (INSERT, UPDATE, DELETE...): misura già completa
+                observer(sql, parameters, seconds)
+            else:
+                self._pending = [sql, parameters, seconds]
+
+        def _fetched(self, started, exhausted):
+            if self._pending is not None:
+                self._pending[2] += time.perf_counter() - started
+                if exhausted:
+                    self._report()
+
+        def execute(self, sql, parameters=()):
+            self._report()
+            started = time.perf_counter()
+            try:
+                super().execute(sql, parameters)
+            except BaseException:
+                observer(sql, parameters, time.perf_counter() - started)
+                raise
+            self._executed(sql, parameters, time.perf_counter() - started)
+            return self
+
+        def executemany(self, sql, seq_of_parameters):
+            self._report()
+            started = time.perf_counter()
+            try:
+                return super().executemany(sql, seq_of_parameters)
+            finally:
+                observer(sql, None, time.perf_counter() - started)
+
+        def executescript(self, script):
+            self._report()
+            started = time.perf_counter()
+            try:
+                return super().executescript(script)
+            finally:
+                observer(script, None, time.perf_counter() - started)
+
+        def fetchone(self):
+            started = time.perf_counter()
+            row = super().fetchone()
+            self._fetched(started, row is None)
+            return row
+
+        def fetchmany(self, size=None):
+            size = self.arraysize if size is None else size
+            started = time.perf_counter()
+            rows = super().fetchmany(size)
+            self._fetched(started, len(rows) < size)
+            return rows
+
+        def fetchall(self):
+            started = time.perf_counter()
+            rows = super().fetchall()
+            self._fetched(started, True)
+            return rows
+
+        # Iterazione a blocchi: un solo controllo del tempo ogni ITER_BATCH righe invece che per riga
+        def __iter__(self):
+            while True:
+                rows = self.fetchmany(ITER_BATCH)
+                yield from rows
+                if len(rows) < ITER_BATCH:
+                    return
+
+        def close(self):
+            self._report()
+            super().close()
+
+        # Cursore abbandonato con righe non lette (es. execute(...).fetchone())
+        def __del__(self):
+            try:
+                self._report()
+            except Exception:
+                pass
+
+    class InstrumentedConnection(sqlite3.Connection):
+        def cursor(self, factory=InstrumentedCursor):
+            return super().cursor(factory)
+
+        # Le scorciatoie della connessione non passano da Cursor.execute: vanno reindirizzate
+        def execute(self, sql, parameters=()):
+            return self.cursor().execute(sql, parameters)
+
+        def executemany(self, sql, seq_of_parameters):
+            return self.cursor().executemany(sql, seq_of_parameters)
+
+        def executescript(self, script):
+            return self.cursor().executescript(script)
+
+    return InstrumentedConnection
+
+def configure_slow_log(path=None):
+    if path and not any(getattr(h, 'baseFilename', None) == os.path.abspath(path) for h in slow_log.handlers):
+        handler = logging.FileHandler(path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(process)d %(message)s'))
+        slow_log.addHandler(handler)
+        slow_log.setLevel(logging.WARNING)
+    return slow_log
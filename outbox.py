@@ -0,0 +1,254 @@
+# outbox.py
+# Coda persistente delle email (tabella email_outbox) e worker in background che la
+# svuotano riutilizzando una connessione SMTP già autenticata.
+import os
+import time
+import random
+import logging
+import smtplib
+import threading
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+logger = logging.getLogger(__name__)
+
+# Stati di un messaggio
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+OUTBOX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    quote_id INTEGER,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    locked_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_status ON email_outbox (status, next_attempt_at);
+'''
+
+def init_outbox(db):
+    db.executescript(OUTBOX_SCHEMA)
+    db.commit()
+
+# Accoda un messaggio senza fare commit: va salvato nella stessa transazione del chiamante
+def enqueue_email(db, recipient, subject, body, quote_id=None):
+    now = time.time()
+    cur = db.execute(
+        "INSERT INTO email_outbox (quote_id, recipient, subject, body, next_attempt_at, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (quote_id, recipient, subject, body, now, now)
+    )
+    return cur.lastrowid
+
+# Connessione SMTP persistente: STARTTLS e login una sola volta, poi riusata per più messaggi
+class SMTPSession:
+    def __init__(self, host, port, user=None, password=None, use_tls=True, timeout=30, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._server = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                server.starttls()
+            if self.user:
+                server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+
+    def send(self, msg):
+        # I server chiudono le connessioni inattive: dopo idle_timeout si riparte da capo
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+        reused = self._server is not None
+        if not reused:
+            self._connect()
+        try:
+            self._server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError, OSError):
+            self.close()
+            if not reused:
+                raise
+            # La connessione riusata era caduta: un solo nuovo tentativo su una connessione fresca
+            self._connect()
+            self._server.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+            self._server = None
+
+# Pool di worker che consegnano i messaggi con retry e backoff esponenziale
+class OutboxWorkerPool:
+    def __init__(self, connect, smtp_factory, sender, workers=2, max_attempts=6,
+                 backoff_base=30, backoff_max=3600, lease=300, poll_interval=5.0, on_send=None):
+        self.connect = connect
+        self.smtp_factory = smtp_factory
+        self.sender = sender
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.on_send = on_send  # on_send(secondi, esito) dopo ogni tentativo: 'sent', 'refused' o 'error'
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # Avvia i thread nel processo corrente (idempotente, da richiamare anche dopo un fork)
+    def start(self):
+        if self._pid == os.getpid() or self.workers <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'outbox-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._pid = None
+
+    # Sveglia i worker dopo un nuovo inserimento
+    def notify(self):
+        self._wakeup.set()
+
+    # Prende in carico un messaggio: scaduto il lease, un messaggio 'sending' torna disponibile
+    def _claim(self, conn):
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, recipient, subject, body, attempts FROM email_outbox "
+                "WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND locked_until < ?) "
+                "ORDER BY next_attempt_at LIMIT 1",
+                (STATUS_PENDING, now, STATUS_SENDING, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE email_outbox SET status = ?, locked_until = ? WHERE id = ?",
+                    (STATUS_SENDING, now + self.lease, row[0])
+                )
+            conn.commit()
+            return row
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _build_message(self, recipient, subject, body):
+        msg = MIMEMultipart()
+        msg['From'] = self.sender
+        msg['To'] = recipient
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+        return msg
+
+    def _mark_sent(self, conn, message_id, attempts):
+        conn.execute(
+            "UPDATE email_outbox SET status = ?, attempts = ?, sent_at = ?, locked_until = NULL, last_error = NULL "
+            "WHERE id = ?",
+            (STATUS_SENT, attempts, time.time(), message_id)
+        )
+        conn.commit()
+
+    def _mark_failed(self, conn, message_id, attempts, error, permanent=False):
+        if permanent or attempts >= self.max_attempts:
+            status, next_attempt = STATUS_FAILED, time.time()
+        else:
+            # Backoff esponenziale con jitter per non ritentare tutti insieme
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+            status, next_attempt = STATUS_PENDING, time.time() + delay * random.uniform(0.8, 1.2)
+        conn.execute(
+            "UPDATE email_outbox SET status = ?, attempts = ?, next_attempt_at = ?, locked_until = NULL, last_error = ? "
+            "WHERE id = ?",
+            (status, attempts, next_attempt, str(error)[:500], message_id)
+        )
+        conn.commit()
+
+    def _deliver(self, conn, session, row):
+        message_id, recipient, subject, body, attempts = row
+        attempts += 1
+        started = time.perf_counter()
+        try:
+            session.send(self._build_message(recipient, subject, body))
+        except smtplib.SMTPRecipientsRefused as e:
+            self._observe(started, 'refused')
+            logger.error(f"Email {message_id} rifiutata dal server: {str(e)}")
+            self._mark_failed(conn, message_id, attempts, e, permanent=True)
+        except Exception as e:
+            self._observe(started, 'error')
+            session.close()
+            logger.error(f"Errore invio email {message_id} (tentativo {attempts}): {str(e)}")
+            self._mark_failed(conn, message_id, attempts, e)
+        else:
+            self._observe(started, 'sent')
+            self._mark_sent(conn, message_id, attempts)
+
+    def _observe(self, started, result):
+        if self.on_send is not None:
+            self.on_send(time.perf_counter() - started, result)
+
+    def _run(self):
+        conn = self.connect()
+        session = self.smtp_factory()
+        try:
+            while True:
+                # Azzerato prima della lettura: un notify() arrivato mentre si legge la coda non va perso.
+                # stop() imposta _stop prima di _wakeup, quindi il controllo dopo clear() non perde l'arresto
+                self._wakeup.clear()
+                if self._stop.is_set():
+                    break
+                try:
+                    row = self._claim(conn)
+                except Exception as e:
+                    logger.error(f"Errore lettura coda email: {str(e)}")
+                    row = None
+                if row is None:
+                    # Coda vuota: la connessione SMTP resta aperta per i prossimi messaggi (send()
+                    # la rinnova se è rimasta inattiva oltre idle_timeout)
+                    self._wakeup.wait(self.poll_interval)
+                    continue
+
+                try:
+                    self._deliver(conn, session, row)
+                except Exception as e:
+                    # Stato non aggiornato: il messaggio torna disponibile alla scadenza del lease
+                    logger.error(f"Errore aggiornamento coda email: {str(e)}")
+        finally:
+            session.close()
+            conn.close()
@@ -0,0 +1,456 @@
+# quote_archive.py
+# Archivio append-only del testo delle citazioni inviate: pochi file segmento al posto di un
+# file quote_<id>.txt per ogni invio.
+#
+# Formato:
+#   segment_NNNNNN.dat  record = intestazione (magic, id, lunghezza, crc32) + testo UTF-8
+#   index.dat           voci a dimensione fissa (id, segmento, offset, lunghezza); lunghezza 0 = eliminato
+#
+# Uso da riga di comando:
+#   python quote_archive.py migrate [--remove]   importa i file quote_*.txt esistenti
+#   python quote_archive.py compact              riscrive i segmenti senza le citazioni eliminate
+#   python quote_archive.py get <id>
+#   python quote_archive.py stats
+import os
+import re
+import sys
+import mmap
+import time
+import zlib
+import struct
+import argparse
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo lock tra thread dello stesso processo
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+QUOTES_FOLDER = os.environ.get('QUOTES_FOLDER', os.path.join(BASE_DIR, 'quotes_files'))  # Come in app.py
+ARCHIVE_DIR = os.path.join(QUOTES_FOLDER, 'archive')
+
+RECORD_MAGIC = b'QAR1'
+RECORD_HEADER = struct.Struct('<4sqII')  # magic, quote_id, lunghezza, crc32
+INDEX_ENTRY = struct.Struct('<qIQI')  # quote_id, segmento, offset del record, lunghezza testo
+SEGMENT_PATTERN = re.compile(r'^segment_(\d{6})\.dat$')
+QUOTE_FILE_PATTERN = re.compile(r'^quote_(\d+)\.txt$')
+
+class ArchiveError(Exception):
+    pass
+
+class QuoteArchive:
+    def __init__(self, directory=ARCHIVE_DIR, segment_size=64 * 1024 * 1024, fsync_every=32, fsync_interval=1.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_every = fsync_every  # 1 = fsync a ogni record
+        self.fsync_interval = fsync_interval
+        self.index_path = os.path.join(directory, 'index.dat')
+        self._lock = threading.RLock()
+        self._pid = None
+
+    # File aperti per processo: dopo un fork lock e descrittori vanno riaperti
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(self.directory, 'archive.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        self._index_fd = os.open(self.index_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._index = {}
+        self._index_pos = 0
+        self._segment = None
+        self._segment_fd = None
+        self._maps = {}
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._timer = None
+        self._pid = os.getpid()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f'segment_{number:06d}.dat')
+
+    def _segments(self):
+        return sorted(
+            int(m.group(1)) for m in map(SEGMENT_PATTERN.match, os.listdir(self.directory)) if m
+        )
+
+    def _flock(self):
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _funlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    # Indice riscritto da una compattazione (anche in un altro processo): si riapre e si ricarica da zero
+    def _reopen_index_if_replaced(self):
+        if os.stat(self.index_path).st_ino != os.fstat(self._index_fd).st_ino:
+            os.close(self._index_fd)
+            self._index_fd = os.open(self.index_path, os.O_RDWR | os.O_APPEND)
+            self._reset_index()
+
+    def _reset_index(self):
+        self._index = {}
+        self._index_pos = 0
+        self._close_maps()
+
+    # Legge le voci aggiunte all'indice (anche da altri processi) dall'ultima lettura
+    def _refresh_index(self):
+        self._reopen_index_if_replaced()
+        size = os.fstat(self._index_fd).st_size
+        end = size - (size - self._index_pos) % INDEX_ENTRY.size
+        if end <= self._index_pos:
+            return
+        data = os.pread(self._index_fd, end - self._index_pos, self._index_pos)
+        for quote_id, segment, offset, length in INDEX_ENTRY.iter_unpack(data):
+            if length:
+                self._index[quote_id] = (segment, offset, length)
+            else:
+                self._index.pop(quote_id, None)
+        self._index_pos = end
+
+    def _close_maps(self):
+        for m in self._maps.values():
+            m.close()
+        self._maps = {}
+
+    # Segmento attivo in scrittura; si passa al successivo quando supera segment_size
+    def _active_segment(self, record_size):
+        if self._segment is None:
+            segments = self._segments()
+            self._segment = segments[-1] if segments else 1
+        # Un altro processo può aver già aperto un segmento successivo
+        while os.path.exists(self._segment_path(self._segment + 1)):
+            self._segment += 1
+        if not os.path.exists(self._segment_path(self._segment)) and self._segment_fd is not None:
+            # Segmento rimosso da una compattazione senza record da conservare
+            os.close(self._segment_fd[1])
+            self._segment_fd = None
+            self._segment += 1
+        if self._segment_fd is None or self._segment_fd[0] != self._segment:
+            self._open_segment_fd(self._segment)
+        size = os.fstat(self._segment_fd[1]).st_size
+        if size and size + record_size > self.segment_size:
+            self._sync()
+            self._segment += 1
+            self._open_segment_fd(self._segment)
+            size = 0
+        return self._segment, size
+
+    def _open_segment_fd(self, number):
+        if self._segment_fd is not None:
+            os.close(self._segment_fd[1])
+        fd = os.open(self._segment_path(number), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._segment_fd = (number, fd)
+
+    def _sync(self):
+        if self._segment_fd is not None:
+            os.fsync(self._segment_fd[1])
+        os.fsync(self._index_fd)
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    # Aggiunge il testo di una citazione; fsync raggruppati ogni fsync_every record o fsync_interval secondi
+    def append(self, quote_id, text):
+        payload = text.encode('utf-8')
+        record = RECORD_HEADER.pack(RECORD_MAGIC, quote_id, len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            self._open()
+            self._flock()
+            try:
+                self._reopen_index_if_replaced()
+                segment, offset = self._active_segment(len(record))
+                os.write(self._segment_fd[1], record)
+                os.write(self._index_fd, INDEX_ENTRY.pack(quote_id, segment, offset, len(payload)))
+                self._pending += 1
+                if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+            finally:
+                self._funlock()
+            self._index[quote_id] = (segment, offset, len(payload))
+            self._schedule_sync()
+
+    # Segna una citazione come eliminata; lo spazio viene recuperato da compact()
+    def delete(self, quote_id):
+        with self._lock:
+            self._open()
+            self._flock()
+            try:
+                self._reopen_index_if_replaced()
+                os.write(self._index_fd, INDEX_ENTRY.pack(quote_id, 0, 0, 0))
+                self._pending += 1
+            finally:
+                self._funlock()
+            self._index.pop(quote_id, None)
+            self._schedule_sync()
+
+    # Record ancora senza fsync: un timer li sincronizza dopo fsync_interval secondi anche se non
+    # arrivano altri invii (altrimenti resterebbero in sospeso fino al prossimo append)
+    def _schedule_sync(self):
+        if self._pending and self._timer is None and self.fsync_interval > 0:
+            self._timer = threading.Timer(self.fsync_interval, self._timed_sync)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_sync(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._timer = None
+        try:
+            self.sync()
+        except OSError:
+            # Riprova al prossimo append o delete
+            pass
+
+    def sync(self):
+        with self._lock:
+            self._open()
+            if self._pending:
+                self._flock()
+                try:
+                    self._sync()
+                finally:
+                    self._funlock()
+
+    def _map(self, segment, end):
+        m = self._maps.get(segment)
+        if m is None or len(m) < end:
+            # Il segmento attivo cresce: si rimappa quando il record cade oltre la fine
+            if m is not None:
+                m.close()
+            with open(self._segment_path(segment), 'rb') as f:
+                m = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return m
+
+    # Legge il testo di una citazione tramite mmap; None se assente o eliminata
+    def get(self, quote_id):
+        with self._lock:
+            self._open()
+            entry = self._index.get(quote_id)
+            if entry is None:
+                self._refresh_index()
+                entry = self._index.get(quote_id)
+                if entry is None:
+                    return None
+            try:
+                return self._read(quote_id, *entry)
+            except (OSError, ArchiveError):
+                # Segmento rimosso da una compattazione in un altro processo: si rilegge l'indice
+                self._reset_index()
+                self._refresh_index()
+                entry = self._index.get(quote_id)
+                return self._read(quote_id, *entry) if entry else None
+
+    def _read(self, quote_id, segment, offset, length):
+        end = offset + RECORD_HEADER.size + length
+        m = self._map(segment, end)
+        magic, record_id, record_length, crc = RECORD_HEADER.unpack_from(m, offset)
+        payload = m[offset + RECORD_HEADER.size:end]
+        if magic != RECORD_MAGIC or record_id != quote_id or record_length != length or zlib.crc32(payload) != crc:
+            raise ArchiveError(f"Record corrotto per la citazione {quote_id}")
+        return payload.decode('utf-8')
+
+    def ids(self):
+        with self._lock:
+            self._open()
+            self._refresh_index()
+            return sorted(self._index)
+
+    def stats(self):
+        with self._lock:
+            self._open()
+            self._refresh_index()
+            segments = self._segments()
+            return {
+                'records': len(self._index),
+                'segments': len(segments),
+                'bytes': sum(os.path.getsize(self._segment_path(n)) for n in segments),
+                'live_bytes': sum(RECORD_HEADER.size + e[2] for e in self._index.values()),
+            }
+
+    # Riscrive i record ancora validi in segmenti nuovi e sostituisce l'indice in modo atomico.
+    # drop: id aggiuntivi da scartare (es. citazioni rifiutate non ancora segnate come eliminate)
+    def compact(self, drop=()):
+        drop = set(drop)
+        with self._lock:
+            self._open()
+            self._flock()
+            try:
+                self._sync()
+                self._refresh_index()
+                old_segments = self._segments()
+                number = (old_segments[-1] if old_segments else 0) + 1
+                entries = sorted(
+                    (e[0], e[1], e[2], quote_id) for quote_id, e in self._index.items() if quote_id not in drop
+                )
+                old_bytes = sum(os.path.getsize(self._segment_path(n)) for n in old_segments)
+                tmp_index = self.index_path + '.tmp'
+                out = None
+                out_size = 0
+                new_index = {}
+                with open(tmp_index, 'wb') as index_out:
+                    for segment, offset, length, quote_id in entries:
+                        payload = self._read(quote_id, segment, offset, length).encode('utf-8')
+                        record = RECORD_HEADER.pack(RECORD_MAGIC, quote_id, len(payload), zlib.crc32(payload)) + payload
+                        if out is None or (out_size and out_size + len(record) > self.segment_size):
+                            if out is not None:
+                                out.flush()
+                                os.fsync(out.fileno())
+                                out.close()
+                                number += 1
+                            out = open(self._segment_path(number), 'wb')
+                            out_size = 0
+                        out.write(record)
+                        index_out.write(INDEX_ENTRY.pack(quote_id, number, out_size, len(payload)))
+                        new_index[quote_id] = (number, out_size, len(payload))
+                        out_size += len(record)
+                    if out is not None:
+                        out.flush()
+                        os.fsync(out.fileno())
+                        out.close()
+                    index_out.flush()
+                    os.fsync(index_out.fileno())
+                os.replace(tmp_index, self.index_path)
+                self._close_maps()
+                if self._segment_fd is not None:
+                    os.close(self._segment_fd[1])
+                    self._segment_fd = None
+                self._segment = None
+                for n in old_segments:
+                    os.remove(self._segment_path(n))
+                os.close(self._index_fd)
+                self._index_fd = os.open(self.index_path, os.O_RDWR | os.O_APPEND)
+                dropped = len(self._index) - len(new_index)
+                self._index = new_index
+                self._index_pos = os.fstat(self._index_fd).st_size
+                new_bytes = sum(os.path.getsize(self._segment_path(n)) for n in self._segments())
+                return {
+                    'kept': len(new_index),
+                    'dropped': dropped,
+                    'bytes_reclaimed': old_bytes - new_bytes,
+                }
+            finally:
+                self._funlock()
+
+    # File dell'archivio aperti sotto lock, con la dimensione in quel momento: leggendo fino a quella
+    # dimensione si ottiene una copia coerente anche se nel frattempo si aggiungono record (append-only)
+    # o una compattazione sostituisce i file (i descrittori restano sui file vecchi).
+    # Restituisce [(nome, file, dimensione)], da chiudere a cura del chiamante
+    def open_files(self):
+        with self._lock:
+            self._open()
+            self._flock()
+            try:
+                self._sync()
+                names = [os.path.basename(self._segment_path(n)) for n in self._segments()] + ['index.dat']
+                files = []
+                for name in names:
+                    f = open(os.path.join(self.directory, name), 'rb')
+                    files.append((name, f, os.fstat(f.fileno()).st_size))
+                return files
+            finally:
+                self._funlock()
+
+    # Sostituisce il contenuto con quello di un'altra cartella (es. un backup estratto). I segmenti
+    # ricevono numeri nuovi, come in compact(): gli altri processi passano ai nuovi file da soli
+    def replace_with(self, source):
+        with self._lock:
+            self._open()
+            self._flock()
+            try:
+                self._sync()
+                old_segments = self._segments()
+                base = old_segments[-1] if old_segments else 0
+                with open(os.path.join(source, 'index.dat'), 'rb') as f:
+                    data = f.read()
+                data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+                segments = sorted(int(m.group(1)) for m in map(SEGMENT_PATTERN.match, os.listdir(source)) if m)
+                renumber = {n: base + i + 1 for i, n in enumerate(segments)}
+                entries = list(INDEX_ENTRY.iter_unpack(data))
+                for quote_id, segment, offset, length in entries:
+                    if length and segment not in renumber:
+                        raise ArchiveError(f"Segmento {segment} mancante in {source}")
+                for segment, number in renumber.items():
+                    name = os.path.basename(self._segment_path(segment))
+                    with open(os.path.join(source, name), 'rb') as src, open(self._segment_path(number), 'wb') as out:
+                        while True:
+                            chunk = src.read(1024 * 1024)
+                            if not chunk:
+                                break
+                            out.write(chunk)
+                        out.flush()
+                        os.fsync(out.fileno())
+                tmp_index = self.index_path + '.tmp'
+                with open(tmp_index, 'wb') as index_out:
+                    for quote_id, segment, offset, length in entries:
+                        index_out.write(INDEX_ENTRY.pack(quote_id, renumber.get(segment, 0), offset, length))
+                    index_out.flush()
+                    os.fsync(index_out.fileno())
+                os.replace(tmp_index, self.index_path)
+                self._close_maps()
+                if self._segment_fd is not None:
+                    os.close(self._segment_fd[1])
+                    self._segment_fd = None
+                self._segment = None
+                for n in old_segments:
+                    os.remove(self._segment_path(n))
+                os.close(self._index_fd)
+                self._index_fd = os.open(self.index_path, os.O_RDWR | os.O_APPEND)
+                self._reset_index()
+                self._refresh_index()
+                return len(self._index)
+            finally:
+                self._funlock()
+
+    # Importa i file quote_<id>.txt già presenti (una tantum), opzionalmente eliminandoli
+    def migrate(self, folder=QUOTES_FOLDER, remove=False):
+        migrated = skipped = 0
+        existing = set(self.ids())
+        files = sorted(
+            (int(m.group(1)), m.group(0)) for m in map(QUOTE_FILE_PATTERN.match, os.listdir(folder)) if m
+        )
+        for quote_id, name in files:
+            if quote_id in existing:
+                skipped += 1
+                continue
+            with open(os.path.join(folder, name), 'r', encoding='utf-8') as f:
+                self.append(quote_id, f.read())
+            migrated += 1
+        self.sync()
+        if remove:
+            for quote_id, name in files:
+                if self.get(quote_id) is not None:
+                    os.remove(os.path.join(folder, name))
+        return {'migrated': migrated, 'skipped': skipped}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archivio delle citazioni inviate")
+    parser.add_argument('--dir', default=ARCHIVE_DIR, help="Directory dell'archivio")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_migrate = sub.add_parser('migrate', help="Importa i file quote_*.txt")
+    p_migrate.add_argument('--folder', default=QUOTES_FOLDER)
+    p_migrate.add_argument('--remove', action='store_true', help="Elimina i file dopo l'importazione")
+    sub.add_parser('compact', help="Elimina dai segmenti le citazioni rifiutate")
+    p_get = sub.add_parser('get', help="Stampa il testo di una citazione")
+    p_get.add_argument('quote_id', type=int)
+    sub.add_parser('stats', help="Statistiche dell'archivio")
+    args = parser.parse_args(argv)
+
+    archive = QuoteArchive(args.dir)
+    if args.command == 'migrate':
+        print(archive.migrate(args.folder, remove=args.remove))
+    elif args.command == 'compact':
+        print(archive.compact())
+    elif args.command == 'get':
+        text = archive.get(args.quote_id)
+        if text is None:
+            print(f"Citazione {args.quote_id} non presente", file=sys.stderr)
+            return 1
+        print(text)
+    elif args.command == 'stats':
+        print(archive.stats())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,429 @@
+# quote_cards.py
+# Immagini PNG delle frasi (card) per la condivisione e per i display che non reggono l'animazione
+# di static/index.html: testo, autore e logo Rotary di static/ sui colori della pagina.
+#
+# Le card stanno in una cache su disco con limite di dimensione (LRU sul mtime), con chiave
+# SHA-256 di testo, autore e dimensioni: una frase modificata ha chiavi nuove, le vecchie card
+# escono dalla cache da sole. Il rendering avviene in un pool di thread del sistema operativo, mai
+# nel thread della richiesta: con gevent (monkey.patch_all nei worker gunicorn) i "thread" di
+# threading sono greenlet sullo stesso thread e un rendering Pillow fermerebbe tutte le richieste e
+# gli stream SSE del worker, quindi si usa il pool di thread nativi di gevent con lock e attese
+# originali. La stessa chiave non viene mai disegnata due volte (richieste in corso condivise nel
+# processo, lock su file tra i worker, ricontrollo della cache dopo il lock).
+#
+# Un solo worker alla volta segue il log delle modifiche (quote_changes) e disegna in anticipo le
+# card delle frasi approvate o modificate nelle dimensioni di sizes: a regime le richieste trovano
+# già il file pronto. Al primo avvio (o dopo un resync) si parte dalla fine del log: le frasi già
+# presenti vengono disegnate solo alla prima richiesta, non tutte insieme.
+#
+# Pillow è opzionale: senza, available è False e l'endpoint risponde 503.
+import os
+import io
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi
+    fcntl = None
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+try:
+    from gevent import monkey as _monkey
+except ImportError:
+    _monkey = None
+
+# Primitive di threading non modificate dal monkey patching: sicure tra thread nativi
+def _gevent_patched():
+    return _monkey is not None and _monkey.is_module_patched('threading')
+
+def _native(module, name):
+    if _gevent_patched():
+        return _monkey.get_original(module, name)
+    return getattr(__import__(module), name)
+
+logger = logging.getLogger(__name__)
+
+CARD_FORMAT = 1  # Da incrementare se cambia il disegno: tutte le chiavi cambiano
+LOCK_STRIPES = 64
+
+BACKGROUND = '#0050a2'
+BOX = '#ffffff'
+TEXT_COLOR = '#0c3c7c'
+AUTHOR_COLOR = '#555555'
+FOOTER = '#ffffff'
+FONT_CANDIDATES = ('DejaVuSans-BoldOblique.ttf', 'DejaVuSans-Bold.ttf', 'DejaVuSans.ttf')
+
+class CardRenderer:
+    def __init__(self, logo_path=None, font_path=None):
+        self.logo_path = logo_path
+        self.font_path = font_path
+        self._logo = None
+        self._scaled = {}  # Logo ridimensionato per dimensione: il ridimensionamento costa più del resto
+        self._local = _native('threading', 'local')()  # Font per thread: FreeType non va condiviso tra thread
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def _font(self, size):
+        fonts = getattr(self._local, 'fonts', None)
+        if fonts is None:
+            fonts = self._local.fonts = {}
+        font = fonts.get(size)
+        if font is None:
+            for candidate in ((self.font_path,) if self.font_path else ()) + FONT_CANDIDATES:
+                try:
+                    font = ImageFont.truetype(candidate, size)
+                    break
+                except OSError:
+                    continue
+            else:
+                font = ImageFont.load_default(size)
+            fonts[size] = font
+        return font
+
+    def _load_logo(self):
+        if self._logo is None and self.logo_path and os.path.exists(self.logo_path):
+            with Image.open(self.logo_path) as im:
+                self._logo = im.convert('RGBA')
+        return self._logo
+
+    # Righe del testo entro width pixel (a capo tra le parole; una parola troppo lunga resta intera)
+    @staticmethod
+    def _wrap(draw, text, font, width):
+        lines = []
+        for paragraph in text.splitlines() or ['']:
+            line = ''
+            for word in paragraph.split():
+                candidate = f'{line} {word}' if line else word
+                if line and draw.textlength(candidate, font=font) > width:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = candidate
+            lines.append(line)
+        return lines
+
+    # Carattere più grande (a passi del 10%) con cui il testo sta nel riquadro
+    def _fit(self, draw, text, width, height, start):
+        size = start
+        while True:
+            font = self._font(size)
+            lines = self._wrap(draw, text, font, width)
+            line_height = round(size * 1.25)
+            widest = max(draw.textlength(l, font=font) for l in lines)
+            if size <= 10 or (len(lines) * line_height <= height and widest <= width):
+                return font, lines, line_height
+            size = max(10, int(size * 0.9))
+
+    def render(self, text, author, width, height):
+        if Image is None:
+            raise RuntimeError("Pillow non installato")
+        image = Image.new('RGB', (width, height), BACKGROUND)
+        draw = ImageDraw.Draw(image)
+        unit = min(width, height)
+
+        # Fascia bianca in basso con il logo, come il footer della pagina dei display
+        footer_h = max(40, round(height * 0.14))
+        draw.rectangle((0, height - footer_h, width, height), fill=FOOTER)
+        logo = self._load_logo()
+        if logo is not None:
+            logo_h = round(footer_h * 0.7)
+            logo_w = min(round(logo.width * logo_h / logo.height), width - 2 * round(unit * 0.05))
+            logo_h = round(logo.height * logo_w / logo.width)
+            scaled = self._scaled.get((logo_w, logo_h))
+            if scaled is None:
+                scaled = self._scaled[(logo_w, logo_h)] = logo.resize((logo_w, logo_h), Image.LANCZOS)
+            image.paste(scaled, ((width - logo_w) // 2, height - footer_h + (footer_h - logo_h) // 2), scaled)
+
+        margin = round(unit * 0.05)
+        box = (margin, margin, width - margin, height - footer_h - margin)
+        draw.rounded_rectangle(box, radius=max(4, round(unit * 0.01)), fill=BOX)
+        padding = round(unit * 0.05)
+        inner_w = box[2] - box[0] - 2 * padding
+        inner_h = box[3] - box[1] - 2 * padding
+
+        author_size = max(10, round(unit * 0.035))
+        author_font = self._font(author_size)
+        author_line = f'— {author}'
+        author_h = round(author_size * 1.6)
+        font, lines, line_height = self._fit(
+            draw, text, inner_w, inner_h - author_h, max(12, round(unit * 0.08))
+        )
+
+        # Testo centrato nel riquadro, autore allineato a destra sotto il testo
+        block_h = len(lines) * line_height + author_h
+        y = box[1] + padding + max(0, (inner_h - block_h) // 2)
+        center = (box[0] + box[2]) / 2
+        for line in lines:
+            draw.text((center, y), line, font=font, fill=TEXT_COLOR, anchor='ma')
+            y += line_height
+        draw.text((box[2] - padding, y + round(author_size * 0.4)), author_line, font=author_font,
+                  fill=AUTHOR_COLOR, anchor='ra')
+
+        out = io.BytesIO()
+        image.save(out, 'PNG', compress_level=6)
+        return out.getvalue()
+
+class CardCache:
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._lock = _native('threading', 'Lock')()
+
+    @staticmethod
+    def key(text, author, width, height):
+        data = json.dumps([CARD_FORMAT, text, author, width, height], ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.png')
+
+    # Percorso della card se presente. Il mtime fa da ultimo accesso per l'LRU (aggiornato al massimo ogni minuto)
+    def get(self, key):
+        path = self.path(key)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        if time.time() - mtime > 60:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._written += len(data)
+            due = self._written > self.max_bytes // 10
+            if due:
+                self._written = 0
+        if due:
+            self.evict()
+        return path
+
+    def _lock_fd(self, name):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.open(os.path.join(self.directory, name), os.O_RDWR | os.O_CREAT, 0o644)
+
+    # Elimina le card usate meno di recente finché la cache non scende al 90% del limite
+    def evict(self):
+        fd = self._lock_fd('.evict.lock')
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 0  # Già in corso in un altro worker
+            files = []
+            for sub in os.scandir(self.directory):
+                if sub.is_dir():
+                    for entry in os.scandir(sub.path):
+                        if entry.name.endswith('.png'):
+                            st = entry.stat()
+                            files.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(f[1] for f in files)
+            removed = 0
+            if total > self.max_bytes:
+                files.sort()
+                target = self.max_bytes * 0.9
+                for _, size, path in files:
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    removed += 1
+            return removed
+        finally:
+            os.close(fd)
+
+    def stats(self):
+        count = size = 0
+        if os.path.isdir(self.directory):
+            for sub in os.scandir(self.directory):
+                if sub.is_dir():
+                    for entry in os.scandir(sub.path):
+                        if entry.name.endswith('.png'):
+                            count += 1
+                            size += entry.stat().st_size
+        return {'cards': count, 'bytes': size, 'max_bytes': self.max_bytes}
+
+class CardService:
+    # sizes: dimensioni disegnate in anticipo; connect/read_changes come per ChangeHub
+    # last_seq(conn): ultima sequenza del log, punto di partenza al primo avvio
+    def __init__(self, cache, renderer, sizes=(), workers=2, connect=None, read_changes=None,
+                 last_seq=None, poll_interval=1.0, batch=200):
+        self.cache = cache
+        self.renderer = renderer
+        self.sizes = list(sizes)
+        self.workers = workers
+        self.connect = connect
+        self.read_changes = read_changes
+        self.last_seq = last_seq
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self.rendered = 0
+        self._inflight = {}
+        self._executor = None
+        self._pid = None
+        self._follower_pid = None
+        self._lock = threading.Lock()  # Solo richieste e follower: i thread di rendering non lo toccano
+        self._wake = threading.Event()
+
+    @property
+    def available(self):
+        return self.renderer.available
+
+    def _pool(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Dopo un fork pool e richieste in corso del padre non valgono più
+                    if _gevent_patched():
+                        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+                        self._executor = NativeThreadPoolExecutor(self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='card-render')
+                    self._inflight = {}
+                    self._pid = os.getpid()
+        return self._executor
+
+    # Future con il percorso della card: subito pronta se è in cache, altrimenti condivisa tra
+    # tutte le richieste della stessa chiave finché il rendering non termina
+    def ensure(self, text, author, width, height):
+        key = self.cache.key(text, author, width, height)
+        path = self.cache.get(key)
+        if path is not None:
+            future = Future()
+            future.set_result(path)
+            return key, future
+        executor = self._pool()
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = executor.submit(self._render, key, text, author, width, height)
+                future.add_done_callback(lambda done: self._forget(key, done))
+        return key, future
+
+    # Senza lock: sotto gevent la callback gira nel loop, dove non si può attendere
+    def _forget(self, key, future):
+        if self._inflight.get(key) is future:
+            self._inflight.pop(key, None)
+
+    # Lock su file tra i worker (a strisce, per non creare un file per chiave). Gira in un thread
+    # del pool: l'attesa del lock non ferma le richieste del worker
+    def _render(self, key, text, author, width, height):
+        fd = self.cache._lock_fd(f'.render_{zlib.crc32(key.encode()) % LOCK_STRIPES:02d}.lock')
+        try:
+            if fcntl is not None:
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        _native('time', 'sleep')(0.02)
+            path = self.cache.get(key)
+            if path is None:
+                path = self.cache.put(key, self.renderer.render(text, author, width, height))
+                self.rendered += 1
+            return path
+        finally:
+            os.close(fd)
+
+    def prerender(self, text, author):
+        return [self.ensure(text, author, w, h)[1] for w, h in self.sizes]
+
+    # Avvia il thread che segue il log delle modifiche (idempotente, da richiamare anche dopo un fork)
+    def start(self):
+        if not self.available or not self.sizes or self.connect is None:
+            return
+        self._pool()
+        with self._lock:
+            if self._follower_pid == os.getpid():
+                return
+            self._follower_pid = os.getpid()
+        threading.Thread(target=self._follow, name='card-prerender', daemon=True).start()
+
+    # Sveglia il thread dopo una modifica fatta da questo worker
+    def notify(self):
+        self._wake.set()
+
+    def _cursor_path(self):
+        return os.path.join(self.cache.directory, '.prerender_seq')
+
+    def _save_cursor(self, since):
+        tmp = self._cursor_path() + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(str(since))
+        os.replace(tmp, self._cursor_path())
+
+    def _follow(self):
+        # Lock tenuto per tutta la vita del processo: alla sua uscita lo prende un altro worker
+        fd = self.cache._lock_fd('.prerender.lock')
+        while fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(30)
+        try:
+            with open(self._cursor_path(), encoding='utf-8') as f:
+                since = int(f.read().strip())
+        except (OSError, ValueError):
+            since = None
+        conn = None
+        while True:
+            try:
+                if conn is None:
+                    conn = self.connect()
+                if since is None:
+                    # Primo avvio o resync: nessun rendering dell'intero catalogo, si segue da qui
+                    since = self.last_seq(conn) if self.last_seq is not None else 0
+                    self._save_cursor(since)
+                page = self.read_changes(conn, since, self.batch)
+                if page['resync']:
+                    since = None
+                    continue
+                futures = []
+                for change in page['changes']:
+                    if change['op'] == 'upsert':
+                        futures.extend(self.prerender(change['quote']['text'], change['quote']['author']))
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        # Una frase che non si riesce a disegnare non blocca le successive
+                        logger.error(f"Errore rendering card: {str(e)}")
+                if page['seq'] != since:
+                    since = page['seq']
+                    self._save_cursor(since)
+                if page['more']:
+                    continue
+            except Exception as e:
+                logger.error(f"Errore rendering anticipato delle card: {str(e)}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
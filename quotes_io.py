@@ -0,0 +1,208 @@
+# quotes_io.py
+# Importazione ed esportazione massiva delle citazioni (CSV / JSONL, anche compressi con gzip).
+#
+# Esempi:
+#   python quotes_io.py import antologia.csv --validated
+#   python quotes_io.py import requests.jsonl --text-field body --author-field title
+#   python quotes_io.py export quotes.jsonl.gz --validated-only
+import os
+import sys
+import csv
+import gzip
+import json
+import time
+import argparse
+
+from app import connect_db, fts_defer, fts_index_from, init_db, publish_quotes_snapshot
+from dedup import exact_fingerprint, index_quotes
+
+PROGRESS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS import_progress (
+    source TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    imported INTEGER NOT NULL,
+    skipped INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+)
+'''
+
+EXPORT_BATCH = 1000
+
+def _open_text(path, mode):
+    if path == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+def _detect_format(path, fmt):
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'jsonl'
+
+def _read_records(f, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+    else:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+# Duplicato se il testo normalizzato ha la stessa impronta di una citazione già presente
+# (la stessa regola di /submit e dell'aggiunta dall'admin), cercata sull'indice delle impronte
+def _is_duplicate(db, fingerprint):
+    return db.execute(
+        "SELECT 1 FROM quote_fingerprints f JOIN quotes ON quotes.id = f.quote_id WHERE f.exact = ? LIMIT 1",
+        (fingerprint,)
+    ).fetchone() is not None
+
+# Importa le citazioni a blocchi di batch_size righe, una transazione per blocco.
+# La posizione raggiunta è salvata nella stessa transazione: dopo un'interruzione si riprende da lì.
+def import_quotes(path, fmt=None, text_field='text', author_field='author', validated_field='validated',
+                  default_author=None, validated=False, batch_size=5000, restart=False, db=None):
+    fmt = _detect_format(path, fmt)
+    source = os.path.abspath(path) if path != '-' else '-'
+    db = db or connect_db()
+    db.execute(PROGRESS_SCHEMA)
+    db.commit()
+
+    start = 0
+    if restart:
+        db.execute("DELETE FROM import_progress WHERE source = ?", (source,))
+        db.commit()
+    else:
+        row = db.execute("SELECT position FROM import_progress WHERE source = ?", (source,)).fetchone()
+        if row:
+            start = row[0]
+
+    imported = skipped = invalid = 0
+    position = 0
+    batch = []
+    batch_fingerprints = set()  # Impronte del blocco non ancora scritto
+    batch_skipped = 0
+    started_at = time.monotonic()
+
+    # Righe, indice full-text e impronte del blocco nella stessa transazione: una citazione importata
+    # è subito visibile alla ricerca e al controllo dei duplicati (anche dopo un'interruzione)
+    def flush():
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            last_id = db.execute("SELECT IFNULL(MAX(id), 0) FROM quotes").fetchone()[0]
+            fts_defer(db)
+            db.executemany("INSERT INTO quotes (text, author, validated) VALUES (?, ?, ?)", batch)
+            fts_index_from(db, last_id)
+            index_quotes(db, db.execute("SELECT id, text FROM quotes WHERE id > ? ORDER BY id", (last_id,)).fetchall())
+            db.execute(
+                "INSERT INTO import_progress (source, position, imported, skipped, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(source) DO UPDATE SET position = excluded.position, "
+                "imported = import_progress.imported + excluded.imported, "
+                "skipped = import_progress.skipped + excluded.skipped, updated_at = excluded.updated_at",
+                (source, position, len(batch), batch_skipped, time.time())
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        batch.clear()
+        batch_fingerprints.clear()
+
+    with _open_text(path, 'r') as f:
+        for record in _read_records(f, fmt):
+            position += 1
+            if position <= start:
+                continue
+            text = (record.get(text_field) or '').strip()
+            author = (record.get(author_field) or default_author or '').strip()
+            if not text or not author:
+                invalid += 1
+                batch_skipped += 1
+            else:
+                fingerprint = exact_fingerprint(text)
+                if fingerprint in batch_fingerprints or _is_duplicate(db, fingerprint):
+                    skipped += 1
+                    batch_skipped += 1
+                else:
+                    batch_fingerprints.add(fingerprint)
+                    is_validated = record.get(validated_field, validated)
+                    batch.append((text, author, 1 if is_validated in (True, 1, '1', 'true', 'True') else 0))
+                    imported += 1
+            if len(batch) + batch_skipped >= batch_size:
+                flush()
+                batch_skipped = 0
+        if batch or batch_skipped:
+            flush()
+    
+    # Nuovi file statici per i display se sono state importate frasi validate
+    publish_quotes_snapshot()
+
+    return {
+        'imported': imported,
+        'duplicates': skipped,
+        'invalid': invalid,
+        'resumed_from': start,
+        'seconds': round(time.monotonic() - started_at, 2),
+    }
+
+# Esporta in streaming (memoria costante) in CSV o JSONL, con gzip se il file termina in .gz
+def export_quotes(path, fmt=None, validated_only=False, db=None):
+    fmt = _detect_format(path, fmt)
+    db = db or connect_db(readonly=True)
+    query = "SELECT id, text, author, validated FROM quotes"
+    if validated_only:
+        query += " WHERE validated = 1"
+    cur = db.execute(query + " ORDER BY id")
+    count = 0
+    with _open_text(path, 'w') as f:
+        writer = csv.writer(f) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(['id', 'text', 'author', 'validated'])
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            if writer:
+                writer.writerows(tuple(r) for r in rows)
+            else:
+                f.write(''.join(
+                    json.dumps(dict(id=r[0], text=r[1], author=r[2], validated=r[3]), ensure_ascii=False) + '\n'
+                    for r in rows
+                ))
+            count += len(rows)
+    return {'exported': count}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importazione/esportazione massiva delle citazioni")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_import = sub.add_parser('import', help="Importa citazioni da CSV o JSONL")
+    p_import.add_argument('path', help="File da importare (.csv, .jsonl, anche .gz; - per stdin)")
+    p_import.add_argument('--format', choices=['csv', 'jsonl'])
+    p_import.add_argument('--text-field', default='text')
+    p_import.add_argument('--author-field', default='author')
+    p_import.add_argument('--validated-field', default='validated')
+    p_import.add_argument('--default-author', help="Autore per i record che ne sono privi")
+    p_import.add_argument('--validated', action='store_true', help="Pubblica subito le citazioni importate")
+    p_import.add_argument('--batch-size', type=int, default=5000)
+    p_import.add_argument('--restart', action='store_true', help="Ignora un'importazione interrotta e riparte da capo")
+
+    p_export = sub.add_parser('export', help="Esporta le citazioni in CSV o JSONL")
+    p_export.add_argument('path', help="File di destinazione (.csv, .jsonl, anche .gz; - per stdout)")
+    p_export.add_argument('--format', choices=['csv', 'jsonl'])
+    p_export.add_argument('--validated-only', action='store_true')
+
+    args = parser.parse_args(argv)
+    if args.command == 'import':
+        init_db()
+        result = import_quotes(
+            args.path, args.format, args.text_field, args.author_field, args.validated_field,
+            args.default_author, args.validated, args.batch_size, args.restart
+        )
+    else:
+        result = export_quotes(args.path, args.format, args.validated_only)
+    print(json.dumps(result), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
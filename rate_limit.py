@@ -0,0 +1,140 @@
+# rate_limit.py
+# Controllo di ammissione per le rotte di scrittura, condiviso tra i worker tramite file mappati
+# in memoria (mmap) e protetti da flock:
+#   TokenBucketLimiter  token bucket per chiave (IP, email), a slot fissi indirizzati dall'hash
+#   ConcurrencyLimiter  numero massimo di richieste in corso su tutti i worker
+import os
+import mmap
+import time
+import struct
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo lock tra thread dello stesso processo
+    fcntl = None
+
+BUCKET_SLOT = struct.Struct('<Qdd')  # hash della chiave, token disponibili, ultimo aggiornamento
+CONCURRENCY_SLOT = struct.Struct('<qd')  # pid, inizio della richiesta
+
+# File a dimensione fissa mappato in memoria, riaperto dopo un fork
+class _SharedFile:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(fd).st_size != self.size:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            # Dimensione cambiata (nuova configurazione): lo stato riparte da zero
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._map = mmap.mmap(fd, self.size)
+        self._pid = os.getpid()
+
+    # Sezione critica tra thread (lock) e tra processi (flock)
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self._open()
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except Exception:
+            self._lock.release()
+            raise
+        return self._map
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+def _key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big') or 1
+
+class TokenBucketLimiter:
+    # rate token al secondo, burst capacità massima. Se due chiavi finiscono nello stesso slot,
+    # lo slot passa all'ultima arrivata con il bucket pieno: con abbastanza slot è raro
+    def __init__(self, path, rate, burst, slots=4096):
+        self.rate = rate
+        self.burst = burst
+        self.slots = slots
+        self._file = _SharedFile(path, slots * BUCKET_SLOT.size)
+
+    # (ammessa, secondi da attendere prima di riprovare)
+    def acquire(self, key, cost=1.0):
+        if self.rate <= 0:
+            return True, 0.0
+        h = _key_hash(key)
+        offset = (h % self.slots) * BUCKET_SLOT.size
+        now = time.time()
+        with self._file as m:
+            slot_key, tokens, updated = BUCKET_SLOT.unpack_from(m, offset)
+            if slot_key != h:
+                tokens, updated = float(self.burst), now
+            tokens = min(float(self.burst), tokens + max(0.0, now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            BUCKET_SLOT.pack_into(m, offset, h, tokens, now)
+        return allowed, 0.0 if allowed else (cost - tokens) / self.rate
+
+class ConcurrencyLimiter:
+    # Al massimo limit richieste contemporanee. Lo slot di un processo terminato, o occupato da più
+    # di stale secondi, viene considerato libero
+    def __init__(self, path, limit, stale=60.0):
+        self.limit = limit
+        self.stale = stale
+        self._file = _SharedFile(path, max(1, limit) * CONCURRENCY_SLOT.size)
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    # Indice dello slot occupato, None se il limite è raggiunto
+    def acquire(self):
+        if self.limit <= 0:
+            return -1
+        now = time.time()
+        pid = os.getpid()
+        with self._file as m:
+            for i in range(self.limit):
+                slot_pid, started = CONCURRENCY_SLOT.unpack_from(m, i * CONCURRENCY_SLOT.size)
+                if slot_pid == 0 or now - started > self.stale or (slot_pid != pid and not self._alive(slot_pid)):
+                    CONCURRENCY_SLOT.pack_into(m, i * CONCURRENCY_SLOT.size, pid, now)
+                    return i
+        return None
+
+    def release(self, slot):
+        if slot is None or slot < 0:
+            return
+        with self._file as m:
+            # Uno slot scaduto può essere già stato riassegnato a un altro processo
+            if CONCURRENCY_SLOT.unpack_from(m, slot * CONCURRENCY_SLOT.size)[0] == os.getpid():
+                CONCURRENCY_SLOT.pack_into(m, slot * CONCURRENCY_SLOT.size, 0, 0.0)
+
+    def in_use(self):
+        now = time.time()
+        with self._file as m:
+            slots = [CONCURRENCY_SLOT.unpack_from(m, i * CONCURRENCY_SLOT.size) for i in range(self.limit)]
+        return sum(1 for pid, started in slots if pid != 0 and now - started <= self.stale and self._alive(pid))
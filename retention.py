@@ -0,0 +1,287 @@
+# retention.py
+# Pulizia periodica: invii mai confermati scaduti, invii confermati spostati nell'archivio storico
+# (o eliminati), email già consegnate, testi orfani nell'archivio e nei vecchi file quote_<id>.txt,
+# compattazione dell'archivio e recupero dello spazio del database a piccoli passi.
+#
+# Uso da riga di comando:
+#   python retention.py                         esegue subito un giro completo e stampa il report
+#   python retention.py --enable-incremental-vacuum
+#                                               attiva auto_vacuum=INCREMENTAL (esegue un VACUUM completo, una volta)
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+
+from outbox import STATUS_SENT, STATUS_FAILED
+
+logger = logging.getLogger(__name__)
+
+QUOTE_FILE_PATTERN = re.compile(r'^quote_(\d+)\.txt$')
+
+RETENTION_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS quotes_da_validare_archivio (
+    id INTEGER PRIMARY KEY,
+    nome_completo TEXT NOT NULL,
+    frase TEXT NOT NULL,
+    email TEXT NOT NULL,
+    created_at REAL,
+    archived_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS retention_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_run REAL NOT NULL DEFAULT 0,
+    last_report TEXT
+);
+INSERT OR IGNORE INTO retention_state (id, last_run) VALUES (1, 0);
+'''
+
+# Aggiunge created_at agli invii: le righe già presenti partono da adesso, così nessuna scade subito
+def init_retention(db):
+    db.executescript(RETENTION_SCHEMA)
+    columns = [c[1] for c in db.execute("PRAGMA table_info(quotes_da_validare)").fetchall()]
+    if 'created_at' not in columns:
+        db.execute("ALTER TABLE quotes_da_validare ADD COLUMN created_at REAL")
+        db.execute("UPDATE quotes_da_validare SET created_at = ? WHERE created_at IS NULL", (time.time(),))
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_quotes_da_validare_status_created ON quotes_da_validare (email_checked, created_at)"
+    )
+    db.commit()
+
+# Attiva il vacuum incrementale: cambia il formato del file, quindi richiede un VACUUM completo
+def enable_incremental_vacuum(db):
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    db.execute("VACUUM")
+    return True
+
+class RetentionJob:
+    def __init__(self, connect, archive, quotes_folder, unconfirmed_ttl=7 * 86400, confirmed_ttl=30 * 86400,
+                 confirmed_mode='archive', outbox_ttl=14 * 86400, interval=3600, chunk=500,
+                 vacuum_pages=256, compact_ratio=0.25, extra_tasks=()):
+        self.connect = connect
+        self.archive = archive
+        self.quotes_folder = quotes_folder
+        self.unconfirmed_ttl = unconfirmed_ttl
+        self.confirmed_ttl = confirmed_ttl  # 0 = gli invii confermati non vengono toccati
+        self.confirmed_mode = confirmed_mode  # 'archive' o 'purge'
+        self.outbox_ttl = outbox_ttl
+        self.interval = interval
+        self.chunk = chunk
+        self.vacuum_pages = vacuum_pages
+        self.compact_ratio = compact_ratio  # Compatta l'archivio oltre questa quota di byte eliminati
+        self.extra_tasks = list(extra_tasks)  # [(nome, funzione(db) -> numero)]
+        self._stop = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # Avvia il thread nel processo corrente (idempotente, da richiamare anche dopo un fork)
+    def start(self):
+        if self._pid == os.getpid() or self.interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            threading.Thread(target=self._loop, name='retention', daemon=True).start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+        self._pid = None
+
+    # Un solo worker per intervallo: il turno si prende con una scrittura atomica su retention_state
+    def _claim(self, db):
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            last_run = db.execute("SELECT last_run FROM retention_state WHERE id = 1").fetchone()[0]
+            if now - last_run < self.interval:
+                db.rollback()
+                return False
+            db.execute("UPDATE retention_state SET last_run = ? WHERE id = 1", (now,))
+            db.commit()
+            return True
+        except Exception:
+            db.rollback()
+            raise
+
+    def _loop(self):
+        # Attesa iniziale sfalsata per pid: i worker avviati insieme non si contendono il turno
+        self._stop.wait(30 + (os.getpid() % 30))
+        while not self._stop.is_set():
+            db = None
+            try:
+                db = self.connect()
+                if self._claim(db):
+                    self.run(db)
+            except Exception as e:
+                logger.error(f"Errore job di pulizia: {str(e)}")
+            finally:
+                if db is not None:
+                    db.close()
+            self._stop.wait(min(self.interval, 300))
+
+    # Elimina a blocchi le righe selezionate da select_ids, una transazione per blocco
+    def _delete_chunks(self, db, select_ids, params, before_delete=None):
+        removed = []
+        while True:
+            ids = [r[0] for r in db.execute(select_ids + " LIMIT ?", params + (self.chunk,)).fetchall()]
+            if not ids:
+                return removed
+            if before_delete:
+                before_delete(ids)
+            db.executemany("DELETE FROM quotes_da_validare WHERE id = ?", [(i,) for i in ids])
+            db.commit()
+            removed.extend(ids)
+
+    def expire_unconfirmed(self, db, now):
+        if self.unconfirmed_ttl <= 0:
+            return []
+        return self._delete_chunks(
+            db, "SELECT id FROM quotes_da_validare WHERE email_checked = 0 AND created_at < ?",
+            (now - self.unconfirmed_ttl,)
+        )
+
+    # Invii confermati da più di confirmed_ttl: la frase è già in quotes (copiata alla conferma),
+    # resta solo la riga di moderazione con nome ed email
+    def retire_confirmed(self, db, now):
+        if self.confirmed_ttl <= 0:
+            return []
+        select = "SELECT id FROM quotes_da_validare WHERE email_checked = 3 AND created_at < ?"
+        archive = None
+        if self.confirmed_mode == 'archive':
+            def archive(ids):
+                placeholders = ','.join('?' * len(ids))
+                db.execute(
+                    "INSERT OR REPLACE INTO quotes_da_validare_archivio "
+                    "(id, nome_completo, frase, email, created_at, archived_at) "
+                    f"SELECT id, nome_completo, frase, email, created_at, ? FROM quotes_da_validare WHERE id IN ({placeholders})",
+                    [now] + ids
+                )
+        return self._delete_chunks(db, select, (now - self.confirmed_ttl,), archive)
+
+    def prune_outbox(self, db, now):
+        if self.outbox_ttl <= 0:
+            return 0
+        cur = db.execute(
+            "DELETE FROM email_outbox WHERE status IN (?, ?) AND created_at < ?",
+            (STATUS_SENT, STATUS_FAILED, now - self.outbox_ttl)
+        )
+        db.commit()
+        return cur.rowcount
+
+    # Testi senza più una riga in attesa (approvati, rifiutati, scaduti): segnati come eliminati,
+    # poi l'archivio viene compattato se lo spazio morto supera compact_ratio.
+    # archive_ids va letto prima di pending (vedi run())
+    def clean_archive(self, archive_ids, pending):
+        orphans = [i for i in archive_ids if i not in pending]
+        for quote_id in orphans:
+            self.archive.delete(quote_id)
+        stats = self.archive.stats()
+        reclaimed = 0
+        if stats['bytes'] and (stats['bytes'] - stats['live_bytes']) / stats['bytes'] > self.compact_ratio:
+            reclaimed = self.archive.compact()['bytes_reclaimed']
+        return len(orphans), reclaimed
+
+    # Vecchi file quote_<id>.txt (precedenti all'archivio a segmenti): {id: nome}
+    def quote_files(self):
+        if not os.path.isdir(self.quotes_folder):
+            return {}
+        return {
+            int(m.group(1)): m.group(0)
+            for m in map(QUOTE_FILE_PATTERN.match, os.listdir(self.quotes_folder)) if m
+        }
+
+    # File di invii non più in attesa; files va letto prima di pending (vedi run())
+    def remove_orphan_files(self, files, pending):
+        removed = reclaimed = 0
+        for quote_id, name in files.items():
+            if quote_id not in pending:
+                path = os.path.join(self.quotes_folder, name)
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                reclaimed += size
+        return removed, reclaimed
+
+    # Spazio libero restituito al filesystem a blocchi di vacuum_pages pagine, senza bloccare le scritture a lungo
+    def reclaim_space(self, db):
+        page_size = db.execute("PRAGMA page_size").fetchone()[0]
+        freed = 0
+        if db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            while not self._stop.is_set():
+                free = db.execute("PRAGMA freelist_count").fetchone()[0]
+                if free == 0:
+                    break
+                db.execute(f"PRAGMA incremental_vacuum({min(free, self.vacuum_pages)})").fetchall()
+                db.commit()
+                freed += min(free, self.vacuum_pages)
+                time.sleep(0.05)
+        db.execute("PRAGMA optimize")
+        return freed * page_size
+
+    def run(self, db=None):
+        own = db is None
+        db = db or self.connect()
+        started = time.time()
+        try:
+            report = {
+                'expired_unconfirmed': len(self.expire_unconfirmed(db, started)),
+                'confirmed_' + ('archived' if self.confirmed_mode == 'archive' else 'purged'):
+                    len(self.retire_confirmed(db, started)),
+                'outbox_pruned': self.prune_outbox(db, started),
+            }
+            for name, task in self.extra_tasks:
+                report[name] = task(db)
+            # Prima i testi, poi le righe in attesa: il testo di un invio si scrive dopo il commit
+            # della sua riga, quindi ogni id letto qui ha già la riga se l'invio è ancora in attesa.
+            # Nell'ordine inverso un invio arrivato tra le due letture risulterebbe orfano
+            archive_ids = self.archive.ids()
+            files = self.quote_files()
+            pending = {r[0] for r in db.execute("SELECT id FROM quotes_da_validare").fetchall()}
+            report['archive_orphans'], report['archive_bytes_reclaimed'] = self.clean_archive(archive_ids, pending)
+            report['files_removed'], report['file_bytes_reclaimed'] = self.remove_orphan_files(files, pending)
+            report['db_bytes_reclaimed'] = self.reclaim_space(db)
+            report['db_free_bytes'] = (
+                db.execute("PRAGMA freelist_count").fetchone()[0] * db.execute("PRAGMA page_size").fetchone()[0]
+            )
+            report['seconds'] = round(time.time() - started, 3)
+            db.execute(
+                "UPDATE retention_state SET last_run = ?, last_report = ? WHERE id = 1",
+                (started, json.dumps(report))
+            )
+            db.commit()
+            logger.info(f"Pulizia completata: {json.dumps(report)}")
+            return report
+        finally:
+            if own:
+                db.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pulizia e compattazione di database e archivio")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="Attiva auto_vacuum=INCREMENTAL (VACUUM completo, da eseguire a sito fermo)")
+    args = parser.parse_args(argv)
+
+    from app import connect_db, init_db, retention_job
+    init_db()
+    if args.enable_incremental_vacuum:
+        db = connect_db()
+        try:
+            print(json.dumps({'enabled': enable_incremental_vacuum(db)}))
+        finally:
+            db.close()
+        return 0
+    print(json.dumps(retention_job.run(), indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
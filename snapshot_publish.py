@@ -0,0 +1,148 @@
+# snapshot_publish.py
+# Pubblicazione dell'elenco delle frasi validate come file statici versionati, già compressi,
+# serviti direttamente dal proxy (o da app.py con send_asset di static_build.py) senza passare da SQLite.
+#
+# Contenuto della cartella:
+#   quotes.<hash>.json(.gz|.br)  payload immutabile, il nome cambia a ogni modifica
+#   quotes.manifest.json         puntatore alla versione corrente (unico file da non mettere in cache)
+#
+# Uso da riga di comando:
+#   python snapshot_publish.py            pubblica lo stato corrente del database
+#   python snapshot_publish.py --show     mostra il manifest corrente
+import os
+import re
+import sys
+import json
+import gzip
+import time
+import hashlib
+import argparse
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo lock tra thread dello stesso processo
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # Variante .br opzionale: serve il pacchetto brotli
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.path.join(BASE_DIR, 'static', 'snapshot')
+MANIFEST_NAME = 'quotes.manifest.json'
+PAYLOAD_PATTERN = re.compile(r'^quotes\.([0-9a-f]{16})\.json(\.gz|\.br)?$')
+
+# Payload con hash (e sue varianti): contenuto immutabile, cache di un anno
+def is_payload(name):
+    return PAYLOAD_PATTERN.match(name) is not None
+
+# Scrittura atomica: file temporaneo nella stessa cartella e rename
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class SnapshotPublisher:
+    def __init__(self, directory=SNAPSHOT_DIR, keep=3, gzip_level=9, brotli_quality=5):
+        self.directory = directory
+        self.keep = keep  # Versioni precedenti lasciate su disco per i client che le stanno scaricando
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self._lock = threading.Lock()
+
+    def current(self):
+        try:
+            with open(self.manifest_path, 'rb') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    # Pubblica il payload se è cambiato. version è il contatore delle frasi validate: un worker
+    # rimasto indietro non sovrascrive mai il manifest scritto da uno più aggiornato
+    def publish(self, body, version=None, count=None):
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            lock_fd = os.open(os.path.join(self.directory, '.publish.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                manifest = self.current()
+                if manifest and manifest.get('hash') == digest:
+                    return manifest
+                if manifest and version is not None and (manifest.get('version') or 0) > version:
+                    return manifest
+
+                name = f"quotes.{digest}.json"
+                files = {'identity': name}
+                sizes = {'identity': len(body)}
+                variants = [('identity', name, body),
+                            ('gzip', name + '.gz', gzip.compress(body, self.gzip_level, mtime=0))]
+                if brotli is not None:
+                    variants.append(('br', name + '.br', brotli.compress(body, quality=self.brotli_quality)))
+                # Prima i payload, poi il puntatore: chi legge il manifest trova sempre i file
+                for encoding, filename, data in variants:
+                    path = os.path.join(self.directory, filename)
+                    if not os.path.exists(path):
+                        _write_atomic(path, data)
+                    files[encoding] = filename
+                    sizes[encoding] = len(data)
+
+                manifest = {
+                    'version': version,
+                    'hash': digest,
+                    'count': count,
+                    'published_at': int(time.time()),
+                    'files': files,
+                    'sizes': sizes,
+                }
+                _write_atomic(self.manifest_path, json.dumps(manifest, separators=(',', ':')).encode('utf-8'))
+                self._prune(digest)
+                return manifest
+            finally:
+                os.close(lock_fd)
+
+    # Elimina le versioni più vecchie oltre le ultime keep
+    def _prune(self, current):
+        versions = {}
+        for name in os.listdir(self.directory):
+            m = PAYLOAD_PATTERN.match(name)
+            if m and m.group(1) != current:
+                path = os.path.join(self.directory, name)
+                try:
+                    mtime = os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                versions.setdefault(m.group(1), []).append((mtime, path))
+        ordered = sorted(versions.values(), key=lambda paths: max(p[0] for p in paths), reverse=True)
+        for paths in ordered[self.keep:]:
+            for _, path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pubblicazione statica delle frasi validate")
+    parser.add_argument('--dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--show', action='store_true', help="Mostra il manifest corrente")
+    args = parser.parse_args(argv)
+
+    publisher = SnapshotPublisher(args.dir)
+    if args.show:
+        print(json.dumps(publisher.current(), indent=2))
+        return 0
+
+    from app import get_quotes_snapshot
+    snapshot = get_quotes_snapshot()
+    print(json.dumps(publisher.publish(snapshot.body, snapshot.version, len(snapshot.ids)), indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
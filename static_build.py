@@ -0,0 +1,258 @@
+# static_build.py
+# Build dei file statici: nomi con hash del contenuto, riferimenti riscritti nelle pagine HTML,
+# SVG minificati e varianti precompresse (.gz, .br) dei file di testo. Il risultato va in
+# static_build/ e viene servito da send_asset() con cache immutabile per i file con hash.
+#
+# Uso da riga di comando:
+#   python static_build.py                  costruisce static_build/ a partire da static/
+#   python static_build.py --src DIR --out DIR
+import io
+import os
+import re
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+import argparse
+import mimetypes
+import xml.etree.ElementTree as ET
+
+try:
+    import brotli
+except ImportError:  # Variante .br opzionale: serve il pacchetto brotli
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(BASE_DIR, 'static')
+BUILD_DIR = os.path.join(BASE_DIR, 'static_build')
+MANIFEST_NAME = 'assets.json'
+URL_PREFIX = '/static/'
+
+# Cartelle generate a runtime, escluse dal build
+SKIP_DIRS = {'snapshot'}
+COMPRESSIBLE = {'.html', '.css', '.js', '.svg', '.json', '.txt', '.xml'}
+MIN_COMPRESS_SIZE = 512
+SVG_PRECISION = 2  # Decimali delle coordinate: i loghi sono disegnati in unità di pixel
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+_REFERENCE = re.compile(r'''((?:src|href)\s*=\s*["']|url\(\s*["']?)([^"')\s]+)''', re.IGNORECASE)
+
+# Livelli nascosti (display="none", tipici degli export di Illustrator): rimossi se nessun
+# elemento visibile ne usa gli id (url(#id), href="#id")
+def _drop_hidden_layers(text):
+    try:
+        namespaces = [ns for _, ns in ET.iterparse(io.StringIO(text), events=('start-ns',))]
+        root = ET.fromstring(text)
+    except ET.ParseError:
+        return text
+    for prefix, uri in namespaces:
+        ET.register_namespace(prefix, uri)
+    parents = {child: parent for parent in root.iter() for child in parent}
+    removed = False
+    for el in list(root.iter()):
+        style = (el.get('style') or '').replace(' ', '')
+        if el not in parents or (el.get('display') != 'none' and 'display:none' not in style):
+            continue
+        inside = ET.tostring(el, encoding='unicode')
+        ids = [e.get('id') for e in el.iter() if e.get('id')]
+        if any(_count_refs(text, i) > _count_refs(inside, i) for i in ids):
+            continue
+        parents[el].remove(el)
+        removed = True
+    return ET.tostring(root, encoding='unicode') if removed else text
+
+def _count_refs(text, element_id):
+    return text.count(f'#{element_id})') + text.count(f'#{element_id}"')
+
+# Coordinate dei tracciati arrotondate a SVG_PRECISION decimali, senza zeri superflui
+def _round_number(m):
+    value = ('%.*f' % (SVG_PRECISION, float(m.group(0)))).rstrip('0').rstrip('.')
+    value = re.sub(r'^(-?)0\.', r'\1.', value)
+    return '0' if value in ('-0', '', '-') else value
+
+def _round_path(m):
+    if re.search(r'\d[eE]', m.group(2)):  # Notazione esponenziale: lasciata com'è
+        return m.group(0)
+    return m.group(1) + re.sub(r'-?\d*\.\d+|-?\d+', _round_number, m.group(2)) + m.group(3)
+
+# Minificazione: livelli nascosti, commenti, prologo XML/DOCTYPE, precisione e spazi superflui
+def minify_svg(data):
+    text = data.decode('utf-8')
+    text = _drop_hidden_layers(text)
+    text = re.sub(r'<!--.*?-->', '', text, flags=re.DOTALL)
+    text = re.sub(r'<\?xml.*?\?>', '', text, flags=re.DOTALL)
+    text = re.sub(r'<!DOCTYPE[^>]*>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'<metadata\b.*?</metadata>', '', text, flags=re.DOTALL)
+    text = re.sub(r'(\s(?:d|points)=")([^"]*)(")', _round_path, text)
+    if '<text' not in text:  # Nei nodi <text> gli spazi sono contenuto
+        text = re.sub(r'>\s+<', '><', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ?([,;]) ?', r'\1', text)
+    return text.strip().encode('utf-8')
+
+def _hashed_name(rel, data):
+    stem, ext = os.path.splitext(rel)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+# Varianti .gz/.br accanto al file, solo se fanno risparmiare almeno il 10%
+def _precompress(path, data):
+    written = []
+    if len(data) < MIN_COMPRESS_SIZE:
+        return written
+    variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    for ext, compressed in variants:
+        if len(compressed) < len(data) * 0.9:
+            _write(path + ext, compressed)
+            written.append(ext)
+    return written
+
+# Riscrive i riferimenti locali (relativi o /static/...) verso l'URL assoluto del file con hash.
+# Anche i link tra pagine diventano assoluti: index.html viene servito pure come /
+def _rewrite_html(text, rel_dir, assets, pages):
+    def replace(m):
+        prefix, url = m.group(1), m.group(2)
+        if re.match(r'^[a-z][a-z0-9+.-]*:|^//|^#', url, re.IGNORECASE):
+            return m.group(0)
+        path, rest = re.match(r'^([^?#]*)(.*)$', url).groups()
+        if path.startswith(URL_PREFIX):
+            rel = path[len(URL_PREFIX):]
+        elif path.startswith('/'):
+            return m.group(0)
+        else:
+            rel = os.path.normpath(os.path.join(rel_dir, path)).replace(os.sep, '/')
+        if rel in assets:
+            return prefix + URL_PREFIX + assets[rel] + rest
+        if rel in pages:
+            return prefix + URL_PREFIX + rel + rest
+        return m.group(0)
+    return _REFERENCE.sub(replace, text)
+
+def build(src=SOURCE_DIR, out=BUILD_DIR):
+    files = []
+    for root, dirs, names in os.walk(src):
+        dirs[:] = sorted(d for d in dirs if os.path.relpath(os.path.join(root, d), src) not in SKIP_DIRS)
+        for name in sorted(names):
+            if not name.startswith('.'):
+                files.append(os.path.relpath(os.path.join(root, name), src).replace(os.sep, '/'))
+
+    # Build in una cartella temporanea, poi sostituzione in blocco
+    tmp = out + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    assets = {}
+    pages = [rel for rel in files if rel.endswith('.html')]
+    stats = {'files': 0, 'bytes_in': 0, 'bytes_out': 0, 'compressed': 0}
+    for rel in files:
+        if rel in pages:
+            continue
+        with open(os.path.join(src, rel), 'rb') as f:
+            data = f.read()
+        stats['bytes_in'] += len(data)
+        if rel.endswith('.svg'):
+            data = minify_svg(data)
+        assets[rel] = _hashed_name(rel, data)
+        path = os.path.join(tmp, assets[rel])
+        _write(path, data)
+        if os.path.splitext(rel)[1] in COMPRESSIBLE:
+            stats['compressed'] += len(_precompress(path, data))
+        stats['files'] += 1
+        stats['bytes_out'] += len(data)
+
+    # Le pagine HTML mantengono il nome (sono il punto di ingresso) ma puntano ai file con hash
+    for rel in pages:
+        with open(os.path.join(src, rel), 'rb') as f:
+            data = f.read()
+        stats['bytes_in'] += len(data)
+        text = _rewrite_html(data.decode('utf-8'), os.path.dirname(rel), assets, pages)
+        data = text.encode('utf-8')
+        path = os.path.join(tmp, rel)
+        _write(path, data)
+        stats['compressed'] += len(_precompress(path, data))
+        stats['files'] += 1
+        stats['bytes_out'] += len(data)
+
+    _write(os.path.join(tmp, MANIFEST_NAME), json.dumps(assets, indent=2, sort_keys=True).encode('utf-8'))
+    old = out + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(out):
+        os.rename(out, old)
+    os.rename(tmp, out)
+    shutil.rmtree(old, ignore_errors=True)
+    return stats
+
+# Nomi dei file con hash del build corrente, ricaricati se il build viene rifatto
+_immutable = {'mtime': None, 'names': frozenset()}
+
+def _immutable_names(build_dir):
+    try:
+        mtime = os.stat(os.path.join(build_dir, MANIFEST_NAME)).st_mtime
+    except OSError:
+        return frozenset()
+    if mtime != _immutable['mtime']:
+        try:
+            with open(os.path.join(build_dir, MANIFEST_NAME), 'rb') as f:
+                names = frozenset(json.loads(f.read()).values())
+        except (OSError, ValueError):
+            names = frozenset()
+        _immutable['mtime'], _immutable['names'] = mtime, names
+    return _immutable['names']
+
+def is_built(build_dir=BUILD_DIR):
+    return os.path.isfile(os.path.join(build_dir, MANIFEST_NAME))
+
+# Risponde con un file del build, scegliendo la variante precompressa accettata dal client.
+# send_file gestisce ETag, 304 e richieste Range. None se il file non fa parte del build.
+# immutable: se None si decide dal manifest del build (file con hash)
+def send_asset(build_dir, filename, immutable=None):
+    from flask import request, send_file
+    from werkzeug.utils import safe_join
+
+    path = safe_join(build_dir, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+
+    mimetype, file_encoding = mimetypes.guess_type(filename)
+    encoding = None
+    if file_encoding:
+        # Variante .gz/.br richiesta direttamente: si serve il file compresso così com'è
+        mimetype = 'application/octet-stream'
+    else:
+        mimetype = mimetype or 'application/octet-stream'
+        for name, ext in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[name] and os.path.isfile(path + ext):
+                path, encoding = path + ext, name
+                break
+
+    resp = send_file(path, mimetype=mimetype, conditional=True)
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    if os.path.splitext(filename)[1] in COMPRESSIBLE:
+        resp.vary.add('Accept-Encoding')
+    if immutable is None:
+        immutable = filename in _immutable_names(build_dir)
+    if immutable:
+        resp.headers['Cache-Control'] = IMMUTABLE
+    else:
+        # Pagine HTML e manifest: sempre rivalidate, il contenuto può cambiare con un nuovo build
+        resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build dei file statici con hash e precompressione")
+    parser.add_argument('--src', default=SOURCE_DIR)
+    parser.add_argument('--out', default=BUILD_DIR)
+    args = parser.parse_args(argv)
+    print(json.dumps(build(args.src, args.out)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())